@@ -21,11 +21,11 @@ async def update_migration_job(id:str, job_json:dict) -> None:
         
         # job = MigrationJob(**job_json)
         # Set up DB client
-        db_client = Database.get_collection(MigrationJob.Settings.name)
+        db_client = Database.get_async_collection(MigrationJob.Settings.name)
         
         # Update
         # res = db_client.update_one({'_id': ObjectId(id) }, {"$set": {"apps": data, "status": Status.PENDING_APPROVAL.value }})
-        res = db_client.update_one({'_id': ObjectId(id) }, {"$set": job_json })
+        res = await db_client.update_one({'_id': ObjectId(id) }, {"$set": job_json })
         
         return JSONResponse(content={"message": f"Migration Job updated: {res}"})
         
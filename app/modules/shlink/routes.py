@@ -24,14 +24,14 @@ from core.config import settings
 import asyncio
 
 # from .tasks import process_short_link_visit
-from core.utils.cache import SimpleCache
+from core.utils.cache import shared_cache
 
 # Load router and define permissions at module level if required.
 router = APIRouter() #dependencies=[Depends(verify_permissions(Module.permission(PermissionsOptions.read)))])
 
 from core.utils.endpoints import CRUDJsonEndpoints
 
-shlink_cache = SimpleCache()
+shlink_cache = shared_cache('shlink')
 
 # CRUDJsonEndpoints(
 #     router = router,
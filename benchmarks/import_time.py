@@ -0,0 +1,80 @@
+"""
+Import-time benchmark of the core package, as paid on every cold start of an API or RQ worker.
+
+Imports each target in a fresh interpreter with `python -X importtime`, and sums the cumulative time of the modules
+it imports (the interpreter's own startup imports excluded), keeping the fastest of --repeat runs. Fails when a target
+exceeds its budget, or imports a module that must only be loaded on first use (FastAPI, Beanie, RQ, tiktoken...).
+Run it from the project directory, so the settings find the .env file.
+
+Usage:
+    python -m benchmarks.import_time [--repeat N] [--scale X] [--top N]
+"""
+import argparse
+import re
+import subprocess
+import sys
+
+# Target: budget in milliseconds
+BUDGETS = {
+    "core": 400,
+    "core.common": 450,
+    "core.utils.counter": 450,
+}
+
+# Heavy packages the targets must not import, loaded lazily on first use
+LAZY = ("fastapi", "beanie", "motor", "rq", "redis", "tiktoken", "nicegui", "rich", "pympler")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime(code: str) -> list:
+    """ (cumulative microseconds, depth, module) of each import of `code`, in a fresh interpreter. """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            imports.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per target, the fastest is kept")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplies the budgets, for slower machines")
+    parser.add_argument("--top", type=int, default=0, help="Also lists the N slowest direct imports of each target")
+    args = parser.parse_args()
+
+    startup = {module for _, _, module in importtime("pass")}
+    failed = False
+    print(f"{'target':<25} {'ms':>8} {'budget':>8}  result")
+    for target, budget in BUDGETS.items():
+        runs = []
+        try:
+            for _ in range(args.repeat):
+                imports = importtime(f"import {target}")
+                top_level = [(us, module) for us, depth, module in imports if depth == 0 and module not in startup]
+                runs.append((sum(us for us, _ in top_level) / 1000, imports))
+        except RuntimeError as e:
+            failed = True
+            print(f"{target:<25} {'-':>8} {budget * args.scale:>8.0f}  failed: {e}")
+            continue
+        ms, imports = min(runs, key=lambda run: run[0])
+        modules = {module for _, _, module in imports}
+        eager = sorted(module for module in LAZY if module in modules)
+        result = "ok"
+        if ms > budget * args.scale:
+            result = "over budget"
+        if eager:
+            result = ("" if result == "ok" else result + ", ") + "imports " + ", ".join(eager)
+        failed = failed or result != "ok"
+        print(f"{target:<25} {ms:>8.1f} {budget * args.scale:>8.0f}  {result}")
+        for us, module in sorted(((us, module) for us, depth, module in imports if depth == 1), reverse=True)[:args.top]:
+            print(f"    {module:<40} {us / 1000:>8.1f}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
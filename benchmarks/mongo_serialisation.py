@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of DatabaseMongoBaseModel serialisation, as done for every item of a POST and every document read.
+
+Compares model_dump_json() parsed back with json.loads (the previous model_dump_json), model_dump() and to_mongo(),
+loading a stored document through __init__ (validation) and from_mongo(), and its JSON output for list endpoints,
+from the model and from a read-only view().
+
+Usage:
+    python -m benchmarks.mongo_serialisation [--number N]
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from core.schemas.database import DatabaseMongoBaseModel
+
+
+class Location(BaseModel):
+    city: str = ""
+    country: str = ""
+    latitude: str = ""
+    is_empty: bool = True
+
+
+class Visit(DatabaseMongoBaseModel):
+    short_id: str
+    date: Optional[datetime] = None
+    user_agent: Optional[str] = None
+    ip_address: Optional[str] = None
+    potential_bot: bool = False
+    location: Optional[Location] = None
+    server_data: Optional[Dict[str, Any]] = {}
+
+    class Settings:
+        name = "benchmark_visits"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=1000, help="Calls per implementation")
+    args = parser.parse_args()
+
+    visit = Visit(short_id="abc123", date=datetime.now(), user_agent="Mozilla/5.0", ip_address="127.0.0.1",
+                  location={"city": "Valletta", "country": "MT"}, server_data={"query": "utm_source=x"})
+    document = visit.to_mongo()
+    cases = {
+        "model_dump_json + json.loads": lambda: json.loads(BaseModel.model_dump_json(visit)),
+        "model_dump": visit.model_dump,
+        "to_mongo": visit.to_mongo,
+        "Visit(**document)": lambda: Visit(**document),
+        "Visit.from_mongo": lambda: Visit.from_mongo(document),
+        "from_mongo + model_dump json": lambda: Visit.from_mongo(document).model_dump(mode="json"),
+        "view + model_dump json": lambda: Visit.view(document).model_dump(mode="json"),
+    }
+    print(f"{'call':<30} {'us':>8}")
+    for name, call in cases.items():
+        print(f"{name:<30} {timeit.timeit(call, number=args.number) / args.number * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
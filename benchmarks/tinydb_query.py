@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of TinyDB query parsing, as done on every TinyDB find, update and delete.
+
+Compares TinyMongo's parse_query on a deep copied query with ObjectIds converted by dict_walk (the previous
+behaviour), with DragonTinyMongoCollection.parse_query.
+
+Usage:
+    python -m benchmarks.tinydb_query [--number N]
+"""
+import argparse
+import copy
+import timeit
+
+from bson import ObjectId
+from tinymongo import TinyMongoCollection
+
+from core.utils.database import DragonTinyMongoCollection
+from core.utils.dict import dict_walk
+
+
+QUERIES = {
+    "empty": {},
+    "_id": {"_id": ObjectId()},
+    "field": {"module_name": "users"},
+    "$in": {"_id": {"$in": [ObjectId() for _ in range(20)]}},
+    "$and/$or": {"$and": [
+        {"module_name": "users"},
+        {"$or": [{"_id": ObjectId()}, {"created_on": {"$gte": "2024-01-01"}}]},
+    ]},
+}
+
+
+def previous_parse_query(collection, query):
+    query = copy.deepcopy(query)
+    if query != {} or not query is None:
+        query = dict_walk(query, lambda k,v: str(v) if isinstance(v, ObjectId) else v)
+    return TinyMongoCollection.parse_query(collection, query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000, help="Calls per query and implementation")
+    args = parser.parse_args()
+
+    collection = DragonTinyMongoCollection("benchmark", parent=None)
+    print(f"{'query':<10} {'previous (us)':>14} {'current (us)':>14} {'speedup':>8}")
+    for name, query in QUERIES.items():
+        previous = timeit.timeit(lambda: previous_parse_query(collection, query), number=args.number)
+        current = timeit.timeit(lambda: collection.parse_query(query), number=args.number)
+        print(f"{name:<10} {previous / args.number * 1e6:>14.1f} {current / args.number * 1e6:>14.1f} {previous / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
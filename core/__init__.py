@@ -1,9 +1,24 @@
 # from core.config.config import Config
-from core.module_manager.module import Module
-from core.modules import users
+from importlib import import_module
 
 from core.utils.logging import logger as log, print
 
+# Loaded on first access, so importing core (or any core.* module, eg. from an RQ worker) does not import FastAPI
+# and the module manager. Name: (module, attribute), or the module itself when attribute is None.
+_LAZY = {
+    "Module": ("core.module_manager.module", "Module"),
+    "users": ("core.modules.users", None),
+}
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module 'core' has no attribute '{name}'")
+    module_name, attribute = _LAZY[name]
+    value = import_module(module_name)
+    value = getattr(value, attribute) if attribute else value
+    globals()[name] = value
+    return value
+
 __all__ = [
     # "Config",
     "Module",
@@ -1,11 +1,25 @@
 """
 A simple file that preloads some of the most common methods for quick and easy access.
+TaskManager is loaded on first access, as importing it imports RQ and Redis and creates the queue.
 """
+from importlib import import_module
+
 from core.utils.logging import logger as log, print
 from core.config import settings
 from core.utils.cache import global_cache
 from core.utils.datetime import utc_now, utc_datetime, nice_time
-from core.utils.task_manager import TaskManager
+
+# Name: module, of the attributes loaded on first access
+_LAZY = {
+    "TaskManager": "core.utils.task_manager",
+}
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module 'core.common' has no attribute '{name}'")
+    value = getattr(import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
 
 __all__ = [
     "log",
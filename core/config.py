@@ -81,8 +81,31 @@ class Settings(BaseSettings):
     SENTRY_PROFILES_SAMPLE_RATE: Optional[float] = 1.0
     
     # Database settings
+    # MongoDB URI, "tinydb", or "sqlite" / "sqlite:///path/to/file.db" for an embedded database that several workers can share
     MONGODB_URI: str | None = "tinydb" # Fallback to TinyDb
     DATABASE_NAME: str | None = None
+    # MongoDB connection pool size, per client: the sync (PyMongo) and async (Motor) clients of each worker have their own pool
+    MONGODB_MAX_POOL_SIZE: int = 50
+    MONGODB_MIN_POOL_SIZE: int = 10
+    # TinyDB keeps the database in memory and writes it to disk every TINYDB_FLUSH_INTERVAL seconds, on shutdown,
+    # or after TINYDB_WRITE_CACHE_SIZE writes. 0 writes every change immediately, as is always done when REDIS_HOST is set
+    # without RQ_BYPASS_WORKER, since the RQ worker processes write to the same file.
+    TINYDB_FLUSH_INTERVAL: float = 1.0
+    TINYDB_WRITE_CACHE_SIZE: int = 1000
+    # Fraction of list queries (CRUD endpoints, admin tables) explained to log collection scans with a suggested index,
+    # eg. 0.01 while debugging. 0 disables it.
+    DATABASE_EXPLAIN_SAMPLE_RATE: float = 0.0
+    # Record latency histograms per collection and operation, served on /metrics/database (core.utils.database_metrics).
+    # Operations slower than DATABASE_SLOW_QUERY_MS are logged with the shape of their filter.
+    DATABASE_METRICS: bool = False
+    DATABASE_SLOW_QUERY_MS: float = 100
+    # Database.write_behind() writes a batch when DATABASE_WRITE_BUFFER_SIZE writes are pending, or DATABASE_WRITE_BUFFER_INTERVAL
+    # seconds after its first write. Callers block while DATABASE_WRITE_BUFFER_MAX_PENDING writes are pending.
+    DATABASE_WRITE_BUFFER_SIZE: int = 500
+    DATABASE_WRITE_BUFFER_INTERVAL: float = 1.0
+    DATABASE_WRITE_BUFFER_MAX_PENDING: int = 10_000
+    # Bearer token required by the /metrics endpoints. They are disabled (404) until it is set
+    METRICS_TOKEN: str | None = None
     
 
     REDIS_HOST: str | None = None
@@ -92,6 +115,12 @@ class Settings(BaseSettings):
     
     FASTAPI_WORKERS: int = 1
     
+    # In-process cache limits (core.utils.cache.SimpleCache). None to disable a limit.
+    CACHE_MAX_ENTRIES: int | None = 10_000
+    CACHE_MAX_BYTES: int | None = 64 * 1024 * 1024
+    # Share cached values between workers through Redis (core.utils.cache.TieredCache). Requires REDIS_HOST.
+    CACHE_REDIS: bool = True
+    
     @model_validator(mode="after")
     def _set_default_database_name(self) -> Self:
         if not self.MONGODB_URI or self.MONGODB_URI == "tinydb":
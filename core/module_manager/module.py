@@ -3,10 +3,10 @@ from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from typing import Union, List, Optional, Dict, Any, Type, Callable
 from importlib import import_module
-from beanie import Document
 from core.schemas import module_schema, singleton , module_config
 from core.utils.logging import logger as log, print
 from core.utils.string import to_snake_case
+from core.utils.startup import StartupTimings
 
 from core.config import settings
 
@@ -60,7 +60,8 @@ class Module(metaclass=singleton.SingletonMeta):
         try:
             for mod in module:
                 log.debug("Importing Core Module: " + mod)
-                mod = import_module(f"core.modules.{mod}.main")
+                with StartupTimings.measure("import", f"core.{mod}"):
+                    import_module(f"core.modules.{mod}.main")
         except Exception as e:
             raise Exception(f"Failed to load module {mod}: {e}")
         log.info("Core modules loaded: " + str(module))
@@ -90,7 +91,8 @@ class Module(metaclass=singleton.SingletonMeta):
         try:
             for mod in module:
                 log.debug("Importing App Module: "+ mod)
-                mod = import_module(f"app.modules.{mod}.main")
+                with StartupTimings.measure("import", f"app.{mod}"):
+                    import_module(f"app.modules.{mod}.main")
         except Exception as e:
             raise Exception(f"Failed to load module {mod}: {e}")
 
@@ -293,12 +295,13 @@ class Module(metaclass=singleton.SingletonMeta):
             try:
                 if mod.router:
                     # pass
-                    app.include_router(
-                        mod.router, 
-                        prefix=f"{settings.API_V1_STR.rstrip('/')}/{mod.name}", 
-                        # prefix=f"{settings.API_VERSION_STR.rstrip('/').format(version=mod.version)}/{mod.name}", # TODO using module versioning
-                        tags=[f"{mod.name.capitalize()}"]
-                    )
+                    with StartupTimings.measure("routes", mod.name):
+                        app.include_router(
+                            mod.router, 
+                            prefix=f"{settings.API_V1_STR.rstrip('/')}/{mod.name}", 
+                            # prefix=f"{settings.API_VERSION_STR.rstrip('/').format(version=mod.version)}/{mod.name}", # TODO using module versioning
+                            tags=[f"{mod.name.capitalize()}"]
+                        )
             except Exception as e:
                 log.error(f"Failed to load routes for module {mod.name}: {e}")
                 raise Exception(f"Failed to load routes for module {mod.name}: {e}")
\ No newline at end of file
@@ -11,8 +11,15 @@ from typing_extensions import Literal, TypeAlias
 from pydantic import BaseModel as PydanticBaseModel, Field, validator, VERSION, root_validator
 from pydantic.json_schema import GenerateJsonSchema
 # from sqlmodel import SQLModel, Field # We use Field from SQLModel instead of Pydantic as a standard
-from typing import Optional, Any, TYPE_CHECKING, Type
+from typing import Optional, Any, TYPE_CHECKING, Type, Union, get_args, get_origin
+from typing_extensions import Annotated
 from datetime import datetime, timezone
+from enum import Enum
+from collections.abc import Mapping
+import types
+import copy
+import json
+import hashlib
 from bson import DBRef, ObjectId
 from bson.errors import InvalidId
 from core.config import settings
@@ -27,7 +34,7 @@ if IS_PYDANTIC_V2:
         TypeAdapter,
     )
     from pydantic.json_schema import JsonSchemaValue
-    from pydantic_core import CoreSchema, core_schema
+    from pydantic_core import CoreSchema, core_schema, to_json, to_jsonable_python
     from pydantic_core.core_schema import (
         ValidationInfo,
         simple_ser_schema,
@@ -107,6 +114,298 @@ if not IS_PYDANTIC_V2:
 
 
 
+# Types PyMongo and the TinyDB serializers store as they are. Other values are stored in their JSON form (eg. URLs, UUIDs, dates, Enums).
+_BSON_TYPES = (str, int, float, bool, bytes, datetime, ObjectId, type(None))
+
+
+def _bson_native(annotation, seen: dict = None) -> bool:
+    """ Whether the Python serialisation of a field, from its annotation, only holds BSON types. """
+    if annotation is Any:
+        return True
+    origin = get_origin(annotation)
+    if origin is Annotated:
+        return _bson_native(get_args(annotation)[0], seen)
+    if origin is Literal:
+        return all(isinstance(arg, _BSON_TYPES) for arg in get_args(annotation))
+    if origin in (Union, types.UnionType, list, tuple):
+        return all(arg is Ellipsis or _bson_native(arg, seen) for arg in get_args(annotation))
+    if origin is dict:
+        key, value = get_args(annotation) or (str, Any)
+        return key is str and _bson_native(value, seen)
+    if not isinstance(annotation, type) or origin is not None or issubclass(annotation, Enum):
+        return False
+    if issubclass(annotation, PydanticBaseModel):
+        # Results by model, and True for the models being checked, for recursive models
+        seen = {} if seen is None else seen
+        if annotation not in seen:
+            seen[annotation] = True
+            seen[annotation] = all(_bson_native(field.annotation, seen) for field in annotation.model_fields.values())
+        return seen[annotation]
+    return issubclass(annotation, _BSON_TYPES)
+
+
+def _utc(value):
+    return value.replace(tzinfo=timezone.utc) if isinstance(value, datetime) and value.tzinfo is None else value
+
+
+def _field_loader(annotation):
+    """
+    Converts the stored value of a field to the value of the model: nested models are constructed, naive datetimes made UTC,
+    and values stored in their JSON form are validated. None when the stored value is used as it is.
+    """
+    if not _bson_native(annotation):
+        return _validator(annotation)
+    origin = get_origin(annotation)
+    if origin is Annotated:
+        return _field_loader(get_args(annotation)[0])
+    if origin in (Union, types.UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return _field_loader(args[0])
+    elif origin is list:
+        args = get_args(annotation)
+        item = _field_loader(args[0]) if args else None
+        return (lambda value: [item(v) for v in value] if isinstance(value, list) else value) if item else None
+    elif isinstance(annotation, type) and origin is None:
+        if issubclass(annotation, datetime):
+            return _utc
+        if issubclass(annotation, PydanticBaseModel):
+            return lambda value: from_mongo(annotation, value) if isinstance(value, Mapping) else value
+        return None
+    if any(isinstance(arg, type) and issubclass(arg, PydanticBaseModel) for arg in _walk_args(annotation)):
+        # Other annotations holding models (unions, dicts)
+        return _validator(annotation)
+    return None
+
+
+def _validator(annotation):
+    """ Validates a stored value, which is kept as it is if it is no longer valid. """
+    adapter = TypeAdapter(annotation)
+    def validate(value):
+        try:
+            return adapter.validate_python(value)
+        except ValueError:
+            return value
+    return validate
+
+
+def _walk_args(annotation):
+    for arg in get_args(annotation):
+        yield arg
+        yield from _walk_args(arg)
+
+
+# Per-class plans of to_mongo() and from_mongo(), built on first use
+_dump_plans: dict = {}
+_load_plans: dict = {}
+_MISSING = object()
+
+
+def _dump_plan(model: Type[PydanticBaseModel]) -> tuple:
+    """ Fields serialised in Python mode (BSON types), and fields serialised in JSON mode. """
+    plan = _dump_plans.get(model)
+    if plan is None:
+        native = {name for name, field in model.model_fields.items() if _bson_native(field.annotation)}
+        plan = _dump_plans[model] = (native, set(model.model_fields) - native)
+    return plan
+
+
+def _load_plan(model: Type[PydanticBaseModel]) -> tuple:
+    """ (name, key in the document, loader, FieldInfo) of each field, and whether instances can be built without model_construct(). """
+    plan = _load_plans.get(model)
+    if plan is None:
+        fields = [(name, "_id" if name == "id" else name, _field_loader(field.annotation), field) for name, field in model.model_fields.items()]
+        direct = not model.__private_attributes__ and model.__pydantic_post_init__ is None and model.model_config.get("extra") != "allow"
+        plan = _load_plans[model] = (fields, direct)
+    return plan
+
+
+def from_mongo(model: Type[PydanticBaseModel], document: dict) -> PydanticBaseModel:
+    """
+    Builds a model from a database document without validating it. _id is set as id, nested models are constructed,
+    naive datetimes are made UTC like DatabaseMongoBaseModel.__init__ does, and values stored in their JSON form by to_mongo()
+    are validated. Only for documents that were validated before being stored.
+    """
+    fields, direct = _load_plan(model)
+    values = {}
+    fields_set = set()
+    for name, key, loader, field in fields:
+        value = document.get(key, _MISSING)
+        if value is _MISSING and key == "_id":
+            value = document.get(name, _MISSING)
+        if value is _MISSING:
+            if field.is_required():
+                continue
+            value = field.get_default(call_default_factory=True, validated_data=values)
+        else:
+            fields_set.add(name)
+            if loader is not None and value is not None:
+                value = loader(value)
+        values[name] = value
+    if not direct:
+        return model.model_construct(fields_set, **values)
+    # What model_construct() does, for models without private attributes, post init or extra fields
+    instance = model.__new__(model)
+    object.__setattr__(instance, "__dict__", values)
+    object.__setattr__(instance, "__pydantic_fields_set__", fields_set)
+    object.__setattr__(instance, "__pydantic_extra__", None)
+    object.__setattr__(instance, "__pydantic_private__", None)
+    return instance
+
+
+def _plain(model: Type[PydanticBaseModel]) -> bool:
+    """ Whether model_dump() of the model only serialises its fields, without custom serializers or computed fields. """
+    decorators = model.__pydantic_decorators__
+    return not (decorators.field_serializers or decorators.model_serializers or decorators.computed_fields)
+
+
+def _jsonable(value):
+    """ The JSON form of stored values: datetimes as pydantic dumps them, ObjectIds as strings, and RawBSONDocuments as dicts. """
+    return to_jsonable_python(value, fallback=lambda v: dict(v) if isinstance(v, Mapping) else str(v))
+
+
+def _json_encoder(annotation):
+    """
+    Converts the stored value of a field, not None, for _jsonable() to return the JSON form model_dump(mode='json') of the
+    loaded model would. Nested models are dumped from the stored dict, and values stored in their JSON form are validated
+    and dumped again. None when the stored value is used as it is.
+    """
+    origin = get_origin(annotation)
+    if origin in (Union, types.UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return _json_encoder(args[0])
+    elif origin is list:
+        args = get_args(annotation)
+        encoder = _json_encoder(args[0]) if args else None
+        if encoder is not None:
+            return lambda value, exclude_none: [None if v is None else encoder(v, exclude_none) for v in value] if isinstance(value, list) else value
+    elif isinstance(annotation, type) and origin is None:
+        if issubclass(annotation, PydanticBaseModel) and _plain(annotation):
+            return lambda value, exclude_none: _view_json(annotation, value, exclude_none=exclude_none) if isinstance(value, Mapping) else value
+        if issubclass(annotation, datetime):
+            return lambda value, exclude_none: _utc(value)
+    if _bson_native(annotation) and not any(isinstance(arg, type) and issubclass(arg, PydanticBaseModel) for arg in _walk_args(annotation)):
+        return None
+    validate = _validator(annotation)
+    adapter = TypeAdapter(annotation)
+    def encode(value, exclude_none):
+        try:
+            return adapter.dump_python(validate(value), mode='json', exclude_none=exclude_none, warnings=False)
+        except ValueError:
+            return value
+    return encode
+
+
+# Processed model_json_schema() per (class, arguments), and its version hash, built on first use
+_json_schemas: dict = {}
+
+
+# Per-class plans of DocumentView, built on first use
+_view_plans: dict = {}
+
+
+def _view_plan(model: Type[PydanticBaseModel]) -> tuple:
+    """ {name: (key, loader, FieldInfo)} for attribute access, [(name, key, encoder, FieldInfo)] for JSON, and whether the model is _plain(). """
+    plan = _view_plans.get(model)
+    if plan is None:
+        fields, _ = _load_plan(model)
+        plan = _view_plans[model] = (
+            {name: (key, loader, field) for name, key, loader, field in fields},
+            [(name, key, _json_encoder(field.annotation), field) for name, key, _, field in fields],
+            _plain(model),
+        )
+    return plan
+
+
+def _view_json(model: Type[PydanticBaseModel], document: Mapping, include=None, exclude=None, exclude_none: bool = False) -> dict:
+    """ The fields of a stored document of the model, with the defaults of its missing fields, for _jsonable(). """
+    _, fields, _ = _view_plan(model)
+    get = document.get
+    output = {}
+    for name, key, encoder, field in fields:
+        if (include is not None and name not in include) or (exclude is not None and name in exclude):
+            continue
+        value = get(key, _MISSING)
+        if value is _MISSING and key == "_id":
+            value = get(name, _MISSING)
+        if value is _MISSING:
+            if field.is_required():
+                continue
+            default = field.get_default(call_default_factory=True, validated_data={})
+            value = to_jsonable_python(default, exclude_none=exclude_none, fallback=str)
+        elif value is not None and encoder is not None:
+            value = encoder(value, exclude_none)
+        if value is None and exclude_none:
+            continue
+        output[name] = value
+    return output
+
+
+class DocumentView:
+    """
+    Read-only view of a stored document (a dict or a RawBSONDocument) as a DatabaseMongoBaseModel, without building the model.
+    Fields are loaded like from_mongo() does, when they are first accessed, and model_dump(mode='json') returns the same
+    output as the model's from the stored values. For list endpoints returning many documents.
+    Usage:
+        view = ShlinkShortLinkDocument.view(document)
+        view.visits_count
+        view.model_dump(mode="json", exclude={"meta"})
+    """
+    __slots__ = ("_model", "_document", "_values")
+
+    def __init__(self, model: Type["DatabaseMongoBaseModel"], document: Mapping):
+        object.__setattr__(self, "_model", model)
+        object.__setattr__(self, "_document", document)
+        object.__setattr__(self, "_values", {})
+
+    def __getattr__(self, name):
+        values = self._values
+        if name in values:
+            return values[name]
+        field = _view_plan(self._model)[0].get(name)
+        if field is None:
+            raise AttributeError(f"'{self._model.__name__}' object has no attribute '{name}'")
+        key, loader, info = field
+        value = self._document.get(key, _MISSING)
+        if value is _MISSING and key == "_id":
+            value = self._document.get(name, _MISSING)
+        if value is _MISSING:
+            if info.is_required():
+                raise AttributeError(f"'{self._model.__name__}' document has no '{name}'")
+            value = info.get_default(call_default_factory=True, validated_data=values)
+        elif loader is not None and value is not None:
+            value = loader(value)
+        values[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        raise TypeError(f"{self._model.__name__} view is read-only")
+
+    def __delattr__(self, name):
+        raise TypeError(f"{self._model.__name__} view is read-only")
+
+    def __repr__(self):
+        return f"{self._model.__name__}.view({dict(self._document)!r})"
+
+    def model(self) -> "DatabaseMongoBaseModel":
+        """ The model of the document, see from_mongo(). """
+        return from_mongo(self._model, self._document)
+
+    def model_dump(self, *, mode: str = 'json', include: set[str] | None = None, exclude: set[str] | None = None, exclude_none: bool = False, warnings: bool = True) -> dict[str, Any]:
+        """ The document as DatabaseMongoBaseModel.model_dump() returns it, id as _id. Modes other than 'json' dump the model. """
+        if mode != 'json' or not _view_plan(self._model)[2]:
+            return self.model().model_dump(mode=mode, include=include, exclude=exclude, exclude_none=exclude_none, warnings=warnings)
+        output = _jsonable(_view_json(self._model, self._document, include, exclude, exclude_none))
+        if output.get('id', None):
+            output['_id'] = output.pop('id')
+        return output
+
+    def model_dump_json(self, *, include: set[str] | None = None, exclude: set[str] | None = None, exclude_none: bool = False) -> str:
+        """ The JSON of model_dump(). """
+        return to_json(self.model_dump(include=include, exclude=exclude, exclude_none=exclude_none)).decode()
+
+
 class DatabaseMongoBaseModelMeta(type(PydanticBaseModel)):
     """
     Validate that the model has a 'Settings' class with a 'name' attribute.
@@ -183,15 +482,17 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
         
         # fields = {"id": "_id"} # Deprecated pydantic V2
     
+    # Other inputs (eg. the list of a Union[Model, List[Model]] body) are left to fail validation
     @root_validator(pre=True)
     def set_created_on(cls, values):
-        if "created_on" not in values or values["created_on"] is None:
+        if isinstance(values, dict) and values.get("created_on") is None:
             values["created_on"] = datetime.now(timezone.utc)
         return values
 
     @root_validator(pre=True)
     def set_updated_on(cls, values):
-        values["updated_on"] = datetime.now(timezone.utc)
+        if isinstance(values, dict):
+            values["updated_on"] = datetime.now(timezone.utc)
         return values    
     
     # @validator('id', pre=True, always=True)
@@ -211,15 +512,56 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
         # Convert all naive datetime objects in data to aware datetime objects
         for key, value in data.items():
             if isinstance(value, datetime) and value.tzinfo is None:
-                print(value)
                 data[key] = value.replace(tzinfo=timezone.utc)
         super().__init__(**data)
-        if not data.get('_id', None) and not self.id:
+        # _id (from the database) is kept as it is, TinyDB ids are not ObjectIds
+        _id = data.get('_id', None)
+        if _id:
+            if self.id != _id:
+                self.id = _id
+        elif not self.id:
             self.id = PydanticObjectId()
-        if not self.id and data.get('_id', None):
-            self.id = data['_id']
-        if data.get('_id', None) and self.id != data['_id']:
-            self.id = data['_id']
+    
+    def to_mongo(self, exclude: set[str] | None = None) -> dict[str, Any]:
+        """
+        Returns the document to store in the database, in one pass of the model's serializer: id as _id,
+        BSON types (datetimes, ObjectIds) as they are, and other values (URLs, Enums, dates...) in their JSON form.
+        Faster than model_dump() and model_dump_json(), and does not validate.
+        """
+        native, json_fields = _dump_plan(type(self))
+        exclude = {'id', *(exclude or ())}
+        serializer = self.__pydantic_serializer__
+        document = serializer.to_python(self, mode='python', exclude=exclude | json_fields if json_fields else exclude)
+        if json_fields - exclude:
+            document.update(serializer.to_python(self, mode='json', include=json_fields - exclude))
+        _id = self.id
+        if _id:
+            if Database.using_tinydb:
+                _id = str(_id)
+            elif not isinstance(_id, ObjectId) and ObjectId.is_valid(_id):
+                _id = PydanticObjectId(_id)
+            document['_id'] = _id
+        return document
+    
+    @classmethod
+    def from_mongo(cls, document: dict):
+        """
+        Builds the model from a database document without validating it again. See from_mongo().
+        
+        Usage:
+            job = MigrationJob.from_mongo(Database.get_collection(MigrationJob.Settings.name).find_one({"_id": _id}))
+        """
+        return from_mongo(cls, document)
+
+    @classmethod
+    def view(cls, document: Mapping) -> DocumentView:
+        """
+        Read-only view of a database document, loading its fields on access. See DocumentView.
+        
+        Usage:
+            rows = [ShlinkAnalyticsDocument.view(document).model_dump(mode="json") for document in cursor]
+        """
+        return DocumentView(cls, document)
         
     def model_dump(self, *, mode: str = 'python', include: set[int] | set[str] | dict[int, Any] | dict[str, Any] | None = None, exclude: set[int] | set[str] | dict[int, Any] | dict[str, Any] | None = None, by_alias: bool = False, exclude_unset: bool = False, exclude_defaults: bool = False, exclude_none: bool = False, round_trip: bool = False, warnings: bool = True) -> dict[str, Any]:
         """
@@ -228,7 +570,7 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
         try:
             _dict = super().model_dump(mode=mode, include=include, exclude=exclude, by_alias=by_alias, exclude_unset=exclude_unset, exclude_defaults=exclude_defaults, exclude_none=exclude_none, round_trip=round_trip, warnings=warnings)
             if _dict.get('id', None):
-                if Database.using_tinydb:
+                if Database.using_tinydb or mode == 'json':
                     _dict['_id'] = str(_dict['id'])
                 else:
                     _dict['_id'] = PydanticObjectId(_dict['id'])
@@ -272,9 +614,9 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
             A JSON string representation of the model.
         """
         try:
-            import json
-            _dict = json.loads(super().model_dump_json(
-                indent = indent,
+            # The JSON types, without encoding and decoding a JSON string
+            _dict = super().model_dump(
+                mode = 'json',
                 include = include,
                 exclude = exclude,
                 by_alias = by_alias,
@@ -283,7 +625,7 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
                 exclude_none = exclude_none,
                 round_trip = round_trip,
                 warnings = warnings,
-            ))
+            )
             if Database.using_tinydb:
                 _dict['_id'] = str(_dict['id'])
             else:
@@ -302,6 +644,7 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
         **kwargs,
     ) -> dict[str, Any]:
         """Generates a JSON schema for a model class.
+        The schema is generated once per class and arguments, and a copy returned on each call.
 
         Args:
             by_alias: Whether to use attribute aliases or not.
@@ -313,6 +656,34 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
         Returns:
             The JSON schema for the given model class.
         """    
+        return copy.deepcopy(cls._json_schema(*args, **kwargs)[0])
+
+    @classmethod
+    def schema_version(cls, *args, **kwargs) -> str:
+        """
+        Hash of the JSON schema, with the arguments of model_json_schema(). Changes whenever the schema does, eg. to use as an ETag.
+        """
+        entry = cls._json_schema(*args, **kwargs)
+        if entry[1] is None:
+            entry[1] = hashlib.sha256(json.dumps(entry[0], sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()[:32]
+        return entry[1]
+
+    @classmethod
+    def _json_schema(cls, *args, **kwargs) -> list:
+        """ [schema, version] of the class and arguments, from _json_schemas. Unhashable arguments are not cached. """
+        try:
+            key = (cls, args, tuple(sorted(kwargs.items())))
+            entry = _json_schemas.get(key)
+        except TypeError:
+            key = entry = None
+        if entry is None:
+            entry = [cls._generate_json_schema(*args, **kwargs), None]
+            if key is not None:
+                _json_schemas[key] = entry
+        return entry
+
+    @classmethod
+    def _generate_json_schema(cls, *args, **kwargs) -> dict[str, Any]:
         # json_schema_extra = cls.Config.json_schema_extra.copy()
         # json_schema_extra['collection_name'] = cls.collection_name()
         # cls.Config.json_schema_extra.update({'collection_name': cls.collection_name()})
@@ -329,6 +700,13 @@ class DatabaseMongoBaseModel(PydanticBaseModel, metaclass=DatabaseMongoBaseModel
         properties.update(metadata_fields)
 
         return json_schema    
+
+    @classmethod
+    def model_rebuild(cls, *args, **kwargs):
+        """ Rebuilds the model, and drops the cached JSON schemas, which may change with it. """
+        result = super().model_rebuild(*args, **kwargs)
+        _json_schemas.clear()
+        return result
     
     # @classmethod
     # def from_dict(cls, data: dict):
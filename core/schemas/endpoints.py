@@ -8,15 +8,25 @@ from enum import Enum
 class SortOrder(Enum):
     asc = "asc"
     desc = "desc"
+
+class CountMode(Enum):
+    exact = "exact"
+    estimated = "estimated"
+
+class ExportFormat(Enum):
+    ndjson = "ndjson"
+    csv = "csv"
     
 class CRUDResponseModelGet(BaseModel):
     status_code: int = 200
     message: str = "success"
     data: List[dict] = []
     page: int = 1
-    total_pages: int = 1
+    total_pages: Optional[int] = 1 # None when counting was skipped
     per_page: int = 10
-    total_items: int = 0
+    total_items: Optional[int] = 0 # None when counting was skipped
+    total_estimated: bool = False # True when total_items is an estimate or a capped count
+    next_cursor: Optional[str] = None # Keyset pagination cursor for the next page, None on the last page
     
 class CRUDResponseModelPostMany(BaseModel):
     status_code: int
@@ -27,6 +37,14 @@ class CRUDResponseModelPostMany(BaseModel):
 class CRUDResponseModelDelete(BaseModel):
     status_code: int
     message: str
+    deleted_count: Optional[int] = None # Bulk delete: number of items deleted
+    matched_count: Optional[int] = None # Bulk delete: number of items matching the request, also returned on dry runs
+    dry_run: bool = False
+
+class CRUDRequestModelDeleteMany(BaseModel):
+    ids: Optional[List[str]] = None # IDs of the items to delete
+    filter: Optional[str] = None # Filter in MongoDB Extended JSON. Cannot be empty.
+    max_items: Optional[int] = None # Refuse to delete if more items match. Cannot exceed the endpoint cap.
 
 class CRUDQueryData(BaseModel):
     data: Optional[dict] = None # Used for the query to the database or item data being used
@@ -9,6 +9,10 @@ from core.utils.logging import logger as log, print
 from core.utils.database import Database
 
 
+# Default of fetch_config(), to tell a document not fetched yet from a module without one
+_NOT_FETCHED = object()
+
+
 class ModuleDocument(DatabaseMongoBaseModel):
     module_name: str = None
     title: str = None
@@ -39,14 +43,18 @@ class ModuleSchema(BaseModel):
     description:Optional[str] = None # Description of the module, used in the admin panel, under the title before the data.
 
 
-    def fetch_config(self):
+    def fetch_config(self, data: Optional[dict] = _NOT_FETCHED):
         """
         Fetch the configuration from the database and updates the attributes of the module.
         
+        Args:
+            data: The module's document, or None when it has none, when already fetched with fetch_config_documents().
+        
         Returns:
             The configuration object
         """
-        data = Database.get_collection('modules').find_one({"module_name": self.name})
+        if data is _NOT_FETCHED:
+            data = Database.get_collection('modules').find_one({"module_name": self.name})
         
         # print("FETCH CONFIG", data)
         if not data:
@@ -57,6 +65,17 @@ class ModuleSchema(BaseModel):
             self.config = self.config_class(**data.get('config')) if data.get('config') else None
         return self.config
     
+    @staticmethod
+    def fetch_config_documents(names: List[str]) -> dict:
+        """
+        The stored configuration documents of the modules, by module name, in one query.
+        """
+        documents = {}
+        for document in Database.get_collection('modules').find({"module_name": {"$in": names}}):
+            # The first document of a module, as find_one() returns
+            documents.setdefault(document.get('module_name'), document)
+        return documents
+    
     def save_config(self):
         """
         Save the configuration to the database
@@ -1,52 +1,422 @@
+"""
+In-process cache.
+
+SimpleCache is a bounded LRU cache with per-entry TTL. Lookups and inserts are O(1): entries live in an
+OrderedDict (LRU order) and expiry times are bucketed per second, so expired entries can be swept without
+scanning the whole cache. Memory is accounted incrementally from a per-entry size estimate taken when the
+value is stored, and is exposed through `stats()`.
+
+Keys are indexed per namespace and per tag, so `clear(namespace=...)` and `invalidate_tags(...)` only touch
+the entries they remove.
+
+The `cache` / `async_cache` decorators coalesce concurrent misses for the same key into a single call of the
+wrapped function (single-flight), and can optionally serve stale values while one refresh runs in the
+background (stale-while-revalidate).
+
+TieredCache adds a shared Redis tier (L2) behind the in-process cache (L1) for multi-worker deployments.
+Invalidations are broadcast over Redis pub/sub so every worker drops its L1 copies.
+"""
 import time
-from typing import Callable, Any, Dict, Union
-from pydantic import BaseModel
+import json
+import uuid
+import pickle
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Callable, Any, Dict, Union, Optional, Set, Iterable
 from functools import wraps
 from sys import getsizeof
-from pympler import asizeof
+from pydantic import BaseModel
 
-class CacheItem(BaseModel):
-    value: Any
-    expiry: float
+from core.config import settings
+from core.utils.logging import logger as log
 
-class SimpleCache:
-    # _instance = None
+_MISSING = object()
+# Result of an async single-flight whose leader was cancelled, for its waiters to retry
+_RETRY = object()
+
+
+def _estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Cheap, bounded estimate of the memory used by a value. Only walks a few levels of containers, so it
+    never costs more than a handful of `getsizeof` calls for typical cached payloads.
+    """
+    size = getsizeof(value)
+    if _depth >= 3:
+        return size
+    if isinstance(value, BaseModel):
+        return size + _estimate_size(value.__dict__, _depth + 1)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += getsizeof(k) + _estimate_size(v, _depth + 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += _estimate_size(v, _depth + 1)
+    return size
+
+
+class CacheItem:
+    __slots__ = ("value", "expiry", "size", "namespace", "tags", "fresh_until")
 
-    # def __new__(cls, *args, **kwargs):
-    #     if not cls._instance:
-    #         cls._instance = super(SimpleCache, cls).__new__(cls, *args, **kwargs)
-    #     return cls._instance
+    def __init__(self, value: Any, expiry: Optional[float], size: int = 0, namespace: str = 'default', tags: Optional[frozenset] = None, fresh_until: Optional[float] = None):
+        self.value = value
+        self.expiry = expiry
+        self.size = size
+        self.namespace = namespace
+        self.tags = tags
+        # Set when the entry may be served stale: after this time and until `expiry` the value is stale.
+        self.fresh_until = fresh_until
+
+
+class _Flight:
+    """ A computation in progress for a key, shared by all threads that missed on it. """
+    __slots__ = ("event", "result", "error")
 
     def __init__(self):
-        self.storage: Dict[str, CacheItem] = {}
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
 
-    def set(self, key: str, value: Any, ttl: int = 300, namespace: str = 'default'):
-        expiry = time.time() + ttl
-        namespaced_key = f"{namespace}:{key}"
-        self.storage[namespaced_key] = CacheItem(value=value, expiry=expiry)
 
-    def get(self, key: str, namespace: str = 'default'):
-        namespaced_key = f"{namespace}:{key}"
-        item = self.storage.get(namespaced_key)
-        print("Total Cache Size: (pympler) {:.5f} MB".format(asizeof.asizeof(self.storage)/ 1024 / 1024))        
-        if item and time.time() < item.expiry:
-            return item.value
-        else:
-            self.storage.pop(namespaced_key, None)
+class SimpleCache:
+    """
+    Bounded LRU cache with TTL expiry.
+
+    Args:
+        max_entries: Maximum number of entries kept. Least recently used entries are evicted first. None for no limit.
+        max_bytes: Maximum estimated size of all cached values, in bytes. None for no limit.
+        sweep_interval: Minimum number of seconds between two expiry sweeps. Sweeps run amortized on `set()`.
+        sizer: Callable returning the estimated size of a value in bytes. Defaults to a shallow, bounded estimate.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = settings.CACHE_MAX_ENTRIES,
+        max_bytes: Optional[int] = settings.CACHE_MAX_BYTES,
+        sweep_interval: float = 1.0,
+        sizer: Callable[[Any], int] = _estimate_size,
+    ):
+        self.storage: "OrderedDict[str, CacheItem]" = OrderedDict()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sizer = sizer
+        self._lock = threading.RLock()
+        # Expiry buckets: int(expiry second) -> keys expiring during that second
+        self._expiry_buckets: Dict[int, Set[str]] = {}
+        # Secondary indexes: namespace -> keys, tag -> keys
+        self._namespaces: Dict[str, Set[str]] = {}
+        self._tags: Dict[str, Set[str]] = {}
+        # In-flight computations of the decorators, per namespaced key
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._sync_inflight: Dict[str, _Flight] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._revalidating: Set[str] = set()
+        self._swept_until = int(time.time())
+        self._next_sweep = time.time() + sweep_interval
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._stale_hits = 0
+        self._coalesced = 0
+
+    ### Internal helpers (callers must hold the lock)
+
+    @staticmethod
+    def _discard(index: Dict[Any, Set[str]], name: Any, namespaced_key: str):
+        keys = index.get(name)
+        if keys is not None:
+            keys.discard(namespaced_key)
+            if not keys:
+                del index[name]
+
+    def _remove(self, namespaced_key: str) -> Optional[CacheItem]:
+        """
+        Removes an entry with its namespace, tag and expiry index entries, and its size from the accounted bytes.
+        Every path dropping an entry (overwrite, eviction, expiry, clear, invalidation) goes through it, so no index keeps a key
+        that is no longer stored.
+        """
+        item = self.storage.pop(namespaced_key, None)
+        if item is None:
             return None
+        self._bytes -= item.size
+        self._discard(self._namespaces, item.namespace, namespaced_key)
+        if item.tags:
+            for tag in item.tags:
+                self._discard(self._tags, tag, namespaced_key)
+        if item.expiry is not None:
+            self._discard(self._expiry_buckets, int(item.expiry), namespaced_key)
+        return item
+
+    def _evict(self):
+        while self.storage and (
+            (self.max_entries is not None and len(self.storage) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            # Least recently used first
+            self._remove(next(iter(self.storage)))
+            self._evictions += 1
+
+    def _sweep(self, now: float) -> int:
+        removed = 0
+        until = int(now)
+        if until - self._swept_until > len(self._expiry_buckets):
+            seconds = sorted(s for s in self._expiry_buckets if s < until)
+        else:
+            seconds = range(self._swept_until, until)
+        for second in seconds:
+            bucket = self._expiry_buckets.pop(second, None)
+            if not bucket:
+                continue
+            for namespaced_key in bucket:
+                if self._remove(namespaced_key) is not None:
+                    removed += 1
+        self._swept_until = until
+        self._expirations += removed
+        self._next_sweep = now + self.sweep_interval
+        return removed
+
+    def _store(self, namespaced_key: str, item: CacheItem, now: float):
+        self._remove(namespaced_key)
+        self.storage[namespaced_key] = item
+        self._bytes += item.size
+        self._namespaces.setdefault(item.namespace, set()).add(namespaced_key)
+        if item.tags:
+            for tag in item.tags:
+                self._tags.setdefault(tag, set()).add(namespaced_key)
+        if item.expiry is not None:
+            self._expiry_buckets.setdefault(int(item.expiry), set()).add(namespaced_key)
+        if now >= self._next_sweep:
+            self._sweep(now)
+        self._evict()
+
+    def _lookup(self, namespaced_key: str):
+        """
+        Returns a tuple of (value, is_stale). Value is `_MISSING` when there is no usable entry.
+        """
+        with self._lock:
+            item = self.storage.get(namespaced_key)
+            if item is None:
+                self._misses += 1
+                return _MISSING, False
+            now = time.time()
+            if item.expiry is not None and now >= item.expiry:
+                self._remove(namespaced_key)
+                self._expirations += 1
+                self._misses += 1
+                return _MISSING, False
+            self.storage.move_to_end(namespaced_key)
+            if item.fresh_until is not None and now >= item.fresh_until:
+                self._stale_hits += 1
+                return item.value, True
+            self._hits += 1
+            return item.value, False
+
+    ### Public API
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = 300, namespace: str = 'default', tags: Optional[Iterable[str]] = None, stale_ttl: Optional[int] = None):
+        """
+        Stores a value.
+
+        Args:
+            key: Key within the namespace.
+            value: Value to store.
+            ttl: Seconds the value is fresh for. None or 0 to never expire.
+            namespace: Namespace of the key.
+            tags: Tags used to invalidate groups of entries with `invalidate_tags()`.
+            stale_ttl: Seconds the value is kept after `ttl`, to be served stale by the decorators while it is refreshed.
+        """
+        now = time.time()
+        expiry = now + ttl + (stale_ttl or 0) if ttl else None
+        fresh_until = now + ttl if ttl and stale_ttl else None
+        namespaced_key = f"{namespace}:{key}"
+        tags = frozenset(tags) if tags else None
+        item = CacheItem(value=value, expiry=expiry, size=self._sizer(value), namespace=namespace, tags=tags, fresh_until=fresh_until)
+        with self._lock:
+            self._store(namespaced_key, item, now)
+
+    def get(self, key: str, namespace: str = 'default', default: Any = None):
+        value, stale = self._lookup(f"{namespace}:{key}")
+        if value is _MISSING or stale:
+            return default
+        return value
+
+    def sweep(self) -> int:
+        """
+        Removes all expired entries. Sweeps also run automatically from `set()`, at most once every `sweep_interval` seconds.
+
+        Returns:
+            The number of entries removed.
+        """
+        with self._lock:
+            return self._sweep(time.time())
 
     def clear(self, key: str = None, namespace: str = 'default'):
-        # from rich import print
-        # print(self.storage)
-        if key is None:
-            # Clear the entire namespace
-            self.storage = {k: v for k, v in self.storage.items() if not k.startswith(f"{namespace}:")}
+        with self._lock:
+            if key is None:
+                # Clear the entire namespace
+                for namespaced_key in list(self._namespaces.get(namespace, ())):
+                    self._remove(namespaced_key)
+            else:
+                # Clear a specific key in the namespace
+                self._remove(f"{namespace}:{key}")
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Removes every entry stored with at least one of the given tags, across all namespaces.
+
+        Returns:
+            The number of entries removed.
+        """
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for namespaced_key in list(self._tags.get(tag, ())):
+                    if self._remove(namespaced_key) is not None:
+                        removed += 1
+        return removed
+
+    def stats(self, deep: bool = False) -> Dict[str, Any]:
+        """
+        Returns cache statistics. Memory usage is the incrementally tracked estimate.
+
+        Args:
+            deep: Also measure the whole cache with pympler. This walks every cached object, so avoid it on hot paths.
+        """
+        with self._lock:
+            _stats = {
+                "entries": len(self.storage),
+                "namespaces": len(self._namespaces),
+                "tags": len(self._tags),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "stale_hits": self._stale_hits,
+                "coalesced": self._coalesced,
+                "inflight": len(self._inflight) + len(self._sync_inflight),
+            }
+        if deep:
+            from pympler import asizeof
+            _stats["deep_bytes"] = asizeof.asizeof(self.storage)
+        return _stats
+
+    ### Single-flight helpers
+
+    def _single_flight(self, namespaced_key: str, compute: Callable[[], Any]):
+        with self._lock:
+            flight = self._sync_inflight.get(namespaced_key)
+            leader = flight is None
+            if leader:
+                flight = self._sync_inflight[namespaced_key] = _Flight()
+            else:
+                self._coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = compute()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._sync_inflight.pop(namespaced_key, None)
+            flight.event.set()
+
+    async def _async_single_flight(self, namespaced_key: str, compute: Callable[[], Any]):
+        loop = asyncio.get_running_loop()
+        coalesced = False
+        while True:
+            future = self._inflight.get(namespaced_key)
+            if future is None or future.get_loop() is not loop:
+                break
+            if not coalesced:
+                self._coalesced += 1
+                coalesced = True
+            result = await asyncio.shield(future)
+            if result is not _RETRY:
+                return result
+            # The leader was cancelled (eg. its client disconnected): the first waiter to resume becomes the new leader
+        future = loop.create_future()
+        self._inflight[namespaced_key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.set_result(_RETRY)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception() # Mark as retrieved, waiters (if any) re-raise it
+            raise
         else:
-            # Clear a specific key in the namespace
-            namespaced_key = f"{namespace}:{key}"
-            self.storage.pop(namespaced_key, None)
-            
-    def cache(self, ttl: int, key: Union[Callable[[Any], str], str] = None, namespace: str = 'default'):
+            future.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(namespaced_key) is future:
+                del self._inflight[namespaced_key]
+
+    def _revalidate(self, namespaced_key: str, compute: Callable[[], Any]):
+        """ Refreshes a stale entry in a background thread, unless a refresh is already running. """
+        with self._lock:
+            if namespaced_key in self._revalidating or namespaced_key in self._sync_inflight:
+                return
+            self._revalidating.add(namespaced_key)
+        def _run():
+            try:
+                self._single_flight(namespaced_key, compute)
+            except Exception as e:
+                log.error(f"Cache revalidation failed for '{namespaced_key}': {e}")
+            finally:
+                self._revalidating.discard(namespaced_key)
+        threading.Thread(target=_run, daemon=True).start()
+
+    def _async_revalidate(self, namespaced_key: str, compute: Callable[[], Any]):
+        """ Refreshes a stale entry in a background task, unless a refresh is already running. """
+        if namespaced_key in self._revalidating or namespaced_key in self._inflight:
+            return
+        self._revalidating.add(namespaced_key)
+        async def _run():
+            try:
+                await self._async_single_flight(namespaced_key, compute)
+            except Exception as e:
+                log.error(f"Cache revalidation failed for '{namespaced_key}': {e}")
+            finally:
+                self._revalidating.discard(namespaced_key)
+        task = asyncio.get_running_loop().create_task(_run())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    ### Decorators
+
+    def cache(
+        self,
+        ttl: int,
+        key: Union[Callable[[Any], str], str] = None,
+        namespace: str = 'default',
+        tags: Union[Callable[[Any], Iterable[str]], Iterable[str]] = None,
+        stale_ttl: Optional[int] = None,
+        single_flight: bool = True,
+    ):
+        """
+        Caches the return value of a function.
+
+        Args:
+            ttl: Seconds the value is fresh for.
+            key: Cache key, or a callable receiving the function arguments and returning the key. Defaults to the function and its arguments.
+            namespace: Namespace of the cached values.
+            tags: Tags, or a callable receiving the function arguments and returning tags, stored with each value.
+            stale_ttl: If set, values are kept this many seconds after `ttl` and served stale while one background refresh runs.
+            single_flight: Concurrent misses for the same key wait for one call of the function instead of each calling it.
+        """
         def decorator(func: Callable):
             @wraps(func)
             def wrapper(*args, **kwargs):
@@ -54,15 +424,36 @@ class SimpleCache:
                     cache_key = key(*args, **kwargs)
                 else:
                     cache_key = key or str((func, args, frozenset(kwargs.items())))
-                result = self.get(cache_key, namespace=namespace)
-                if result is None:
+                namespaced_key = f"{namespace}:{cache_key}"
+
+                def compute():
                     result = func(*args, **kwargs)
-                    self.set(cache_key, result, ttl, namespace=namespace)
-                return result
+                    self.set(cache_key, result, ttl, namespace=namespace, tags=tags(*args, **kwargs) if callable(tags) else tags, stale_ttl=stale_ttl)
+                    return result
+
+                result, stale = self._lookup(namespaced_key)
+                if result is not _MISSING:
+                    if stale:
+                        self._revalidate(namespaced_key, compute)
+                    return result
+                if single_flight:
+                    return self._single_flight(namespaced_key, compute)
+                return compute()
             return wrapper
         return decorator
 
-    def async_cache(self, ttl: int, key: Union[Callable[[Any], str], str] = None, namespace: str = 'default'):
+    def async_cache(
+        self,
+        ttl: int,
+        key: Union[Callable[[Any], str], str] = None,
+        namespace: str = 'default',
+        tags: Union[Callable[[Any], Iterable[str]], Iterable[str]] = None,
+        stale_ttl: Optional[int] = None,
+        single_flight: bool = True,
+    ):
+        """
+        Caches the return value of a coroutine function. See `cache()` for the arguments.
+        """
         def decorator(func: Callable):
             @wraps(func)
             async def wrapper(*args, **kwargs):
@@ -70,13 +461,236 @@ class SimpleCache:
                     cache_key = key(*args, **kwargs)
                 else:
                     cache_key = key or str((func, args, frozenset(kwargs.items())))
-                result = self.get(cache_key, namespace=namespace)
-                if result is None:
+                namespaced_key = f"{namespace}:{cache_key}"
+
+                async def compute():
                     result = await func(*args, **kwargs)
-                    self.set(cache_key, result, ttl, namespace=namespace)
-                return result
+                    self.set(cache_key, result, ttl, namespace=namespace, tags=tags(*args, **kwargs) if callable(tags) else tags, stale_ttl=stale_ttl)
+                    return result
+
+                result, stale = self._lookup(namespaced_key)
+                if result is not _MISSING:
+                    if stale:
+                        self._async_revalidate(namespaced_key, compute)
+                    return result
+                if single_flight:
+                    return await self._async_single_flight(namespaced_key, compute)
+                return await compute()
             return wrapper
         return decorator
-    
 
-global_cache = SimpleCache()
\ No newline at end of file
+
+class _L2Unavailable(Exception):
+    """ Raised by TieredCache.redis while Redis is skipped after an error. """
+
+
+# Stores an entry and adds it to its index sets, extending the TTL of an index to its longest-lived entry.
+# Plain TTL/EXPIRE instead of EXPIRE NX/GT, which need Redis 7.
+# KEYS: the entry, then its index sets. ARGV: the payload, the TTL in seconds (0 for none).
+# Returns 1 if the entry overwrote an existing one.
+_SET_SCRIPT = """
+local existed = redis.call('EXISTS', KEYS[1])
+local ttl = tonumber(ARGV[2])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    if ttl > 0 and redis.call('TTL', KEYS[i]) < ttl then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+return existed
+"""
+
+
+class TieredCache(SimpleCache):
+    """
+    Two-tier cache: the in-process SimpleCache as L1 and Redis as a shared L2.
+
+    Misses in L1 are looked up in Redis and copied back into L1 for the remaining TTL. Writes go to both tiers.
+    `clear()`, `invalidate_tags()` and `set()` overwriting an existing key publish an invalidation on a Redis channel,
+    and every worker subscribed to it drops the matching L1 entries. If Redis is unavailable the cache keeps working as L1 only,
+    and Redis is not tried again for `retry_interval` seconds, so a down Redis does not slow down every request.
+
+    Values are serialized with pickle, so only use it with a trusted Redis instance.
+
+    Args:
+        name: Name of the cache. Keys in Redis are prefixed with it, so two caches never share entries.
+        redis: Redis connection. Defaults to `core.utils.task_manager.redis_conn`, imported on first use.
+        retry_interval: Seconds to skip Redis after a connection error.
+        **kwargs: Arguments for the L1 SimpleCache.
+    """
+
+    def __init__(self, name: str = 'global', redis=None, retry_interval: float = 30.0, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self._redis = redis
+        self.retry_interval = retry_interval
+        self._l2_retry_at = 0.0
+        self._prefix = f"{settings.PROJECT_NAME}:cache:{name}"
+        self._channel = f"{self._prefix}:invalidate"
+        self._instance_id = uuid.uuid4().hex
+        self._pubsub_thread = None
+        self._set_script = None
+        self._l2_hits = 0
+        self._l2_errors = 0
+
+    @property
+    def redis(self):
+        if time.monotonic() < self._l2_retry_at:
+            raise _L2Unavailable()
+        if self._redis is None:
+            from core.utils.task_manager import redis_conn
+            self._redis = redis_conn
+        self._subscribe()
+        return self._redis
+
+    def _l2_key(self, namespaced_key: str) -> str:
+        return f"{self._prefix}:{namespaced_key}"
+
+    def _l2_error(self, action: str, e: Exception):
+        if isinstance(e, _L2Unavailable):
+            return
+        self._l2_errors += 1
+        if action not in ("serialize", "deserialize"):
+            self._l2_retry_at = time.monotonic() + self.retry_interval
+        log.warning(f"TieredCache '{self.name}': Redis {action} failed, using in-process cache only: {e}")
+
+    ### Pub/sub invalidation
+
+    def _subscribe(self):
+        if self._pubsub_thread is not None:
+            return
+        with self._lock:
+            if self._pubsub_thread is not None:
+                return
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self._channel: self._on_invalidate})
+                self._pubsub_thread = pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+            except Exception as e:
+                self._pubsub_thread = False # Do not retry on every access
+                self._l2_error("subscribe", e)
+
+    def _publish(self, message: dict):
+        message["origin"] = self._instance_id
+        try:
+            self.redis.publish(self._channel, json.dumps(message))
+        except Exception as e:
+            self._l2_error("publish", e)
+
+    def _on_invalidate(self, message: dict):
+        try:
+            data = json.loads(message["data"])
+            if data.get("origin") == self._instance_id:
+                return
+            if data.get("tags"):
+                SimpleCache.invalidate_tags(self, *data["tags"])
+            else:
+                SimpleCache.clear(self, key=data.get("key"), namespace=data.get("namespace", "default"))
+        except Exception as e:
+            log.error(f"TieredCache '{self.name}': invalid invalidation message {message}: {e}")
+
+    ### Tiers
+
+    def _lookup(self, namespaced_key: str):
+        value, stale = super()._lookup(namespaced_key)
+        if value is not _MISSING:
+            return value, stale
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                payload, pttl = pipe.get(self._l2_key(namespaced_key)).pttl(self._l2_key(namespaced_key)).execute()
+        except Exception as e:
+            self._l2_error("get", e)
+            return _MISSING, False
+        if payload is None:
+            return _MISSING, False
+        try:
+            value, fresh_until, namespace, tags = pickle.loads(payload)
+        except Exception as e:
+            self._l2_error("deserialize", e)
+            return _MISSING, False
+        self._l2_hits += 1
+        # Copy into L1 for the remaining lifetime of the Redis key
+        now = time.time()
+        expiry = now + pttl / 1000 if pttl and pttl > 0 else None
+        item = CacheItem(value=value, expiry=expiry, size=self._sizer(value), namespace=namespace, tags=tags, fresh_until=fresh_until)
+        with self._lock:
+            self._store(namespaced_key, item, now)
+        return value, fresh_until is not None and now >= fresh_until
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = 300, namespace: str = 'default', tags: Optional[Iterable[str]] = None, stale_ttl: Optional[int] = None):
+        super().set(key, value, ttl, namespace=namespace, tags=tags, stale_ttl=stale_ttl)
+        namespaced_key = f"{namespace}:{key}"
+        with self._lock:
+            item = self.storage.get(namespaced_key)
+        if item is None:
+            return
+        try:
+            payload = pickle.dumps((value, item.fresh_until, namespace, item.tags), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self._l2_error("serialize", e)
+            return
+        l2_key = self._l2_key(namespaced_key)
+        ex = int((ttl or 0) + (stale_ttl or 0)) or None
+        # Index sets used by clear(namespace=...) and invalidate_tags()
+        indexes = [f"{self._prefix}:ns:{namespace}"] + [f"{self._prefix}:tag:{tag}" for tag in (item.tags or ())]
+        try:
+            if self._set_script is None:
+                self._set_script = self.redis.register_script(_SET_SCRIPT)
+            existed = self._set_script(keys=[l2_key, *indexes], args=[payload, ex or 0])
+        except Exception as e:
+            self._l2_error("set", e)
+            return
+        # Other workers only hold L1 copies of keys that exist in Redis, so only overwrites invalidate them
+        if existed:
+            self._publish({"namespace": namespace, "key": key})
+
+    def clear(self, key: str = None, namespace: str = 'default'):
+        super().clear(key=key, namespace=namespace)
+        try:
+            if key is None:
+                index = f"{self._prefix}:ns:{namespace}"
+                l2_keys = self.redis.smembers(index)
+                self.redis.delete(index, *l2_keys)
+            else:
+                self.redis.delete(self._l2_key(f"{namespace}:{key}"))
+        except Exception as e:
+            self._l2_error("clear", e)
+        self._publish({"namespace": namespace, "key": key})
+
+    def invalidate_tags(self, *tags: str) -> int:
+        removed = super().invalidate_tags(*tags)
+        try:
+            indexes = [f"{self._prefix}:tag:{tag}" for tag in tags]
+            l2_keys = self.redis.sunion(indexes) if indexes else set()
+            self.redis.delete(*indexes, *l2_keys)
+        except Exception as e:
+            self._l2_error("invalidate", e)
+        self._publish({"tags": list(tags)})
+        return removed
+
+    def stats(self, deep: bool = False) -> Dict[str, Any]:
+        _stats = super().stats(deep=deep)
+        _stats.update({
+            "l2_hits": self._l2_hits,
+            "l2_errors": self._l2_errors,
+            "subscribed": bool(self._pubsub_thread),
+        })
+        return _stats
+
+
+def shared_cache(name: str, **kwargs) -> SimpleCache:
+    """
+    Returns a TieredCache shared between workers when Redis caching is enabled (CACHE_REDIS and REDIS_HOST),
+    otherwise an in-process SimpleCache.
+    """
+    if settings.CACHE_REDIS and settings.REDIS_HOST:
+        return TieredCache(name, **kwargs)
+    return SimpleCache(**kwargs)
+
+
+global_cache = shared_cache('global')
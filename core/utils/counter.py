@@ -1,10 +1,15 @@
 """ Persistent counter to keep track of data across requests """
 
-import tiktoken
-encoding = tiktoken.get_encoding("cl100k_base") # gpt-4, gpt-3.5-turbo, text-embedding-ada-002
+from functools import lru_cache
 
 from core.schemas.singleton import SingletonMeta
 
+@lru_cache(maxsize=None)
+def get_encoding():
+    """ The tokenizer, loaded on first use: importing tiktoken and loading its encoding is slow. """
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base") # gpt-4, gpt-3.5-turbo, text-embedding-ada-002
+
 class Count(metaclass=SingletonMeta):
 
     def __init__(self):
@@ -49,7 +54,7 @@ class Count(metaclass=SingletonMeta):
     
     def tokens(self, text: str):
         # Tokenize the text using the tokenizer
-        return len(encoding.encode(text))
+        return len(get_encoding().encode(text))
 
         
     
\ No newline at end of file
@@ -3,23 +3,53 @@ Database Manager
 
 This utility creates and maintains connection to the main database for the application.
 It creates a connection pool to allow multiple connections to it.
-It primarily uses PyMongo for access to a MongoDB database, but can easily resort to a TinyDB, file based no-sql database.
+It primarily uses PyMongo for access to a MongoDB database, but can easily resort to a TinyDB, file based no-sql database,
+or to an SQLite database (core.utils.database_sqlite) with indexed queries, that several workers can share.
 
 This utility provides a wrapper that can be used between database types without changing the code that interacts with the database.
 
+TinyDB keeps each database file in memory, and writes it to disk every TINYDB_FLUSH_INTERVAL seconds and on shutdown,
+or at once when RQ worker processes share the file. The memory copy is reloaded when another process wrote the file.
+All operations on a TinyDB database run on a single thread owned by that database, so reads and writes never interleave,
+and async callers await them without blocking the event loop.
+
+Async code (FastAPI endpoints, NiceGUI pages) should use Database.get_async_collection(), which returns a Motor collection on MongoDB,
+and on TinyDB a wrapper running each call in a worker thread. Database.get_collection() remains the sync API, for RQ workers and scripts.
+
+Writes that do not need to be read back at once (analytics, logs) can be buffered with Database.write_behind(),
+and are sent in batches from a background thread (core.utils.database_buffer).
+
 
 """
 
 
 # db.py
-from pymongo import MongoClient
+import os
+import asyncio
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from queue import Full
+from functools import partial, wraps
+from collections import OrderedDict
+import random
+from pymongo import MongoClient, IndexModel
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.results import DeleteResult, BulkWriteResult
+from core.config import settings
 from core.utils.logging import logger as log
-from core.utils.dict import dict_walk
+from core.utils.database_sqlite import SQLiteDatabase
+from core.utils.database_metrics import DatabaseMetrics, DatabaseCommandListener, MeteredCollection, query_shape
+from core.utils.database_buffer import WriteBuffer, WriteRequest
 
 # TinyDB - MongoDB alternative with MongoDB compatibility
 from tinymongo import TinyMongoClient, TinyMongoDatabase, TinyMongoCollection
+from tinymongo.tinymongo import TinyMongoCursor, InsertManyResult
 from tinymongo.serializers import DateTimeSerializer
 from tinydb_serialization import SerializationMiddleware, Serializer
+from tinydb import where
+from tinydb.database import Table, Document
+from tinydb.middlewares import CachingMiddleware
 from bson.objectid import ObjectId
 
 
@@ -66,41 +96,616 @@ class ObjectIdSerializer(Serializer):
     def decode(self, s):
         return ObjectId(s)
 
+class _QueryFrame:
+    """ A dict or list being normalised by normalize_query(). """
+    __slots__ = ('container', 'key', 'is_dict', 'items', 'values', 'frozen', 'changed')
+    
+    def __init__(self, container, key=None):
+        self.container = container
+        self.key = key
+        self.is_dict = isinstance(container, dict)
+        self.items = iter(container.items()) if self.is_dict else enumerate(container)
+        self.values = []
+        self.frozen = []
+        self.changed = False
+    
+    def add(self, key, original, value, frozen):
+        self.values.append((key, value) if self.is_dict else value)
+        self.changed = self.changed or value is not original
+        if frozen is None:
+            self.frozen = None
+        elif self.frozen is not None:
+            self.frozen.append((key, frozen) if self.is_dict else frozen)
+    
+    def result(self):
+        value = (dict(self.values) if self.is_dict else self.values) if self.changed else self.container
+        frozen = None if self.frozen is None else ('{' if self.is_dict else '[', tuple(self.frozen))
+        return value, frozen
+
+
+def _normalize_leaf(value):
+    if isinstance(value, ObjectId):
+        value = str(value)
+    try:
+        hash(value)
+    except TypeError:
+        return value, None
+    return value, (type(value), value)
+
+
+def normalize_query(query):
+    """
+    Converts the ObjectId values of a MongoDB query to str, for TinyDB. Iterative, and only copies the dicts and lists
+    that contain an ObjectId: a query without ObjectIds is returned as is. The caller's query is never modified.
+    
+    Returns:
+        The normalised query, and a hashable key of it, or None if a value is not hashable.
+    """
+    if not isinstance(query, (dict, list)):
+        return _normalize_leaf(query)
+    stack = [_QueryFrame(query)]
+    while True:
+        frame = stack[-1]
+        for key, value in frame.items:
+            if isinstance(value, (dict, list)):
+                stack.append(_QueryFrame(value, key))
+                break
+            frame.add(key, value, *_normalize_leaf(value))
+        else:
+            stack.pop()
+            value, frozen = frame.result()
+            if not stack:
+                return value, frozen
+            stack[-1].add(frame.key, frame.container, value, frozen)
+
+
+def _on_database_thread(method):
+    """
+    Runs a collection method on the thread of its TinyDB database.
+    """
+    @wraps(method)
+    def run(self, *args, **kwargs):
+        return self.parent.run(method, self, *args, **kwargs)
+    return run
+
+
+class SharedFileCachingMiddleware(CachingMiddleware):
+    """
+    CachingMiddleware for a database file other processes may write to, eg. RQ workers.
+    The cache is reloaded when the file changed on disk (mtime or size) since this process last read or wrote it,
+    and `generation` is incremented so the tables drop what they derived from the previous content.
+    Writes are only batched (WRITE_CACHE_SIZE > 1) when no other process writes to the file, as a batch flushed after
+    another process wrote the file overwrites its changes.
+    """
+    def __init__(self, storage_cls):
+        super().__init__(storage_cls)
+        self.generation = 0
+        self._stat = None
+    
+    def _file_stat(self):
+        try:
+            stat = os.fstat(self.storage._handle.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def refresh(self) -> int:
+        """ Drops the cache if another process changed the file. Returns the generation of the cache. """
+        if self.cache is not None and self._file_stat() != self._stat:
+            if self._cache_modified_count:
+                log.warning("TinyDB file changed on disk while writes were pending, they overwrite the other process's changes.")
+                self._stat = self._file_stat()
+            else:
+                self.cache = None
+                self.generation += 1
+        return self.generation
+    
+    def read(self):
+        self.refresh()
+        if self.cache is None:
+            self.cache = self.storage.read()
+            self._stat = self._file_stat()
+        return self.cache
+    
+    def flush(self):
+        if self._cache_modified_count > 0:
+            super().flush()
+            self._stat = self._file_stat()
+    
+    def reset(self):
+        """ Drops the cache and any pending write, eg. in a forked child: the parent flushed them before the fork. """
+        self.cache = None
+        self._cache_modified_count = 0
+        self.generation += 1
+
+
+class DragonTinyTable(Table):
+    """
+    TinyDB table counting its writes, so the in-memory indexes of DragonTinyMongoCollection know when to rebuild.
+    When another process changed the file, its query cache and last doc id are reset before the next operation.
+    """
+    def __init__(self, *args, **kwargs):
+        self.version = 0
+        self._generation = None
+        super().__init__(*args, **kwargs)
+    
+    def _sync(self):
+        storage = self._storage._storage
+        if not isinstance(storage, SharedFileCachingMiddleware):
+            return
+        generation = storage.refresh()
+        if self._generation is None:
+            # First read, from Table.__init__
+            self._generation = generation
+        if generation == self._generation:
+            return
+        self._generation = generation
+        self.version += 1
+        self.clear_cache()
+        self._init_last_id(self._read())
+    
+    def _get_next_id(self):
+        self._sync()
+        return super()._get_next_id()
+    
+    def _read(self):
+        self._sync()
+        return super()._read()
+    
+    def search(self, cond):
+        self._sync()
+        return super().search(cond)
+    
+    def _write(self, values):
+        self.version += 1
+        super()._write(values)
+    
+    def raw(self) -> dict:
+        """
+        The table's documents by doc id, as held by the storage. TinyDB builds a Document of every row on each _read(),
+        so lookups by doc id read the storage directly.
+        """
+        self._sync()
+        return self._storage._storage.read().get(self.name, {})
+
+
+# Index key of the documents whose value cannot be hashed, always returned as candidates
+_UNHASHABLE = object()
+
+
 class DragonTinyMongoCollection(TinyMongoCollection):
     def __init__(self, table, parent=None):
         super().__init__(table, parent)
+        # In-memory secondary indexes: IndexModel documents by name, and raw doc ids by value per indexed field.
+        # _id is always indexed, like on MongoDB.
+        self._index_specs = {}
+        self._index_values = {}
+    
+    insert = _on_database_thread(TinyMongoCollection.insert)
+    update = _on_database_thread(TinyMongoCollection.update)
+    remove = _on_database_thread(TinyMongoCollection.remove)
+    delete_one = _on_database_thread(TinyMongoCollection.delete_one)
 
+    # Parsed TinyDB queries by normalised query, shared by all collections
+    _parsed_queries = OrderedDict()
+    _parsed_queries_lock = threading.Lock()
+    parsed_queries_size = 1024
+    
     # Hook into this method to type check the _id field.
     # for TinyDB compatibility, we need to convert the _id field to a string
     def parse_query(self, query):
-        if query != {} or not query is None:
-            query = dict_walk(query, lambda k,v: str(v) if isinstance(v, ObjectId) else v)
-        return super().parse_query(query)
+        """
+        Parses a MongoDB query into a TinyDB query. ObjectIds are converted to str, and parsed queries are cached,
+        as TinyMongo deep copies the query at every level while parsing it.
+        """
+        if not query:
+            query, key = {}, ('{', ())
+        else:
+            query, key = normalize_query(query)
+        if key is None:
+            return super().parse_query(query)
+        cache = DragonTinyMongoCollection._parsed_queries
+        with DragonTinyMongoCollection._parsed_queries_lock:
+            parsed = cache.get(key)
+            if parsed is not None:
+                cache.move_to_end(key)
+                return parsed
+        parsed = super().parse_query(query)
+        with DragonTinyMongoCollection._parsed_queries_lock:
+            cache[key] = parsed
+            if len(cache) > self.parsed_queries_size:
+                cache.popitem(last=False)
+        return parsed
+    
+    def build_table(self):
+        self.table = self.parent.tinydb.table(self.tablename, table_class=DragonTinyTable)
+    
+    def _indexed_fields(self) -> dict:
+        """ Indexed fields, with the name of their index. Only the first key of a compound index is used. """
+        fields = {"_id": "_id_"}
+        for name, spec in self._index_specs.items():
+            field, direction = next(iter(spec["key"].items()))
+            if direction in (1, -1):
+                fields.setdefault(field, name)
+        return fields
+    
+    def _index(self, field: str) -> dict:
+        """ Doc ids by value of a field. Built on first use, and again after the table was written to, except by inserts. """
+        if self.table is None:
+            self.build_table()
+        cached = self._index_values.get(field)
+        if cached is not None and cached[0] == self.table.version:
+            return cached[1]
+        index = {}
+        for key, document in self.table.raw().items():
+            self._index_add(index, document.get(field), int(key))
+        self._index_values[field] = (self.table.version, index)
+        return index
+    
+    @staticmethod
+    def _index_add(index: dict, value, doc_id: int):
+        try:
+            index.setdefault(value, []).append(doc_id)
+        except TypeError:
+            index.setdefault(_UNHASHABLE, []).append(doc_id)
+    
+    def _index_inserted(self, doc_id: int, document: dict):
+        """ Adds an inserted document to the indexes that were current before its insert, instead of rebuilding them. """
+        for field, (version, index) in self._index_values.items():
+            if version == self.table.version - 1:
+                self._index_add(index, document.get(field), doc_id)
+                self._index_values[field] = (self.table.version, index)
+    
+    def _plan(self, query):
+        """
+        Returns the index field and values an equality or $in condition of the query can be looked up with, or None to scan.
+        """
+        if not isinstance(query, dict):
+            return None
+        fields = self._indexed_fields()
+        for field, value in query.items():
+            if field not in fields:
+                continue
+            if isinstance(value, dict):
+                if len(value) != 1 or not ("$in" in value and isinstance(value["$in"], list) or "$eq" in value):
+                    continue
+                values = value["$in"] if "$in" in value else [value["$eq"]]
+            else:
+                values = [value]
+            values = [str(value) if isinstance(value, ObjectId) else value for value in values]
+            try:
+                set(values)
+            except TypeError:
+                continue
+            if None not in values:
+                return field, values
+        return None
+    
+    def _search(self, query) -> list:
+        """ Documents matching a query, looked up with an index when one applies. """
+        if self.table is None:
+            self.build_table()
+        cond = self.parse_query(query)
+        plan = self._plan(query)
+        if plan is None:
+            try:
+                return self.table.search(cond)
+            except (AttributeError, TypeError):
+                return []
+        field, values = plan
+        index = self._index(field)
+        doc_ids = sorted({doc_id for value in values + [_UNHASHABLE] for doc_id in index.get(value, ())})
+        # Keys are str when the table was loaded from the file, and int once it was written to
+        table = self.table.raw()
+        documents = []
+        for doc_id in doc_ids:
+            document = table.get(doc_id, table.get(str(doc_id)))
+            if document is not None:
+                documents.append(Document(document, doc_id))
+        try:
+            return [document for document in documents if cond(document)]
+        except (AttributeError, TypeError):
+            return []
+    
+    @_on_database_thread
+    def find(self, filter=None, sort=None, skip=None, limit=None, *args, **kwargs):
+        return TinyMongoCursor(self._search(filter), sort=sort, skip=skip, limit=limit)
+    
+    @_on_database_thread
+    def find_one(self, filter=None):
+        documents = self._search(filter)
+        return documents[0] if documents else None
+    
+    @_on_database_thread
+    def count_documents(self, filter=None, skip: int = 0, limit: int = None, **kwargs) -> int:
+        """
+        Number of matching documents, with the skip and limit of PyMongo. Unindexed queries stop scanning the table once
+        skip + limit documents matched.
+        """
+        skip = skip or 0
+        if self._plan(filter) is not None:
+            count = len(self._search(filter))
+        else:
+            if self.table is None:
+                self.build_table()
+            cond = self.parse_query(filter)
+            stop = skip + limit if limit else None
+            count = 0
+            try:
+                for document in self.table.raw().values():
+                    if cond(document):
+                        count += 1
+                        if count == stop:
+                            break
+            except (AttributeError, TypeError):
+                count = 0
+        count = max(count - skip, 0)
+        return min(count, limit) if limit else count
+    
+    def _check_unique(self, documents: list, exclude=()):
+        """
+        Raises DuplicateKeyError if a document would duplicate the value of a unique index.
+        Documents whose doc id is in `exclude` are ignored, as they are the ones being updated.
+        """
+        for name, spec in self._index_specs.items():
+            if not spec.get("unique"):
+                continue
+            field = next(iter(spec["key"]))
+            index = self._index(field)
+            seen = set()
+            for document in documents:
+                value = document.get(field)
+                if value is None:
+                    continue
+                value = str(value) if isinstance(value, ObjectId) else value
+                if value in seen or any(doc_id not in exclude for doc_id in index.get(value, ())):
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.tablename} index: {name} dup key: {{{field}: {value!r}}}", 11000)
+                seen.add(value)
+    
+    @_on_database_thread
+    def insert_one(self, doc, *args, **kwargs):
+        self._check_unique([doc])
+        result = TinyMongoCollection.insert_one(self, doc, *args, **kwargs)
+        self._index_inserted(result.eid, doc)
+        return result
+    
+    @_on_database_thread
+    def insert_many(self, docs, ordered: bool = True, *args, **kwargs):
+        """
+        Inserts the documents one by one. A duplicate key raises a BulkWriteError, like MongoDB: an ordered insert stops at
+        the first duplicate, an unordered one inserts every other document.
+        """
+        if self.table is None:
+            self.build_table()
+        if not isinstance(docs, list):
+            raise ValueError('"insert_many" requires a list input')
+        results, write_errors = [], []
+        for index, doc in enumerate(docs):
+            try:
+                results.append(self.insert_one(doc, *args, **kwargs))
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": [], "nInserted": len(results), "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(eids=[result.eid for result in results], inserted_ids=[result.inserted_id for result in results])
+    
+    @_on_database_thread
+    def update_one(self, query, doc, *args, **kwargs):
+        """ TinyMongo update of every matching document, checking the unique indexes on the values it sets first. """
+        values = doc["$set"] if "$set" in doc else doc
+        unique_fields = {next(iter(spec["key"])) for spec in self._index_specs.values() if spec.get("unique")}
+        if unique_fields & set(values):
+            matched = [int(document.doc_id) for document in self._search(query)]
+            # Every matched document gets the same values, so two matches are duplicates of each other
+            self._check_unique([values] * len(matched), exclude=set(matched))
+        return TinyMongoCollection.update_one(self, query, doc, *args, **kwargs)
+    
+    def create_index(self, keys, **kwargs) -> str:
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+    
+    def create_indexes(self, indexes: list, **kwargs) -> list:
+        """
+        Registers pymongo.IndexModel indexes. They are kept in memory: equality and $in lookups on the first key of an index
+        no longer scan the collection, and unique indexes are enforced on inserts and updates.
+        """
+        names = []
+        for index in indexes:
+            document = index.document
+            self._index_specs[document["name"]] = {"key": dict(document["key"]), "unique": bool(document.get("unique"))}
+            names.append(document["name"])
+        return names
+    
+    def index_information(self) -> dict:
+        information = {"_id_": {"key": [("_id", 1)]}}
+        for name, spec in self._index_specs.items():
+            information[name] = {"key": list(spec["key"].items()), **({"unique": True} if spec["unique"] else {})}
+        return information
+    
+    def drop_index(self, name: str):
+        self._index_specs.pop(name, None)
+    
+    def explain(self, filter=None, sort=None) -> dict:
+        """ Query plan of find(filter), in the shape of a MongoDB explain(): an IXSCAN on an index, or a COLLSCAN. """
+        plan = self._plan(filter)
+        if plan is None:
+            return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+        field = plan[0]
+        return {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": self._indexed_fields()[field], "keyPattern": {field: 1}}}}}
+    
+    @_on_database_thread
+    def delete_many(self, query):
+        """
+        Removes all matching items with a single TinyDB write, instead of one write per item.
+        Returns a PyMongo DeleteResult, so deleted_count is available like on MongoDB.
+        """
+        ids = [item['_id'] for item in self.find(query)]
+        if self.table is None:
+            self.build_table()
+        removed = self.table.remove(where('_id').one_of(ids)) if ids else []
+        return DeleteResult({'n': len(removed)}, True)
+    
     
+    @_on_database_thread
+    def bulk_write(self, requests, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        """
+        Applies InsertOne, UpdateOne, UpdateMany, DeleteOne and DeleteMany requests one by one, on the database thread.
+        TinyMongo updates every matching document, for UpdateOne too. Duplicate keys raise a BulkWriteError, like MongoDB.
+        """
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            try:
+                if kind == "InsertOne":
+                    self.insert_one(request._doc)
+                    result["nInserted"] += 1
+                elif kind in ("UpdateOne", "UpdateMany"):
+                    updated = len(self.update_one(request._filter, request._doc).raw_result or [])
+                    result["nMatched"] += updated
+                    result["nModified"] += updated
+                elif kind == "DeleteOne":
+                    if self.find_one(request._filter) is not None:
+                        result["nRemoved"] += self.delete_one(request._filter).deleted_count
+                elif kind == "DeleteMany":
+                    result["nRemoved"] += self.delete_many(request._filter).deleted_count
+                else:
+                    raise OperationFailure(f"Unsupported bulk write request on TinyDB: {kind}")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
         
 class DragonTinyMongoDatabase(TinyMongoDatabase):
+    """
+    TinyDB database file, with a single thread running every operation on it.
+    The storage caches the file in memory, and a background timer flushes pending writes every TINYDB_FLUSH_INTERVAL seconds.
+    """
+    def __init__(self, database, foldername, storage):
+        self._name = database
+        self._collections = {}
+        self._closed = False
+        self._start_threads()
+        self.run(super().__init__, database, foldername, storage)
+        atexit.register(self.close)
+        # Threads do not survive a fork (eg. RQ work horses), start new ones in the child
+        os.register_at_fork(before=self.flush, after_in_child=self._after_fork_in_child)
+    
+    def _after_fork_in_child(self):
+        """
+        The child shares the file with its parent, and RQ work horses end with os._exit(), which skips the atexit flush:
+        the child reloads the file and writes every change to disk at once.
+        """
+        self._start_threads()
+        storage = self.tinydb._storage
+        if isinstance(storage, SharedFileCachingMiddleware):
+            storage.reset()
+            storage.WRITE_CACHE_SIZE = 1
+    
+    def _start_threads(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"tinydb-{self._name}")
+        self._thread_id = self._executor.submit(threading.get_ident).result()
+        self._stop_flushing = threading.Event()
+        if settings.TINYDB_FLUSH_INTERVAL:
+            threading.Thread(target=self._flush_periodically, name=f"tinydb-{self._name}-flush", daemon=True).start()
+    
+    def run(self, func, *args, **kwargs):
+        """
+        Runs func on the database thread and waits for the result. Called from the database thread, it runs directly.
+        """
+        if threading.get_ident() == self._thread_id:
+            return func(*args, **kwargs)
+        return self._executor.submit(func, *args, **kwargs).result()
+    
+    async def run_async(self, func, *args, **kwargs):
+        """
+        Awaitable version of run(), for the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
+    def flush(self):
+        """
+        Writes pending changes to disk.
+        """
+        storage = self.tinydb._storage
+        if hasattr(storage, 'flush'):
+            self.run(storage.flush)
+    
+    def _flush_periodically(self):
+        while not self._stop_flushing.wait(settings.TINYDB_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f"Failed to flush TinyDB: {e}")
+    
+    def close(self):
+        """
+        Flushes pending changes and stops the database thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop_flushing.set()
+        try:
+            try:
+                self.run(self.tinydb.close)
+            except RuntimeError:
+                # Interpreter exit: the executor is already shut down and its thread has finished
+                self.tinydb.close()
+        except Exception as e:
+            log.error(f"Failed to close TinyDB: {e}")
+        self._executor.shutdown(wait=True)
+        
     def get(self, name):
-        return DragonTinyMongoCollection(name, self)
+        """Gets a new or existing collection. Collections are created once per name."""
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections.setdefault(name, DragonTinyMongoCollection(name, self))
+        return collection
+    
     def __getattr__(self, name):
         """Gets a new or existing collection"""
-        return DragonTinyMongoCollection(name, self)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get(name)
 
     def __getitem__(self, name):
         """Gets a new or existing collection"""
-        return DragonTinyMongoCollection(name, self)
+        return self.get(name)
     
 class DragonTinyMongoClient(TinyMongoClient):
+    def __init__(self, foldername=u"tinydb"):
+        super().__init__(foldername)
+        self._databases = {}
+        self._lock = threading.Lock()
+    
     @property
     def _storage(self):
+        """
+        New storage stack for one database file. Only built once per database, as databases are created once per name.
+        """
         serialization = SerializationMiddleware()
         serialization.register_serializer(DateTimeSerializer(), 'TinyDate')
         serialization.register_serializer(ObjectIdSerializer(), 'TinyObjectId')
         # register other custom serializers
-        return serialization        
+        # Reads are served from memory, and reloaded when another process wrote the file.
+        # Writes are batched and flushed by DragonTinyMongoDatabase, unless jobs run in an RQ worker process writing to the same file.
+        shared = settings.REDIS_HOST and not settings.RQ_BYPASS_WORKER
+        caching = SharedFileCachingMiddleware(serialization)
+        caching.WRITE_CACHE_SIZE = settings.TINYDB_WRITE_CACHE_SIZE if settings.TINYDB_FLUSH_INTERVAL and not shared else 1
+        return caching
         # return JsonSafeStorage
         
     def get(self, name):
-        return DragonTinyMongoDatabase(name, self._foldername, self._storage)
+        """Gets a new or existing database. Each database file is opened once, with its own storage and thread."""
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = DragonTinyMongoDatabase(name, self._foldername, self._storage)
+            return self._databases[name]
     
     def __getitem__(self, key):
         """Gets a new or existing database based in key"""
@@ -110,27 +715,132 @@ class DragonTinyMongoClient(TinyMongoClient):
     def __getattr__(self, name):
         """Gets a new or existing database based in attribute"""
         # return DragonTinyMongoDatabase(name, self._foldername, self._storage)
+        if name.startswith('_'):
+            raise AttributeError(name)
         return self.get(name)
 
 
 
 
+class AsyncCursor:
+    """
+    Awaitable version of a sync find() or aggregate(), with the Motor cursor API used in the app: to_list() and async iteration.
+    """
+    def __init__(self, method, args, kwargs):
+        self._method = method
+        self._args = args
+        self._kwargs = kwargs
+        
+    def _fetch(self, length=None):
+        docs = list(self._method(*self._args, **self._kwargs))
+        return docs[:length] if length else docs
+        
+    async def to_list(self, length=None):
+        return await Database.run_sync(self._fetch, length)
+    
+    async def __aiter__(self):
+        for doc in await self.to_list():
+            yield doc
+
+
+class AsyncCollection:
+    """
+    Awaitable wrapper of a sync collection, with the same methods as a Motor collection.
+    Used for TinyDB and SQLite, and for MongoDB when Motor is not installed. Each call runs in a worker thread, so it does not block the event loop.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+    
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find, args, kwargs)
+    
+    def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self.collection.aggregate, args, kwargs)
+    
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        async def run(*args, **kwargs):
+            return await Database.run_sync(method, *args, **kwargs)
+        return run
+
+
+def suggest_index(query, sort=None) -> list:
+    """
+    Index keys for a query, following the equality, sort, range rule: fields compared for equality first, then the sort keys,
+    then the fields of range, regex and $or conditions.
+    """
+    equality, ranges = [], []
+    def visit(query, conditions):
+        for key, value in (query or {}).items():
+            if key == "$and":
+                for item in value:
+                    visit(item, conditions)
+            elif key in ("$or", "$nor"):
+                for item in value:
+                    visit(item, ranges)
+            elif key.startswith("$"):
+                continue
+            elif isinstance(value, dict) and any(operator.startswith("$") for operator in value):
+                (conditions if set(value) <= {"$eq", "$in"} else ranges).append(key)
+            else:
+                conditions.append(key)
+    visit(query, equality)
+    keys = []
+    for field, direction in [(field, 1) for field in equality] + list(sort or []) + [(field, 1) for field in ranges]:
+        if field not in [key for key, _ in keys]:
+            keys.append((field, direction))
+    return keys
+
+
+def _plan_stages(plan) -> list:
+    """ Names of all the stages of an explain() result. """
+    if isinstance(plan, dict):
+        return ([plan["stage"]] if isinstance(plan.get("stage"), str) else []) + [stage for value in plan.values() for stage in _plan_stages(value)]
+    if isinstance(plan, list):
+        return [stage for value in plan for stage in _plan_stages(value)]
+    return []
+
+
 class Database:
     """
     Database manager class. 
     Basic usage:
         If databases have been loaded and indexes created:
             data = Database.get_collection('modules').find_one({"module_name": 'module_to_search_for'})
+        From async code:
+            data = await Database.get_async_collection('modules').find_one({"module_name": 'module_to_search_for'})
         If no connection previously made
     """    
     client: MongoClient = None
+    async_client = None
     tinydb_client = None
     db = None
+    async_db = None
     collection = None
     using_tinydb = False
+    using_sqlite = False
+    # Collections by name, created once per connection
+    _collections = {}
+    _async_collections = {}
+    # Query shapes already reported by log_collscan()
+    _collscans = set()
+    # Write-behind buffer of write_behind(), started on first use
+    _write_buffer: WriteBuffer = None
+    _write_buffer_lock = threading.Lock()
 
     @classmethod
     def connect(cls, url: str, dbname: str):
+        cls._collections = {}
+        cls._async_collections = {}
+        cls.using_tinydb = cls.using_sqlite = False
+        if url.startswith('sqlite'):
+            try:
+                cls.using_sqlite = True
+                cls.db = SQLiteDatabase.from_url(url, dbname)
+            except Exception as e:
+                log.error(f"Failed to connect to SQLite: {e}")
+                raise e
+            return True
         if 'tinydb' in url:
             # Using TinyDB!
             try:
@@ -140,24 +850,151 @@ class Database:
             except Exception as e:
                 log.error(f"Failed to connect to TinyDB: {e}")
                 raise e
-            return
+            return True
             
-        cls.client = MongoClient(url, maxPoolSize=50, minPoolSize=10)
+        options = dict(maxPoolSize=settings.MONGODB_MAX_POOL_SIZE, minPoolSize=settings.MONGODB_MIN_POOL_SIZE)
+        if DatabaseMetrics.enabled():
+            options["event_listeners"] = [DatabaseCommandListener()]
+        cls.client = MongoClient(url, **options)
         cls.db = cls.client[dbname]
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            cls.async_client = AsyncIOMotorClient(url, **options)
+            cls.async_db = cls.async_client[dbname]
+        except ImportError:
+            log.warning("Motor is not installed. Database.get_async_collection() will run PyMongo queries in a worker thread.")
         return True
 
     @classmethod
     def close(cls):
+        if cls._write_buffer is not None:
+            # Buffered writes are written before the connection closes
+            cls._write_buffer.close()
+            cls._write_buffer = None
         if cls.client is not None:
             cls.client.close()
+        if (cls.using_tinydb or cls.using_sqlite) and cls.db is not None:
+            cls.db.close()
+        if cls.async_client is not None:
+            cls.async_client.close()
 
     @classmethod
     def get_collection(cls, collection_name):
+        collection = cls._collections.get(collection_name)
+        if collection is None:
+            collection = cls.db.get(collection_name) if cls.using_tinydb else cls.db[collection_name]
+            if (cls.using_tinydb or cls.using_sqlite) and DatabaseMetrics.enabled():
+                # MongoDB commands are recorded by the client's DatabaseCommandListener
+                collection = MeteredCollection(collection, collection_name)
+            cls._collections[collection_name] = collection
+        cls.collection = collection
+        return collection
+    
+    @classmethod
+    def get_async_collection(cls, collection_name):
+        """
+        Returns a collection whose methods are awaited: a Motor collection on MongoDB, or an AsyncCollection on TinyDB and SQLite.
+        
+        Usage:
+            document = await Database.get_async_collection('modules').find_one({"module_name": name})
+            documents = await Database.get_async_collection('modules').find({}).to_list(None)
+        """
+        collection = cls._async_collections.get(collection_name)
+        if collection is None:
+            collection = cls.async_db[collection_name] if cls.async_db is not None else AsyncCollection(cls.get_collection(collection_name))
+            cls._async_collections[collection_name] = collection
+        return collection
+    
+    @classmethod
+    def explain(cls, collection_name: str, filter: dict = None, sort: list = None) -> dict:
+        """
+        Query plan of a find() on the collection, as returned by MongoDB's explain(). TinyDB and SQLite return the same shape,
+        with an IXSCAN stage when an index is used, and a COLLSCAN stage when every document is read.
+        """
+        collection = cls.get_collection(collection_name)
+        if cls.using_tinydb:
+            return collection.explain(filter, sort)
+        return collection.find(filter or {}, sort=sort or None).explain()
+    
+    @classmethod
+    def explain_sampled(cls) -> bool:
+        """ Whether to explain the current query, for the DATABASE_EXPLAIN_SAMPLE_RATE of queries. """
+        return settings.DATABASE_EXPLAIN_SAMPLE_RATE > 0 and random.random() < settings.DATABASE_EXPLAIN_SAMPLE_RATE
+    
+    @classmethod
+    def log_collscan(cls, collection_name: str, filter: dict = None, sort: list = None):
+        """
+        Explains a find(), and logs the collection, filter shape and a suggested index if it scans the whole collection.
+        Each shape is logged as a warning once, then at debug level. Listing a collection without filter or sort is not reported.
+        """
+        if not filter and not sort:
+            return
+        try:
+            plan = cls.explain(collection_name, filter, sort)
+        except Exception as e:
+            log.debug(f"Failed to explain a query on {collection_name}: {e}")
+            return
+        if "COLLSCAN" not in _plan_stages(plan):
+            return
+        shape = query_shape(filter or {})
+        key = (collection_name, repr(shape), repr(sort))
+        level = "DEBUG" if key in cls._collscans else "WARNING"
+        cls._collscans.add(key)
+        keys = suggest_index(filter, sort)
+        suggestion = f"IndexModel({keys})" if keys else "none, the filter has no indexable field"
+        log.log(level, f"COLLSCAN on {collection_name}: filter {shape}, sort {sort}. Suggested index: {suggestion}")
+    
+    @classmethod
+    def write_buffer(cls) -> WriteBuffer:
+        if cls._write_buffer is None:
+            with cls._write_buffer_lock:
+                if cls._write_buffer is None:
+                    cls._write_buffer = WriteBuffer(cls.get_collection)
+        return cls._write_buffer
+    
+    @classmethod
+    def write_behind(cls, collection_name: str, request: WriteRequest, timeout: float = None) -> Future:
+        """
+        Buffers a document to insert, or a PyMongo write request (UpdateOne, DeleteOne...), and returns without waiting for the database.
+        Buffered writes are sent in batches from a background thread, see core.utils.database_buffer.
+        Blocks while the buffer is full. The returned Future resolves once the write is durable.
+        
+        Usage:
+            Database.write_behind('shlink_analytics', analytics.model_dump())
+            Database.write_behind('shlink_analytics', document).result()  # Wait for the write
+        """
+        return cls.write_buffer().put(collection_name, request, timeout=timeout)
+    
+    @classmethod
+    async def write_behind_async(cls, collection_name: str, request: WriteRequest) -> Future:
+        """
+        write_behind() for the event loop: waits for room in a full buffer without blocking the loop.
+        
+        Usage:
+            future = await Database.write_behind_async('shlink_analytics', document)
+            _id = await asyncio.wrap_future(future)  # Optional: wait for the write
+        """
+        buffer = cls.write_buffer()
+        try:
+            return buffer.put(collection_name, request, block=False)
+        except Full:
+            return await asyncio.to_thread(buffer.put, collection_name, request)
+    
+    @classmethod
+    def flush_writes(cls, timeout: float = None) -> bool:
+        """ Writes every buffered write now, and waits for them. Returns False on timeout. """
+        if cls._write_buffer is None:
+            return True
+        return cls._write_buffer.flush(timeout)
+    
+    @classmethod
+    async def run_sync(cls, func, *args, **kwargs):
+        """
+        Runs a blocking database call without blocking the event loop: on the TinyDB database thread, or in a worker thread.
+        """
         if cls.using_tinydb:
-            cls.collection = cls.db.get(collection_name)
-        else:        
-            cls.collection = cls.db[collection_name]
-        return cls.db[collection_name]
+            return await cls.db.run_async(func, *args, **kwargs)
+        return await asyncio.to_thread(func, *args, **kwargs)
     
     
     
@@ -0,0 +1,166 @@
+"""
+Write-behind buffer.
+
+Collects documents to insert, and other PyMongo write requests, per collection, and writes them in batches from a
+background thread: with insert_many() when a batch only holds inserts, with bulk_write() otherwise. A batch is written
+when DATABASE_WRITE_BUFFER_SIZE writes are pending, DATABASE_WRITE_BUFFER_INTERVAL seconds after its oldest write,
+on flush(), and on close(), which Database.close() calls on shutdown.
+
+At most DATABASE_WRITE_BUFFER_MAX_PENDING writes are held in memory: put() blocks while the buffer is full.
+Each write returns a Future, resolved with the _id of an inserted document (None for other requests) once written,
+or with the error that failed it, for callers that must know their write is durable.
+
+Used through Database.write_behind().
+"""
+import os
+import time
+import atexit
+import threading
+from queue import Full
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Tuple, Union
+
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import BulkWriteError
+
+from core.config import settings
+from core.utils.logging import logger as log
+
+WriteRequest = Union[dict, InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany]
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer of all collections, written by one background thread.
+    Usage:
+        future = buffer.put("shlink_analytics", {"short_id": "abc123"})
+        future.result()  # Optional: wait until the document is written
+        buffer.flush()   # Write everything pending now
+    """
+    def __init__(self, get_collection: Callable, size: int = None, interval: float = None, max_pending: int = None):
+        self._get_collection = get_collection
+        self.size = size or settings.DATABASE_WRITE_BUFFER_SIZE
+        self.interval = settings.DATABASE_WRITE_BUFFER_INTERVAL if interval is None else interval
+        self.max_pending = max(max_pending or settings.DATABASE_WRITE_BUFFER_MAX_PENDING, self.size)
+        self._start()
+        atexit.register(self.close)
+        # The thread does not survive a fork (eg. RQ work horses). Writes pending in the parent are the parent's.
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._condition = threading.Condition()
+        self._pending: Dict[str, List[Tuple[object, Future]]] = {}
+        self._count = 0
+        # Writes taken by the thread and not written yet, still counted against max_pending
+        self._writing = 0
+        self._busy = False
+        self._oldest = None
+        self._flush_requested = False
+        self._generation = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="database-write-buffer", daemon=True)
+        self._thread.start()
+
+    def put(self, collection_name: str, request: WriteRequest, block: bool = True, timeout: float = None) -> Future:
+        """
+        Adds a document to insert, or a PyMongo write request, to the collection's batch.
+        While max_pending writes are pending, waits for them to be written, or raises queue.Full without block or after timeout.
+        """
+        if isinstance(request, dict):
+            request = InsertOne(request)
+        future = Future()
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._closed or self._count + self._writing < self.max_pending, timeout if block else 0):
+                raise Full(f"Write buffer is full: {self.max_pending} writes pending")
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+            self._pending.setdefault(collection_name, []).append((request, future))
+            self._count += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._count >= self.size or self._count == 1:
+                # Wake the thread to write the batch, or to wait for the interval of its first write
+                self._condition.notify_all()
+        return future
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Writes every pending write, and waits until they are written. Returns False on timeout. """
+        with self._condition:
+            if self._closed and not self._thread.is_alive():
+                return not self._count
+            # A batch being written was taken before this call, and the writes added since need the next one
+            target = self._generation + (2 if self._busy else 1)
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._generation >= target, timeout)
+
+    def close(self, timeout: float = None):
+        """ Writes every pending write and stops the thread. Later writes raise RuntimeError. """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"pending": self._count, "writing": self._writing, "batches": self._generation, "max_pending": self.max_pending}
+
+    def _due(self) -> bool:
+        return (
+            self._closed or self._flush_requested or self._count >= self.size
+            or (self._oldest is not None and time.monotonic() - self._oldest >= self.interval)
+        )
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due():
+                    self._condition.wait(None if self._oldest is None else max(self.interval - (time.monotonic() - self._oldest), 0))
+                if self._closed and not self._count:
+                    self._generation += 1
+                    self._condition.notify_all()
+                    return
+                batches, self._pending = self._pending, {}
+                self._writing, self._count, self._oldest = self._count, 0, None
+                self._flush_requested = False
+                self._busy = True
+            for collection_name, writes in batches.items():
+                self._write(collection_name, writes)
+            with self._condition:
+                self._writing = 0
+                self._busy = False
+                self._generation += 1
+                self._condition.notify_all()
+
+    def _write(self, collection_name: str, writes: List[Tuple[object, Future]]):
+        requests = [request for request, _ in writes]
+        inserts = all(isinstance(request, InsertOne) for request in requests)
+        errors = {}
+        try:
+            collection = self._get_collection(collection_name)
+            if inserts:
+                # Unordered: one duplicate does not fail the other documents
+                collection.insert_many([request._doc for request in requests], ordered=False)
+            else:
+                collection.bulk_write(requests, ordered=True)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            for error in write_errors:
+                errors[error["index"]] = BulkWriteError({**e.details, "writeErrors": [error]})
+            if not inserts and write_errors:
+                # Ordered: the requests after the first error were not applied
+                first = min(error["index"] for error in write_errors)
+                for index in range(first + 1, len(writes)):
+                    errors[index] = errors[first]
+        except Exception as e:
+            errors = {index: e for index in range(len(writes))}
+        if errors:
+            log.error(f"Failed {len(errors)} of {len(writes)} buffered writes to {collection_name}: {next(iter(errors.values()))}")
+        for index, (request, future) in enumerate(writes):
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(request._doc.get("_id") if isinstance(request, InsertOne) else None)
+
@@ -0,0 +1,332 @@
+"""
+Database metrics.
+
+Records the latency and the number of documents of every database operation, per collection and operation, in
+fixed-bucket histograms, and the cost of each query shape: the filter with its values replaced by their type names,
+so no data is kept or logged. Operations slower than DATABASE_SLOW_QUERY_MS are logged as warnings and kept in a
+short slow-query log.
+
+MongoDB operations are measured by DatabaseCommandListener, registered on the PyMongo and Motor clients, so the
+server round trips of cursors (getMore) are included. TinyDB and SQLite collections are wrapped in a MeteredCollection.
+Enabled with DATABASE_METRICS, and exposed by DatabaseMetrics.snapshot() on the /metrics/database endpoint.
+"""
+import time
+import json
+import threading
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+
+from core.config import settings
+from core.utils.logging import logger as log
+
+
+def query_shape(query):
+    """ The query with its values replaced by their type names, to log queries without their data. """
+    if isinstance(query, dict):
+        return {key: query_shape(value) for key, value in query.items()}
+    if isinstance(query, (list, tuple)):
+        shapes = []
+        for value in query:
+            shape = query_shape(value)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return type(query).__name__
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with fixed buckets, in milliseconds. Percentiles are estimated as the upper bound of their bucket.
+    """
+    BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.documents = 0
+
+    def add(self, ms: float, documents: int = 0):
+        self.counts[bisect_left(self.BUCKETS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.documents += documents
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "documents": self.documents,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": {f"{bound}": count for bound, count in zip(self.BUCKETS + ("+Inf",), self.counts)},
+        }
+
+
+class DatabaseMetrics:
+    """
+    Aggregated database metrics of this worker.
+    Usage:
+        DatabaseMetrics.record("modules", "find", seconds, documents, filter)
+        DatabaseMetrics.snapshot()
+    """
+    _lock = threading.Lock()
+    _histograms: Dict[tuple, LatencyHistogram] = {}
+    # Cost per (collection, operation, shape). New shapes are not tracked beyond max_shapes.
+    _shapes: Dict[tuple, list] = {}
+    max_shapes = 1000
+    slow_queries = deque(maxlen=100)
+    since = time.time()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return settings.DATABASE_METRICS
+
+    @classmethod
+    def record(cls, collection: str, operation: str, seconds: float, documents: int = 0, query=None, shape: str = None):
+        """
+        Records one operation. The shape of the query is computed here unless given, for operations without their query,
+        eg. the getMore of a cursor.
+        """
+        ms = seconds * 1000
+        if shape is None:
+            shape = json.dumps(query_shape(query or {}), default=str)
+        with cls._lock:
+            key = (collection, operation)
+            histogram = cls._histograms.get(key)
+            if histogram is None:
+                histogram = cls._histograms[key] = LatencyHistogram()
+            histogram.add(ms, documents)
+            key = (collection, operation, shape)
+            cost = cls._shapes.get(key)
+            if cost is None and len(cls._shapes) < cls.max_shapes:
+                cost = cls._shapes[key] = [0, 0.0, 0.0]
+            if cost is not None:
+                cost[0] += 1
+                cost[1] += ms
+                cost[2] = max(cost[2], ms)
+        if ms >= settings.DATABASE_SLOW_QUERY_MS:
+            cls.slow_queries.append({
+                "time": datetime.now(timezone.utc).isoformat(),
+                "collection": collection,
+                "operation": operation,
+                "ms": round(ms, 3),
+                "documents": documents,
+                "shape": shape,
+            })
+            log.warning(f"Slow query on {collection}: {operation} took {ms:.1f} ms, {documents} documents, filter {shape}")
+
+    @classmethod
+    def snapshot(cls, top: int = 20) -> Dict[str, Any]:
+        """ Histograms per collection and operation, the top query shapes by total time, and the slow-query log. """
+        with cls._lock:
+            collections = {}
+            for (collection, operation), histogram in sorted(cls._histograms.items()):
+                collections.setdefault(collection, {})[operation] = histogram.to_dict()
+            shapes = sorted(cls._shapes.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            return {
+                "since": datetime.fromtimestamp(cls.since, timezone.utc).isoformat(),
+                "slow_query_ms": settings.DATABASE_SLOW_QUERY_MS,
+                "collections": collections,
+                "shapes": [
+                    {"collection": collection, "operation": operation, "shape": shape, "count": count, "total_ms": round(total, 3), "max_ms": round(slowest, 3)}
+                    for (collection, operation, shape), (count, total, slowest) in shapes
+                ],
+                "slow_queries": list(cls.slow_queries),
+            }
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._histograms = {}
+            cls._shapes = {}
+            cls.slow_queries.clear()
+            cls.since = time.time()
+
+
+def _documents(result) -> int:
+    """ Documents returned or written by a collection method, from its result. """
+    if result is None or isinstance(result, (bool, int)):
+        return 0
+    if isinstance(result, dict):
+        return 1
+    if isinstance(result, list):
+        return len(result)
+    for attribute in ("inserted_ids", "deleted_count", "matched_count", "inserted_id"):
+        value = getattr(result, attribute, None)
+        if value is not None:
+            return len(value) if isinstance(value, list) else value if isinstance(value, int) else 1
+    return 0
+
+
+class MeteredCursor:
+    """
+    Lazy cursor of a MeteredCollection.find(). The time spent fetching documents is added to the time of the find() call,
+    and recorded when the cursor is exhausted, closed or garbage collected.
+    """
+    def __init__(self, cursor, collection: str, query, seconds: float):
+        self._cursor = cursor
+        self._collection = collection
+        self._query = query
+        self._seconds = seconds
+        self._documents = 0
+        self._recorded = False
+
+    def _record(self):
+        if not self._recorded:
+            self._recorded = True
+            DatabaseMetrics.record(self._collection, "find", self._seconds, self._documents, self._query)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            document = next(self._cursor)
+        except StopIteration:
+            self._seconds += time.perf_counter() - start
+            self._record()
+            raise
+        self._seconds += time.perf_counter() - start
+        self._documents += 1
+        return document
+
+    def close(self):
+        self._record()
+        return self._cursor.close()
+
+    def __del__(self):
+        self._record()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if not callable(attribute):
+            return attribute
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            # sort(), skip(), limit()... return the cursor to chain calls
+            return self if result is self._cursor else result
+        return call
+
+
+class MeteredCollection:
+    """
+    Wrapper of a TinyDB or SQLite collection recording the time of its operations. Other attributes are the collection's.
+    """
+    OPERATIONS = {
+        "find_one", "count_documents", "estimated_document_count", "distinct", "aggregate",
+        "insert", "insert_one", "insert_many", "update", "update_one", "update_many", "replace_one",
+        "remove", "delete_one", "delete_many", "bulk_write",
+    }
+
+    def __init__(self, collection, name: str):
+        self.collection = collection
+        self.name = name
+
+    def find(self, filter=None, *args, **kwargs):
+        start = time.perf_counter()
+        cursor = self.collection.find(filter, *args, **kwargs)
+        seconds = time.perf_counter() - start
+        if hasattr(cursor, "__next__"):
+            return MeteredCursor(cursor, self.name, filter, seconds)
+        # TinyDB cursors hold every document already
+        DatabaseMetrics.record(self.name, "find", seconds, cursor.count(), filter)
+        return cursor
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if name not in self.OPERATIONS:
+            return attribute
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            result = attribute(*args, **kwargs)
+            query = args[0] if args and isinstance(args[0], dict) and not name.startswith("insert") else kwargs.get("filter")
+            DatabaseMetrics.record(self.name, name, time.perf_counter() - start, _documents(result), query)
+            return result
+        return call
+
+
+class DatabaseCommandListener(monitoring.CommandListener):
+    """
+    Records the MongoDB commands of a PyMongo or Motor client. getMore commands are recorded with the shape of their cursor's query.
+    """
+    # Recorded commands, and their field holding the filter
+    COMMANDS = {
+        "find": "filter", "aggregate": "pipeline", "count": "query", "distinct": "query", "findAndModify": "query",
+        "insert": None, "update": "updates", "delete": "deletes",
+    }
+
+    def __init__(self):
+        self._started = {}
+        self._cursors = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        name = event.command_name
+        if name == "killCursors":
+            for cursor_id in event.command.get("cursors", ()):
+                self._cursors.pop(cursor_id, None)
+            return
+        if name == "getMore":
+            cursor_id = event.command.get("getMore")
+            cursor = self._cursors.get(cursor_id)
+            if cursor is not None:
+                self._started[(event.connection_id, event.request_id)] = (cursor[0], name, cursor[1], cursor_id)
+            return
+        if name not in self.COMMANDS:
+            return
+        query = event.command.get(self.COMMANDS[name]) if self.COMMANDS[name] else None
+        if name in ("update", "delete") and query:
+            query = query[0].get("q")
+        elif name == "aggregate":
+            # Shape of the first $match stage
+            query = query[0].get("$match") if query else None
+        shape = json.dumps(query_shape(query or {}), default=str)
+        self._started[(event.connection_id, event.request_id)] = (event.command.get(name), name, shape, None)
+
+    def _finished(self, event, reply: dict):
+        command = self._started.pop((event.connection_id, event.request_id), None)
+        if command is None:
+            return
+        collection, name, shape, cursor_id = command
+        documents = 0
+        cursor = reply.get("cursor")
+        if cursor:
+            documents = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+            if cursor.get("id"):
+                self._cursors[cursor["id"]] = (collection, shape)
+            elif cursor_id is not None:
+                self._cursors.pop(cursor_id, None)
+        elif name in ("insert", "update", "delete"):
+            documents = reply.get("n", 0)
+        elif name == "findAndModify":
+            documents = 1 if reply.get("value") else 0
+        elif name == "distinct":
+            documents = len(reply.get("values", ()))
+        DatabaseMetrics.record(str(collection), name, event.duration_micros / 1e6, documents, shape=shape)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finished(event, event.reply)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finished(event, {})
@@ -0,0 +1,820 @@
+"""
+SQLite document database
+
+Embedded alternative to TinyDB, with the PyMongo collection API used in the app. Enable it with MONGODB_URI="sqlite"
+(one file per database in the sqlite/ folder) or MONGODB_URI="sqlite:///path/to/file.db".
+
+Each collection is a table of JSON documents. Queries are translated to SQL using the JSON1 functions of SQLite, so only
+the matching documents are read, and the Settings.indexes of a collection become expression indexes used by the query planner.
+The database runs in WAL mode: readers do not block the writer, so several workers can share it.
+
+Differences with MongoDB:
+    - _id is stored and returned as a str, like on TinyDB. Other ObjectId and datetime values are kept.
+    - A condition on a field does not match the items of an array field: use $elemMatch or $all.
+    - $text searches the fields of the collection's text index with LIKE.
+    - Updates support $set, $unset, $inc, $push and $setOnInsert. A document without operators is merged, like on TinyDB.
+    - aggregate() is not supported.
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import date, datetime, timezone
+from enum import Enum
+from functools import lru_cache
+from collections import deque
+
+from bson.objectid import ObjectId
+from bson.regex import Regex
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+from core.utils.logging import logger as log
+
+
+# Seconds a connection waits for the write lock of another connection or worker
+BUSY_TIMEOUT = 30.0
+# Rows fetched at a time by a cursor, when no batch_size is given
+DEFAULT_BATCH_SIZE = 100
+# Table holding the index definitions of all collections
+INDEXES_TABLE = "__indexes__"
+
+
+def _format_date(value: datetime) -> str:
+    """ UTC, fixed width ISO 8601, so stored dates compare and sort as strings. Naive datetimes are UTC. """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="microseconds") + "Z"
+
+
+def _default(value):
+    """ JSON encoding of the values json does not support. """
+    if isinstance(value, datetime):
+        return {"$date": _format_date(value)}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def _object_hook(obj: dict):
+    if len(obj) == 1:
+        if "$date" in obj:
+            return datetime.fromisoformat(obj["$date"].rstrip("Z")).replace(tzinfo=timezone.utc)
+        if "$oid" in obj:
+            return ObjectId(obj["$oid"])
+    return obj
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def _loads(value: str):
+    return json.loads(value, object_hook=_object_hook)
+
+
+def _param(value):
+    """ SQL parameter comparable with json_extract() of the same value stored in a document. """
+    if isinstance(value, Enum):
+        value = value.value
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (dict, list, tuple, datetime, ObjectId)):
+        return _dumps(value)
+    value = _default(value)
+    return _dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def _id_param(value):
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+def _quote(name: str) -> str:
+    """ Quoted SQL identifier. """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _path(field: str) -> str:
+    """ SQL literal of the JSON path of a dotted field name. Array indexes are supported, eg. 'tags.0'. """
+    path = "$"
+    for part in field.split("."):
+        if part.isdigit():
+            path += f"[{part}]"
+        elif '"' in part or not part:
+            raise OperationFailure(f"Unsupported field name: {field}")
+        else:
+            path += f'."{part}"'
+    return "'" + path.replace("'", "''") + "'"
+
+
+@lru_cache(maxsize=256)
+def _compile(pattern: str):
+    return re.compile(pattern)
+
+
+def _regexp(pattern, value) -> bool:
+    """ REGEXP function of the connections. """
+    return isinstance(value, str) and _compile(pattern).search(value) is not None
+
+
+def _regex_pattern(pattern, options: str = "") -> str:
+    """ Python pattern with inline flags, from a $regex value (str, compiled pattern or bson Regex) and $options. """
+    if isinstance(pattern, Regex):
+        pattern = pattern.try_compile()
+    if isinstance(pattern, re.Pattern):
+        flags = "".join(flag for flag, value in (("i", re.I), ("m", re.M), ("s", re.S), ("x", re.X)) if pattern.flags & value)
+        options, pattern = options + flags, pattern.pattern
+    flags = "".join(sorted(set(options) & set("imsx")))
+    return f"(?{flags}){pattern}" if flags else pattern
+
+
+def _sort_spec(key_or_list, direction=None) -> list:
+    """ List of (field, direction) pairs from the sort arguments of PyMongo. """
+    if not key_or_list:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+
+def _get_path(doc: dict, parts: list):
+    for part in parts:
+        if not isinstance(doc, dict) or part not in doc:
+            return _missing
+        doc = doc[part]
+    return doc
+
+_missing = object()
+
+
+def _project(doc: dict, projection) -> dict:
+    """ Applies a MongoDB projection (inclusion or exclusion, dotted fields) to a document. """
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple, set)):
+        projection = {field: 1 for field in projection}
+    include = [field for field, value in projection.items() if value and field != "_id"]
+    if include or all(projection.values()):
+        output = {"_id": doc["_id"]} if projection.get("_id", 1) else {}
+        for field in include:
+            parts = field.split(".")
+            value = _get_path(doc, parts)
+            if value is _missing:
+                continue
+            target = output
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        return output
+    for field, value in projection.items():
+        parts = field.split(".")
+        parent = _get_path(doc, parts[:-1])
+        if isinstance(parent, dict):
+            parent.pop(parts[-1], None)
+    return doc
+
+
+def _type_guard(expr: str, value_type: str, operand):
+    """
+    SQL condition restricting a $gt/$gte/$lt/$lte to the values of the same type class as the operand, as on MongoDB:
+    {"$gt": 3} matches numbers only, not strings. None for operands without a type class.
+    """
+    if isinstance(operand, Enum):
+        operand = operand.value
+    if isinstance(operand, bool):
+        return f"{value_type} IN ('true', 'false')"
+    if isinstance(operand, (int, float)):
+        return f"{value_type} IN ('integer', 'real')"
+    if isinstance(operand, (str, date)) and not isinstance(operand, datetime):
+        return f"{value_type} = 'text'"
+    if isinstance(operand, (datetime, ObjectId)):
+        tag = "$date" if isinstance(operand, datetime) else "$oid"
+        return f"{value_type} = 'object' AND {expr} LIKE '{{\"{tag}\":%'"
+    return None
+
+
+def _type_condition(expr: str, value_type: str, alias: str) -> str:
+    """ SQL condition of a $type alias, for the types the documents can store. """
+    tagged = f"{value_type} = 'object' AND ({expr} LIKE '{{\"$date\":%' OR {expr} LIKE '{{\"$oid\":%')"
+    conditions = {
+        "null": f"{value_type} = 'null'",
+        "number": f"{value_type} IN ('integer', 'real')",
+        "double": f"{value_type} = 'real'",
+        "int": f"{value_type} = 'integer'",
+        "long": f"{value_type} = 'integer'",
+        "string": f"{value_type} = 'text'",
+        "object": f"{value_type} = 'object' AND NOT ({tagged})",
+        "array": f"{value_type} = 'array'",
+        "objectId": f"{value_type} = 'object' AND {expr} LIKE '{{\"$oid\":%'",
+        "bool": f"{value_type} IN ('true', 'false')",
+        "date": f"{value_type} = 'object' AND {expr} LIKE '{{\"$date\":%'",
+    }
+    if alias not in conditions:
+        raise OperationFailure(f"Unsupported $type: {alias}")
+    return conditions[alias]
+
+
+class _QueryBuilder:
+    """ Translates a MongoDB query into an SQL condition and its parameters. """
+
+    def __init__(self, text_fields: list):
+        self.params = []
+        self.text_fields = text_fields
+        self._aliases = 0
+
+    def where(self, query: dict, source: str = "doc") -> str:
+        clauses = []
+        for key, value in (query or {}).items():
+            if key in ("$and", "$or", "$nor"):
+                if not isinstance(value, (list, tuple)) or not value:
+                    raise OperationFailure(f"{key} must be a nonempty array")
+                conditions = [f"({self.where(item, source)})" for item in value]
+                clause = (" AND " if key == "$and" else " OR ").join(conditions)
+                clauses.append(f"NOT coalesce(({clause}), 0)" if key == "$nor" else clause)
+            elif key == "$text":
+                clauses.append(self._text(value))
+            elif key == "$comment":
+                continue
+            elif key.startswith("$"):
+                raise OperationFailure(f"Unsupported query operator: {key}")
+            else:
+                clauses.append(self._field(key, value, source))
+        return " AND ".join(f"({clause})" for clause in clauses) or "1"
+
+    def _add(self, expr: str, value) -> str:
+        self.params.append(_id_param(value) if expr == "_id" else _param(value))
+        return "?"
+
+    def _field(self, field: str, value, source: str) -> str:
+        if source == "doc" and field == "_id":
+            expr, value_type = "_id", "'text'"
+        else:
+            path = _path(field)
+            expr, value_type = f"json_extract({source}, {path})", f"json_type({source}, {path})"
+        if isinstance(value, dict) and value and all(key.startswith("$") for key in value):
+            clauses = [self._operator(expr, value_type, source, field, operator, operand, value) for operator, operand in value.items() if operator != "$options"]
+            return " AND ".join(f"({clause})" for clause in clauses) or "1"
+        return self._eq(expr, value)
+
+    def _eq(self, expr: str, value) -> str:
+        if value is None:
+            return f"{expr} IS NULL"
+        if isinstance(value, (re.Pattern, Regex)):
+            self.params.append(_regex_pattern(value))
+            return f"regexp(?, {expr})"
+        return f"{expr} = {self._add(expr, value)}"
+
+    def _in(self, expr: str, values) -> str:
+        clauses = []
+        values = list(values)
+        if any(value is None for value in values):
+            clauses.append(f"{expr} IS NULL")
+        for value in values:
+            if isinstance(value, (re.Pattern, Regex)):
+                clauses.append(self._eq(expr, value))
+        values = [value for value in values if value is not None and not isinstance(value, (re.Pattern, Regex))]
+        if values:
+            clauses.append(f"{expr} IN ({', '.join(self._add(expr, value) for value in values)})")
+        return " OR ".join(f"({clause})" for clause in clauses) or "0"
+
+    def _operator(self, expr: str, value_type: str, source: str, field: str, operator: str, operand, operators: dict) -> str:
+        if operator == "$eq":
+            return self._eq(expr, operand)
+        if operator == "$ne":
+            return f"{expr} IS NOT NULL" if operand is None else f"{expr} IS NOT {self._add(expr, operand)}"
+        if operator in ("$gt", "$gte", "$lt", "$lte"):
+            sign = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[operator]
+            condition = f"{expr} {sign} {self._add(expr, operand)}"
+            # _id is always stored as text, ObjectIds included
+            guard = _type_guard(expr, value_type, operand) if expr != "_id" else None
+            return f"{guard} AND {condition}" if guard else condition
+        if operator == "$in":
+            return self._in(expr, operand)
+        if operator == "$nin":
+            return f"NOT coalesce(({self._in(expr, operand)}), 0)"
+        if operator == "$exists":
+            return f"{value_type} IS NOT NULL" if operand else f"{value_type} IS NULL"
+        if operator == "$regex":
+            self.params.append(_regex_pattern(operand, operators.get("$options", "")))
+            return f"regexp(?, {expr})"
+        if operator == "$not":
+            condition = self._field(field, operand, source) if isinstance(operand, dict) else self._eq(expr, operand)
+            return f"NOT coalesce(({condition}), 0)"
+        if operator == "$type":
+            aliases = operand if isinstance(operand, (list, tuple)) else [operand]
+            return " OR ".join(f"({_type_condition(expr, value_type, alias)})" for alias in aliases) or "0"
+        if operator == "$size":
+            return f"json_array_length({source}, {_path(field)}) = {self._add(expr, operand)}"
+        if operator == "$all":
+            return " AND ".join(f"({self._elem_match(source, field, {'$eq': value})})" for value in operand) or "0"
+        if operator == "$elemMatch":
+            return self._elem_match(source, field, operand)
+        raise OperationFailure(f"Unsupported query operator: {operator}")
+
+    def _elem_match(self, source: str, field: str, query: dict) -> str:
+        self._aliases += 1
+        alias = f"j{self._aliases}"
+        path = _path(field)
+        if any(not key.startswith("$") for key in query):
+            condition = f"{alias}.type = 'object' AND ({self.where(query, f'{alias}.value')})"
+        else:
+            expr = f"{alias}.value"
+            condition = " AND ".join(f"({self._operator(expr, f'{alias}.type', source, field, operator, operand, query)})" for operator, operand in query.items() if operator != "$options") or "1"
+        return f"json_type({source}, {path}) = 'array' AND EXISTS (SELECT 1 FROM json_each({source}, {path}) AS {alias} WHERE {condition})"
+
+    def _text(self, value: dict) -> str:
+        if not self.text_fields:
+            raise OperationFailure("text index required for $text query")
+        search = value.get("$search", "") if isinstance(value, dict) else str(value)
+        phrases = re.findall(r'"([^"]+)"', search)
+        words = re.sub(r'"[^"]*"', " ", search).split()
+
+        def contains(term: str) -> str:
+            term = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses = []
+            for field in self.text_fields:
+                self.params.append(term)
+                clauses.append(f"json_extract(doc, {_path(field)}) LIKE ? ESCAPE '\\'")
+            return " OR ".join(clauses)
+
+        clauses = [f"({contains(phrase)})" for phrase in phrases]
+        included = [word for word in words if not word.startswith("-")]
+        if included:
+            clauses.append(" OR ".join(f"({contains(word)})" for word in included))
+        clauses += [f"NOT ({contains(word[1:])})" for word in words if word.startswith("-") and len(word) > 1]
+        return " AND ".join(f"({clause})" for clause in clauses) or "0"
+
+
+class SQLiteCursor:
+    """
+    Cursor of SQLiteCollection.find(), with the chainable sort(), skip() and limit() of PyMongo.
+    The query runs on the first iteration, and documents are decoded one batch at a time.
+    """
+
+    def __init__(self, collection: "SQLiteCollection", filter=None, projection=None, sort=None, skip: int = 0, limit: int = 0, batch_size: int = 0):
+        self.collection = collection
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort = _sort_spec(sort)
+        self._skip = skip or 0
+        self._limit = limit or 0
+        self._batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self._rows = None
+        self._buffer = deque()
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int):
+        self._batch_size = batch_size or DEFAULT_BATCH_SIZE
+        return self
+
+    def _sql(self):
+        builder = self.collection._builder()
+        sql = f"SELECT _id, doc FROM {self.collection._table} WHERE {builder.where(self._filter)}"
+        if self._sort:
+            order = [f"{'_id' if field == '_id' else f'json_extract(doc, {_path(field)})'} {'DESC' if direction == -1 else 'ASC'}" for field, direction in self._sort]
+            # Ties in insertion order, in the direction of the last key so an index can serve the whole order
+            order.append(f"rowid {'DESC' if self._sort[-1][1] == -1 else 'ASC'}")
+            sql += " ORDER BY " + ", ".join(order)
+        if self._limit or self._skip:
+            sql += " LIMIT ? OFFSET ?"
+            builder.params += [abs(self._limit) or -1, self._skip]
+        return sql, builder.params
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        if self._rows is None:
+            self._rows = self.collection.database.connection.execute(*self._sql())
+        if not self._buffer:
+            self._buffer.extend(self._rows.fetchmany(self._batch_size))
+            if not self._buffer:
+                raise StopIteration
+        _id, doc = self._buffer.popleft()
+        return self.collection._load(_id, doc, self._projection)
+
+    def close(self):
+        if self._rows is not None:
+            self._rows.close()
+
+    def count(self) -> int:
+        return self.collection.count_documents(self._filter, skip=self._skip, limit=self._limit or None)
+
+    def explain(self) -> dict:
+        """
+        SQLite query plan, in the shape of a MongoDB explain(): a FETCH of an IXSCAN per index searched, or a COLLSCAN when
+        the table is scanned, under a SORT stage when the order is not given by an index.
+        """
+        sql, params = self._sql()
+        details = [row[3] for row in self.collection.database.connection.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        table = re.escape(self.collection.name)
+        stages = []
+        for detail in details:
+            match = re.match(rf"(SEARCH|SCAN) {table}(?= |$)(?: USING (?:COVERING )?INDEX (\S+)| USING (?:INTEGER )?PRIMARY KEY)?", detail)
+            if not match:
+                continue
+            if match.group(2):
+                name = match.group(2)
+                name = "_id_" if name.startswith("sqlite_autoindex_") else name[len(self.collection.name) + 1:]
+                stages.append({"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": name}})
+            elif match.group(1) == "SEARCH":
+                stages.append({"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "_id_"}})
+            else:
+                stages.append({"stage": "COLLSCAN"})
+        plan = stages[0] if len(stages) == 1 else {"stage": "OR", "inputStages": stages}
+        if any(detail.startswith("USE TEMP B-TREE FOR") and "ORDER BY" in detail for detail in details):
+            plan = {"stage": "SORT", "inputStage": plan}
+        return {"queryPlanner": {"winningPlan": plan, "sqlite": details}}
+
+
+class SQLiteCollection:
+    """
+    Collection of an SQLiteDatabase: a table (_id TEXT PRIMARY KEY, doc TEXT) with the document as JSON, without its _id.
+    Methods have the signatures of pymongo.collection.Collection, and raise the same pymongo.errors.
+    """
+
+    def __init__(self, database: "SQLiteDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._table = _quote(name)
+        self.database.connection.execute(f"CREATE TABLE IF NOT EXISTS {self._table} (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+        self._text_fields = self._load_text_fields()
+
+    def __repr__(self):
+        return f"SQLiteCollection({self.database.path!r}, {self.name!r})"
+
+    def _builder(self) -> _QueryBuilder:
+        return _QueryBuilder(self._text_fields)
+
+    def _where(self, filter) -> tuple:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        builder = self._builder()
+        return builder.where(filter), builder.params
+
+    @staticmethod
+    def _load(_id: str, doc: str, projection=None) -> dict:
+        return _project({"_id": _id, **_loads(doc)}, projection)
+
+    @staticmethod
+    def _dump(document: dict) -> tuple:
+        """ Sets the _id of a new document, like PyMongo, and returns its row. """
+        if document.get("_id") is None:
+            document["_id"] = ObjectId()
+        return str(document["_id"]), _dumps({key: value for key, value in document.items() if key != "_id"})
+
+    def _update_expr(self, update: dict, upsert: bool = False) -> tuple:
+        """ SQL expression of the updated document column, and its parameters. """
+        if not any(key.startswith("$") for key in update):
+            # Merged, like TinyMongo
+            update = {"$set": update}
+        expr, params = "doc", []
+        for operator, fields in update.items():
+            if operator == "$setOnInsert" and not upsert:
+                continue
+            for field, value in fields.items():
+                if field == "_id":
+                    continue
+                path = _path(field)
+                if operator in ("$set", "$setOnInsert"):
+                    expr = f"json_set({expr}, {path}, json(?))"
+                    params.append(_dumps(value))
+                elif operator == "$unset":
+                    expr = f"json_remove({expr}, {path})"
+                elif operator == "$inc":
+                    expr = f"json_set({expr}, {path}, coalesce(json_extract(doc, {path}), 0) + ?)"
+                    params.append(value)
+                elif operator == "$push":
+                    values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                    appends = "".join(", '$[#]', json(?)" for _ in values)
+                    expr = f"json_set({expr}, {path}, json_insert(coalesce(json_extract(doc, {path}), '[]'){appends}))"
+                    params += [_dumps(item) for item in values]
+                else:
+                    raise OperationFailure(f"Unsupported update operator: {operator}")
+        return expr, params
+
+    def _execute(self, connection, sql: str, params=()) -> sqlite3.Cursor:
+        try:
+            return connection.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} {e}", 11000) from e
+
+    def _update(self, connection, filter, update: dict, upsert: bool, many: bool) -> dict:
+        where, params = self._where(filter)
+        expr, update_params = self._update_expr(update)
+        if not many:
+            where = f"rowid = (SELECT rowid FROM {self._table} WHERE {where} LIMIT 1)"
+        matched = self._execute(connection, f"UPDATE {self._table} SET doc = {expr} WHERE {where}", update_params + params).rowcount
+        if matched or not upsert:
+            return {"n": matched, "nModified": matched, "ok": 1.0, "updatedExisting": bool(matched)}
+        # Inserts the equality conditions of the filter, then applies the update to it
+        document = {key: value for key, value in (filter or {}).items() if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))}
+        _id, doc = self._dump(document)
+        self._execute(connection, f"INSERT INTO {self._table} (_id, doc) VALUES (?, ?)", (_id, doc))
+        expr, update_params = self._update_expr(update, upsert=True)
+        self._execute(connection, f"UPDATE {self._table} SET doc = {expr} WHERE _id = ?", update_params + [_id])
+        return {"n": 1, "nModified": 0, "ok": 1.0, "updatedExisting": False, "upserted": document["_id"]}
+
+    # Reads
+
+    def find(self, filter=None, projection=None, sort=None, skip: int = 0, limit: int = 0, batch_size: int = 0, **kwargs) -> SQLiteCursor:
+        return SQLiteCursor(self, filter, projection, sort, skip, limit, batch_size)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for doc in self.find(filter, projection, *args, **{**kwargs, "limit": 1}):
+            return doc
+        return None
+
+    def count_documents(self, filter=None, skip: int = 0, limit: int = None, **kwargs) -> int:
+        where, params = self._where(filter)
+        sql = f"SELECT count(*) FROM (SELECT 1 FROM {self._table} WHERE {where} LIMIT ? OFFSET ?)"
+        return self.database.connection.execute(sql, params + [limit or -1, skip or 0]).fetchone()[0]
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return self.database.connection.execute(f"SELECT count(*) FROM {self._table}").fetchone()[0]
+
+    def distinct(self, key: str, filter=None, **kwargs) -> list:
+        where, params = self._where(filter)
+        expr = "_id" if key == "_id" else f"json_extract(doc, {_path(key)})"
+        rows = self.database.connection.execute(f"SELECT DISTINCT {expr}, json_type(doc, {_path(key)}) FROM {self._table} WHERE {where}", params)
+        return [_loads(value) if kind in ("object", "array") else value for value, kind in rows if value is not None]
+
+    def aggregate(self, pipeline, **kwargs):
+        raise OperationFailure("aggregate() is not supported on SQLite")
+
+    # Writes
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        self._execute(self.database.connection, f"INSERT INTO {self._table} (_id, doc) VALUES (?, ?)", self._dump(document))
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        rows = [self._dump(document) for document in documents]
+        sql = f"INSERT INTO {self._table} (_id, doc) VALUES (?, ?)"
+        with self.database.transaction() as connection:
+            try:
+                connection.execute("SAVEPOINT insert_many")
+                connection.executemany(sql, rows)
+                connection.execute("RELEASE insert_many")
+                return InsertManyResult([document["_id"] for document in documents], True)
+            except sqlite3.IntegrityError:
+                connection.execute("ROLLBACK TO insert_many")
+                connection.execute("RELEASE insert_many")
+            # A duplicate key: inserted one by one to report it, and like MongoDB, keep the documents inserted before it
+            errors, inserted = [], 0
+            for index, row in enumerate(rows):
+                try:
+                    connection.execute(sql, row)
+                    inserted += 1
+                except sqlite3.IntegrityError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": f"E11000 duplicate key error collection: {self.name} {e}", "op": documents[index]})
+                    if ordered:
+                        break
+        raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": inserted, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+
+    def update_one(self, filter, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(self.database.connection, filter, update, upsert, many=False), True)
+
+    def update_many(self, filter, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(self.database.connection, filter, update, upsert, many=True), True)
+
+    def replace_one(self, filter, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        where, params = self._where(filter)
+        doc = _dumps({key: value for key, value in replacement.items() if key != "_id"})
+        matched = self._execute(self.database.connection, f"UPDATE {self._table} SET doc = ? WHERE rowid = (SELECT rowid FROM {self._table} WHERE {where} LIMIT 1)", [doc] + params).rowcount
+        if matched or not upsert:
+            return UpdateResult({"n": matched, "nModified": matched, "ok": 1.0, "updatedExisting": bool(matched)}, True)
+        self.insert_one(replacement)
+        return UpdateResult({"n": 1, "nModified": 0, "ok": 1.0, "updatedExisting": False, "upserted": replacement["_id"]}, True)
+
+    def delete_one(self, filter, **kwargs) -> DeleteResult:
+        where, params = self._where(filter)
+        deleted = self.database.connection.execute(f"DELETE FROM {self._table} WHERE rowid = (SELECT rowid FROM {self._table} WHERE {where} LIMIT 1)", params).rowcount
+        return DeleteResult({"n": deleted, "ok": 1.0}, True)
+
+    def delete_many(self, filter, **kwargs) -> DeleteResult:
+        where, params = self._where(filter)
+        deleted = self.database.connection.execute(f"DELETE FROM {self._table} WHERE {where}", params).rowcount
+        return DeleteResult({"n": deleted, "ok": 1.0}, True)
+
+    def bulk_write(self, requests, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        """ Runs InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne and DeleteMany requests in one transaction. """
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        with self.database.transaction() as connection:
+            for index, request in enumerate(requests):
+                kind = type(request).__name__
+                try:
+                    if kind == "InsertOne":
+                        self._execute(connection, f"INSERT INTO {self._table} (_id, doc) VALUES (?, ?)", self._dump(request._doc))
+                        result["nInserted"] += 1
+                    elif kind in ("UpdateOne", "UpdateMany"):
+                        raw = self._update(connection, request._filter, request._doc, bool(request._upsert), many=kind == "UpdateMany")
+                        if "upserted" in raw:
+                            result["nUpserted"] += 1
+                            result["upserted"].append({"index": index, "_id": raw["upserted"]})
+                        else:
+                            result["nMatched"] += raw["n"]
+                            result["nModified"] += raw["nModified"]
+                    elif kind == "ReplaceOne":
+                        where, params = self._where(request._filter)
+                        doc = _dumps({key: value for key, value in request._doc.items() if key != "_id"})
+                        matched = self._execute(connection, f"UPDATE {self._table} SET doc = ? WHERE rowid = (SELECT rowid FROM {self._table} WHERE {where} LIMIT 1)", [doc] + params).rowcount
+                        result["nMatched"] += matched
+                        result["nModified"] += matched
+                    elif kind in ("DeleteOne", "DeleteMany"):
+                        where, params = self._where(request._filter)
+                        if kind == "DeleteOne":
+                            where = f"rowid = (SELECT rowid FROM {self._table} WHERE {where} LIMIT 1)"
+                        result["nRemoved"] += connection.execute(f"DELETE FROM {self._table} WHERE {where}", params).rowcount
+                    else:
+                        raise OperationFailure(f"Unsupported bulk write request: {kind}")
+                except DuplicateKeyError as e:
+                    result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(e), "op": request})
+                    if ordered:
+                        break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    # Indexes
+
+    def _load_text_fields(self) -> list:
+        fields = []
+        for (spec,) in self.database.connection.execute(f"SELECT spec FROM {_quote(INDEXES_TABLE)} WHERE collection = ?", (self.name,)):
+            fields += [field for field, kind in json.loads(spec)["key"] if kind == "text"]
+        return fields
+
+    def create_index(self, keys, **kwargs) -> str:
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+
+    def create_indexes(self, indexes: list, **kwargs) -> list:
+        """
+        Creates expression indexes on the fields of pymongo.IndexModel objects. Supports ascending, descending and text keys,
+        and the unique and sparse options. An existing index with the same name and keys is kept.
+        """
+        names = []
+        with self.database.transaction() as connection:
+            for index in indexes:
+                document = index.document
+                name = document["name"]
+                key = list(document["key"].items())
+                spec = _dumps({"key": key, "unique": bool(document.get("unique")), "sparse": bool(document.get("sparse"))})
+                existing = connection.execute(f"SELECT spec FROM {_quote(INDEXES_TABLE)} WHERE collection = ? AND name = ?", (self.name, name)).fetchone()
+                if existing:
+                    if existing[0] != spec:
+                        raise OperationFailure(f"An index named {name} already exists on {self.name} with different options", 86)
+                    names.append(name)
+                    continue
+                columns = [(field, direction) for field, direction in key if direction in (1, -1)]
+                if len(columns) != len(key) and any(direction != "text" for _, direction in key):
+                    log.warning(f"Index {name} on {self.name}: only ascending, descending and text keys are supported on SQLite.")
+                if columns:
+                    expressions = ["_id" if field == "_id" else f"json_extract(doc, {_path(field)})" for field, _ in columns]
+                    sql = f"CREATE {'UNIQUE ' if document.get('unique') else ''}INDEX IF NOT EXISTS {_quote(f'{self.name}.{name}')} ON {self._table} ("
+                    sql += ", ".join(f"{expression} {'DESC' if direction == -1 else 'ASC'}" for expression, (_, direction) in zip(expressions, columns)) + ")"
+                    if document.get("sparse"):
+                        sql += " WHERE " + " AND ".join(f"{expression} IS NOT NULL" for expression in expressions)
+                    self._execute(connection, sql)
+                connection.execute(f"INSERT INTO {_quote(INDEXES_TABLE)} (collection, name, spec) VALUES (?, ?, ?)", (self.name, name, spec))
+                names.append(name)
+        self._text_fields = self._load_text_fields()
+        return names
+
+    def index_information(self) -> dict:
+        information = {"_id_": {"key": [("_id", 1)]}}
+        for name, spec in self.database.connection.execute(f"SELECT name, spec FROM {_quote(INDEXES_TABLE)} WHERE collection = ?", (self.name,)):
+            spec = json.loads(spec)
+            information[name] = {"key": [tuple(item) for item in spec["key"]], **({"unique": True} if spec["unique"] else {}), **({"sparse": True} if spec["sparse"] else {})}
+        return information
+
+    def drop_index(self, name: str):
+        with self.database.transaction() as connection:
+            connection.execute(f"DROP INDEX IF EXISTS {_quote(f'{self.name}.{name}')}")
+            connection.execute(f"DELETE FROM {_quote(INDEXES_TABLE)} WHERE collection = ? AND name = ?", (self.name, name))
+        self._text_fields = self._load_text_fields()
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+
+class SQLiteDatabase:
+    """
+    A database file. Each thread has its own connection, opened on first use and closed by close().
+    Collections are created once per name.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._collections = {}
+        self._lock = threading.Lock()
+        with self.transaction() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {_quote(INDEXES_TABLE)} (collection TEXT, name TEXT, spec TEXT, PRIMARY KEY (collection, name))")
+
+    @classmethod
+    def from_url(cls, url: str, name: str) -> "SQLiteDatabase":
+        """ 'sqlite' for sqlite/<name>.db, or 'sqlite:///<path>' for the given file. """
+        path = url[len("sqlite://"):].lstrip("/") if url.startswith("sqlite://") else ""
+        if url.startswith("sqlite:////"):
+            path = "/" + path
+        return cls(path or os.path.join("sqlite", f"{name}.db"))
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread. A forked process opens its own. """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.create_function("regexp", 2, _regexp, deterministic=True)
+            self._local.connection, self._local.pid = connection, os.getpid()
+            with self._lock:
+                self._connections.append((os.getpid(), connection))
+        return connection
+
+    def transaction(self):
+        """ Context manager running the statements of the current thread's connection in one write transaction. """
+        return _Transaction(self.connection)
+
+    def get(self, name: str) -> SQLiteCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+        if collection is None:
+            collection = SQLiteCollection(self, name)
+            with self._lock:
+                collection = self._collections.setdefault(name, collection)
+        return collection
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        return self.get(name)
+
+    def __getattr__(self, name: str) -> SQLiteCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get(name)
+
+    def get_collection(self, name: str) -> SQLiteCollection:
+        return self.get(name)
+
+    def list_collection_names(self) -> list:
+        rows = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name != ?", (INDEXES_TABLE,))
+        return [name for (name,) in rows]
+
+    def drop_collection(self, name: str):
+        with self.transaction() as connection:
+            connection.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+            connection.execute(f"DELETE FROM {_quote(INDEXES_TABLE)} WHERE collection = ?", (name,))
+        with self._lock:
+            self._collections.pop(name, None)
+
+    def close(self):
+        """ Closes the connections opened by this process. """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for pid, connection in connections:
+            if pid == os.getpid():
+                connection.close()
+        self._local = threading.local()
+
+
+class _Transaction:
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        # Takes the write lock now, so concurrent writers wait for the busy timeout instead of failing to upgrade a read lock
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
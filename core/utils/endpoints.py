@@ -6,28 +6,229 @@ It is designed to work with FastAPI and Beanie, and can be used to quickly creat
 """
 
 from core import log
-from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request, Body
-from fastapi.responses import JSONResponse  
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request, Body, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from starlette.routing import BaseRoute
 from typing import Callable, List, Type, Optional, Union, Tuple, Any, Dict
 from pydantic import BaseModel, Field, create_model
-from pymongo import errors as pymongo_errors
-from bson import ObjectId
+from pymongo import errors as pymongo_errors, UpdateOne
+from bson import ObjectId, decode as decode_bson, encode as encode_bson
 from beanie import Document
 from math import ceil
 from enum import Enum
+from functools import wraps
+from email.utils import formatdate, parsedate_to_datetime
+from datetime import datetime, timezone
+from time import time
+import asyncio
+import hashlib
+import base64
+import json
 import bsonjs
-from bson.raw_bson import RawBSONDocument
+import csv
+import io
 
 from .datetime import utc_now
-from .cache import SimpleCache
+from .cache import shared_cache
 
 
-from core.schemas.endpoints import CRUDResponseModelGet, CRUDResponseModelPostMany, CRUDResponseModelDelete, CRUDQueryData, SortOrder
-from core.schemas.database import DatabaseMongoBaseModel
+from core.schemas.endpoints import CRUDResponseModelGet, CRUDResponseModelPostMany, CRUDResponseModelDelete, CRUDRequestModelDeleteMany, CRUDQueryData, SortOrder, CountMode, ExportFormat
+from core.schemas.database import DatabaseMongoBaseModel, from_mongo
 from core.utils.database import Database
 from core.utils.string import to_snake_case
 
+# Response cache shared by all CRUD endpoints. Namespaced per collection, so a write to a collection
+# invalidates every cached response of that collection, in every worker when Redis caching is enabled.
+crud_cache = shared_cache('crud')
+
+class _UncachedResponse(Exception):
+    """ Raised from the cache loader to return an error response without caching it. """
+    def __init__(self, response: Response):
+        self.response = response
+
+def _field_value(doc: dict, field: str):
+    """ Value of a field of a document, following dotted paths like 'meta.created'. None if missing. """
+    for part in field.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+# $type aliases of the BSON types in sort order, as ranked by _bson_order()
+_BSON_TYPES = ["null", "number", "string", "object", "array", "objectId", "bool", "date"]
+
+def _bson_order(value) -> tuple:
+    """
+    Comparable key of a value in the BSON sort order of MongoDB, so values of different types never compare with each other:
+    null, numbers, strings, objects, arrays, ObjectIds, booleans, then dates. Naive datetimes are UTC.
+    """
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (6, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, dict):
+        return (3, tuple((key, _bson_order(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (4, tuple(_bson_order(item) for item in value))
+    if isinstance(value, ObjectId):
+        return (5, str(value))
+    if isinstance(value, datetime):
+        return (7, value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+    return (8, str(value))
+
+def _sort_key(field: str):
+    """ Sort key for in-memory sorting (TinyDB). Missing and None values sort first, then values by type, like MongoDB. """
+    def key(doc: dict):
+        return _bson_order(_field_value(doc, field))
+    return key
+
+def _encode_cursor(doc: dict, sort_by: Optional[str], direction: int) -> str:
+    """
+    Opaque keyset cursor for the position after `doc`: the sort field, direction, and the last (sort value, _id).
+    """
+    return base64.urlsafe_b64encode(encode_bson({"f": sort_by, "d": direction, "v": _field_value(doc, sort_by) if sort_by else None, "i": doc["_id"]})).decode()
+
+def _decode_cursor(cursor: str, sort_by: Optional[str], direction: int) -> dict:
+    try:
+        after = decode_bson(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if after.get("f") != sort_by or after.get("d") != direction:
+        raise ValueError("The cursor was created with a different sort_by or sort_order.")
+    # Only values a sort field can hold, and an _id, as a tampered cursor could hold anything
+    if not isinstance(after.get("i"), (ObjectId, str)) or "v" not in after or not _cursor_value(after["v"]):
+        raise ValueError("Invalid cursor.")
+    return after
+
+def _cursor_value(value) -> bool:
+    """ Whether a decoded cursor value is a JSON-like value of a document field, comparable with _bson_order(). """
+    if value is None or isinstance(value, (bool, int, float, str, datetime, ObjectId)):
+        return True
+    if isinstance(value, dict):
+        return all(_cursor_value(item) for item in value.values())
+    if isinstance(value, list):
+        return all(_cursor_value(item) for item in value)
+    return False
+
+def _keyset_query(after: dict) -> dict:
+    """
+    MongoDB range query selecting the documents after a cursor, sorted by (sort field, _id) in the cursor's direction.
+    """
+    field, value, _id = after["f"], after["v"], after["i"]
+    op = "$gt" if after["d"] == 1 else "$lt"
+    if not field:
+        return {"_id": {op: _id}}
+    if value is None:
+        # null sorts first: ascending continues with the remaining nulls then every non null value
+        if after["d"] == 1:
+            return {"$or": [{field: {"$ne": None}}, {field: None, "_id": {op: _id}}]}
+        return {field: None, "_id": {op: _id}}
+    after_value = [{field: {op: value}}, {field: value, "_id": {op: _id}}]
+    # Range operators only match values of the same type: the values of the types sorting after it are selected by type
+    rank = _bson_order(value)[0]
+    types = (_BSON_TYPES[rank + 1:] if after["d"] == 1 else _BSON_TYPES[1:rank]) if rank < len(_BSON_TYPES) else []
+    after_value += [{field: {"$type": alias}} for alias in types]
+    if after["d"] == -1:
+        # range operators never match null, which sorts last when descending
+        after_value.append({field: None})
+    return {"$or": after_value}
+
+def _projection(include: Optional[set], exclude: Optional[set], keep: List[str]) -> Optional[dict]:
+    """
+    MongoDB projection for the include/exclude query parameters. Fields in `keep` (needed for cursors) are always returned.
+    """
+    if include:
+        fields = {"_id" if field == "id" else field for field in include} | set(keep)
+        # A path and its parent collide on MongoDB: only the parent is kept, eg. 'meta' for 'meta' and 'meta.created'
+        return {field: 1 for field in fields if not any(field.startswith(other + ".") for other in fields)}
+    if exclude:
+        # Fields overlapping a kept field are not excluded, eg. 'meta' for a 'meta.created' cursor
+        kept = lambda field: any(_overlaps(field, key) for key in keep)
+        return {"_id" if field == "id" else field: 0 for field in exclude if not kept(field) and field not in ("_id", "id")} or None
+    return None
+
+def _overlaps(field: str, other: str) -> bool:
+    """ Whether two dotted paths are the same field, or one is inside the other. """
+    return field == other or field.startswith(other + ".") or other.startswith(field + ".")
+
+def _apply_projection(doc: dict, projection: Optional[dict]) -> dict:
+    """ Applies a projection from _projection() to a document in memory (TinyDB). """
+    if not projection:
+        return doc
+    if next(iter(projection.values())):
+        # Top-level fields of dotted paths are kept whole
+        fields = {field.split(".")[0] for field in projection}
+        return {key: value for key, value in doc.items() if key in fields or key == "_id"}
+    return {key: value for key, value in doc.items() if key not in projection}
+
+def _construct_output(output_model: Type[BaseModel], doc: dict) -> BaseModel:
+    """
+    Builds the output model from a database document without validating it again. 
+    Maps _id to id, and makes naive datetimes UTC like DatabaseMongoBaseModel.__init__ does. See core.schemas.database.from_mongo().
+    """
+    return from_mongo(output_model, doc)
+
+def _dump_output(output_model: Type[BaseModel], doc: dict, **kwargs) -> dict:
+    """
+    The JSON output of a database document. DatabaseMongoBaseModel documents are dumped from a read-only view,
+    without building the model. See core.schemas.database.DocumentView.
+    """
+    if isinstance(output_model, type) and issubclass(output_model, DatabaseMongoBaseModel):
+        return output_model.view(doc).model_dump(mode="json", **kwargs)
+    return _construct_output(output_model, doc).model_dump(mode="json", warnings=False, **kwargs)
+
+_MISSING = object()
+
+def _changed(old: Any, new: Any) -> bool:
+    """ Whether a stored value differs from the new value of a field. Naive datetimes, as stored by PyMongo, are UTC. """
+    if isinstance(old, datetime) and isinstance(new, datetime):
+        old, new = (value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value for value in (old, new))
+    return old != new
+
+def _to_mongo(row: BaseModel) -> dict:
+    """ The document to store for a validated row. """
+    return row.to_mongo() if isinstance(row, DatabaseMongoBaseModel) else row.model_dump()
+
+def _parse_filter(filter: str) -> dict:
+    """ Decodes a filter in MongoDB Extended JSON into a query. Raises on invalid syntax. """
+    return decode_bson(bsonjs.loads(filter))
+
+# Operators that run server side JavaScript, not allowed in delete filters
+_UNSAFE_OPERATORS = {"$where", "$function", "$accumulator"}
+
+def _validate_filter(query: Any) -> None:
+    """ Raises ValueError if a filter uses an operator from _UNSAFE_OPERATORS. """
+    if isinstance(query, dict):
+        for key, value in query.items():
+            if key in _UNSAFE_OPERATORS:
+                raise ValueError(f"Operator {key} is not allowed.")
+            _validate_filter(value)
+    elif isinstance(query, list):
+        for value in query:
+            _validate_filter(value)
+
+def _tinydb_find_page(db_collection, query: dict, sort: Optional[List[Tuple[str, int]]], skip: int, limit: Optional[int], count: bool = True, after: Optional[dict] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[int]]:
+    """
+    Returns one page of documents and the total number of matching documents from a TinyDB collection.
+    TinyDB loads all matching documents anyway, so the total is always exact and free, and cursors are applied in memory.
+    The projection is applied to the page only.
+    """
+    docs = list(db_collection.find(query))
+    if sort:
+        for field, direction in reversed(sort):
+            docs.sort(key=_sort_key(field), reverse=direction == -1)
+    if after:
+        field = after["f"]
+        position = (_bson_order(after["v"]) if field else None, str(after["i"]))
+        key = lambda doc: (_sort_key(field)(doc) if field else None, str(doc["_id"]))
+        docs = [doc for doc in docs if (key(doc) > position if after["d"] == 1 else key(doc) < position)]
+    return [_apply_projection(doc, projection) for doc in (docs[skip:skip + limit] if limit else docs[skip:])], len(docs) if count else None
+
 class CRUDJsonEndpoints:
     """
     Class to build CRUD endpoints for JSON data for "GET","POST", "PATCH", "DELETE" methods. Interacts directly with the database collection to process data.
@@ -41,7 +242,7 @@ class CRUDJsonEndpoints:
         - input_model and output_model: Pydantic models for input and output data. If not provided, the collection model will be used.
             - Use Class Settings to apply additional settings to the models (Beanie / Pydantic)
         - name_singluar and name_plural: Names for the collection. Singular will create one item endpoint, and plural will create get_all endpoint. At least one must be provided. 
-        - method: HTTP method to create the endpoint for. Can be a string or a list of strings.
+        - method: HTTP method to create the endpoint for. Can be a string or a list of strings. Add "EXPORT" to register a streaming NDJSON/CSV export route.
         - input_hook and output_hook: Functions to execute once input has been received and validated before the db query, and before output is sent, for validation processing and to modify the content. Accepts BaseRoute or Callable functions. 
         - completed_callbacks: List of functions to execute after the endpoint has been executed. Built in FastAPI callbacks, require BaseRoute (endpoint) function.
     
@@ -49,8 +250,20 @@ class CRUDJsonEndpoints:
         Use the following parameters to apply additional settings to the models, other than that what can be normally applied by default (eg. type and required):
         - endpoints_readonly_fields : List of fields that are read only. These fields cannot be updated through the API endpoints. Only in the module logic.
         - endpoints_updated_field: Field to update with the current datetime when the document is updated.
+    
+    Caching:
+        If cache_ttl is set, GET responses are cached per collection, keyed on the path, the normalized query parameters, the auth headers and the cookies.
+        POST, PATCH and DELETE requests on the same collection clear its cached responses.
+        Cached responses carry ETag and Last-Modified headers, and conditional GETs (If-None-Match / If-Modified-Since) receive a 304.
         
     """
+    # Maximum number of documents counted for 'estimated' counts of filtered queries
+    estimated_count_cap: int = 10_000
+    # Largest page fetched with its count in one $facet aggregation on MongoDB, whose single result document must stay under 16MB
+    facet_max_per_page: int = 100
+    # Maximum number of documents a single bulk delete can remove
+    delete_many_cap: int = 1000
+    
     def __init__(
         self,
         router: APIRouter,
@@ -63,7 +276,7 @@ class CRUDJsonEndpoints:
         
         dependencies: Optional[List[Depends]] = None,
         tags: Optional[List[str]] = None,
-        cache_ttl: Optional[int] = None, # TODO If none, cache will not be used. POST/PATCH/DELETE requests will automatically clear the cache.
+        cache_ttl: Optional[int] = None, # If none, cache will not be used. POST/PATCH/DELETE requests will automatically clear the cache.
         
         # Models
         input_model: Type[BaseModel] = None,
@@ -105,7 +318,7 @@ class CRUDJsonEndpoints:
             
             dependencies: List of FastAPI Depends functions to execute before the endpoint is executed. Default is None.
             tags: List of tags to apply to the endpoint. Default is None.
-            cache_ttl: Time to live for the cache. Default is None.
+            cache_ttl: Seconds to cache GET responses for. Default is None, responses are not cached.
             
             pre_query_callback: Function to execute before the database query is made. Default is None.
             post_query_callback: Function to execute after the database query is made. Default is None.
@@ -135,7 +348,8 @@ class CRUDJsonEndpoints:
         self.input_model = input_model if input_model else self.collection
         
         self.cache_ttl = cache_ttl
-        self._cache = SimpleCache()
+        self._cache = crud_cache
+        self._cache_namespaces = set()
         
         # Callbacks
         self.pre_query_callback = pre_query_callback 
@@ -166,11 +380,200 @@ class CRUDJsonEndpoints:
     def create_endpoint(self):
         log.opt(depth=2).warning("Creating endpoints from init() is no longer supported. It will be removed in future versions. Use .build() instead.", stacklevel=3)
     
-    def clear_cache(self):
+    def clear_cache(self, collection: Optional[Type[Document]] = None):
+        """
+        Clears the cached responses. Automatically called from internal POST, PATCH and DELETE for the collection written to.
+        Can be called externally to clear the cache.
+        
+        Args:
+            collection: Collection to clear cached responses for. Default clears all collections built by this instance.
+        """
+        namespaces = [self._cache_namespace(collection)] if collection else list(self._cache_namespaces)
+        for namespace in namespaces:
+            self._cache.clear(namespace=namespace)
+    
+    @staticmethod
+    def _cache_namespace(collection) -> str:
+        return f"crud:{collection.Settings.name}"
+    
+    @staticmethod
+    def _cache_key(request: Request) -> str:
+        """
+        Cache key for a GET request: path, sorted query parameters and a digest of the credentials, the auth headers and
+        the cookies, so users authenticated by a session cookie never share cached responses.
+        """
+        params = sorted(request.query_params.multi_items())
+        auth = hashlib.sha256("|".join(request.headers.get(header, "") for header in ("authorization", "x-api-key", "cookie")).encode()).hexdigest()
+        return hashlib.sha256(json.dumps([request.url.path, params, auth]).encode()).hexdigest()
+    
+    @staticmethod
+    def _not_modified(request: Request, entry: dict) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            return if_none_match.strip() == "*" or entry["etag"] in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and entry["last_modified"] is not None:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= int(entry["last_modified"])
+            except (TypeError, ValueError):
+                return False
+        return False
+    
+    async def _find_page(self, collection, query: dict, sort: Optional[List[Tuple[str, int]]], skip: int, limit: int, count: bool = True, count_mode: CountMode = CountMode.exact, after: Optional[dict] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[int], bool]:
+        """
+        Fetches one page of documents and the total number of matching documents.
+        On MongoDB, pages of up to facet_max_per_page documents are counted in the same round trip, with a single $facet
+        aggregation. Larger pages, and pages on SQLite, are fetched and counted with two concurrent queries.
+        Queries are awaited through Database.get_async_collection(), TinyDB pages are built in a worker thread.
+        
+        Args:
+            after: Decoded keyset cursor. Only documents after it are returned, and the total is not counted.
+            projection: MongoDB projection for the returned documents.
+        
+        Returns:
+            The documents, the total (None if not counted) and whether the total is an estimate.
+        """
+        if Database.explain_sampled():
+            await Database.run_sync(Database.log_collscan, collection.Settings.name, query, sort)
+        if Database.using_tinydb:
+            items, total = await Database.run_sync(_tinydb_find_page, Database.get_collection(collection.Settings.name), query, sort, skip, limit, count and not after, after, projection)
+            return items, total, False
+        
+        db_collection = Database.get_async_collection(collection.Settings.name)
+        
+        if after:
+            query = {"$and": [query, _keyset_query(after)]} if query else _keyset_query(after)
+            count = False
+        page_stages = ([{"$sort": dict(sort)}] if sort else []) + [{"$skip": skip}, {"$limit": limit}] + ([{"$project": projection}] if projection else [])
+        if count and count_mode == CountMode.estimated and not query:
+            # Collection metadata, no scan
+            return await db_collection.find(query, projection, sort=sort, skip=skip, limit=limit).to_list(None), await db_collection.estimated_document_count(), True
+        if not count:
+            return await db_collection.find(query, projection, sort=sort, skip=skip, limit=limit).to_list(None), None, False
+        
+        if Database.using_sqlite or limit > self.facet_max_per_page:
+            cap = self.estimated_count_cap if count_mode == CountMode.estimated else None
+            count_kwargs = {"limit": cap} if cap else {}
+            items, total = await asyncio.gather(
+                db_collection.find(query, projection, sort=sort, skip=skip, limit=limit).to_list(None),
+                db_collection.count_documents(query, **count_kwargs),
+            )
+            return items, total, cap is not None and total >= cap
+        
+        count_stages = [{"$count": "count"}]
+        if count_mode == CountMode.estimated:
+            count_stages.insert(0, {"$limit": self.estimated_count_cap})
+        result = await db_collection.aggregate([
+            {"$match": query},
+            {"$facet": {"items": page_stages, "total": count_stages}},
+        ]).to_list(1)
+        result = result[0] if result else {}
+        total = result["total"][0]["count"] if result.get("total") else 0
+        return result.get("items", []), total, count_mode == CountMode.estimated and total >= self.estimated_count_cap
+    
+    def _export_stream(self, collection, output_model, query: dict, sort: Optional[List[Tuple[str, int]]], projection: Optional[dict], format: ExportFormat, columns: List[str], batch_size: int, limit: int, dump_include: Optional[set], dump_exclude: Optional[set], request: Request, input_hook=None, output_hook=None):
+        """
+        Generator streaming the matching documents one batch at a time, as NDJSON lines or CSV rows.
+        It is synchronous, so StreamingResponse runs it in the threadpool and only pulls the next batch once the previous one was sent.
+        Memory stays bounded by the batch size. Hooks are called once per batch.
+        
+        Each batch is a keyset query on (sort field, _id) read to the end, so no database cursor is kept between batches:
+        each batch may run on a different thread of the pool, and SQLite connections must not be shared between threads.
+        On TinyDB, which loads every matching document anyway, the documents are fetched once.
+        """
+        db_collection = Database.get_collection(collection.Settings.name)
+        if Database.explain_sampled():
+            Database.log_collscan(collection.Settings.name, query, sort)
+        sort_by, direction = sort[0] if sort else (None, 1)
+        
+        # Ties in _id order, in the sort direction, on every backend
+        keyset_sort = (sort or []) + [("_id", direction)]
+        
+        def batches():
+            if Database.using_tinydb:
+                items = _tinydb_find_page(db_collection, query, keyset_sort, 0, limit or None, False, projection=projection)[0]
+                for start in range(0, len(items), batch_size):
+                    yield items[start:start + batch_size]
+                return
+            remaining = limit or None
+            after = None
+            while remaining is None or remaining > 0:
+                size = min(batch_size, remaining) if remaining else batch_size
+                batch_query = query
+                if after:
+                    batch_query = {"$and": [query, _keyset_query(after)]} if query else _keyset_query(after)
+                batch = list(db_collection.find(batch_query, projection, sort=keyset_sort, limit=size))
+                if not batch:
+                    return
+                # Position after the last document, read before the hooks can change it
+                after = {"f": sort_by, "d": direction, "v": _field_value(batch[-1], sort_by) if sort_by else None, "i": batch[-1]["_id"]}
+                yield batch
+                if len(batch) < size:
+                    return
+                if remaining:
+                    remaining -= len(batch)
+        
+        def encode(batch: List[dict]) -> str:
+            _hook = self._execute_callback(input_hook, query=CRUDQueryData(data=query, method="get", request=request), output=batch)
+            if _hook: batch = _hook
+            output = [_dump_output(output_model, item, include=dump_include, exclude=dump_exclude) for item in batch]
+            _hook = self._execute_callback(output_hook, query=CRUDQueryData(data=query, method="get", request=request), output=output)
+            if _hook: output = _hook
+            if format == ExportFormat.ndjson:
+                return "".join(json.dumps(item, default=str) + "\n" for item in output)
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+            for item in output:
+                writer.writerow({key: json.dumps(value, default=str) if isinstance(value, (dict, list)) else value for key, value in item.items()})
+            return buffer.getvalue()
+        
+        try:
+            if format == ExportFormat.csv:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow(columns)
+                yield buffer.getvalue()
+            for batch in batches():
+                yield encode(batch)
+        except Exception as e:
+            # Headers are already sent, the client sees a truncated response
+            log.error(f"Export of {collection.Settings.name} failed: {e}")
+    
+    def _cached_endpoint(self, endpoint: Callable, collection) -> Callable:
         """
-        Clears the cache. Automatically called from internal POST, PATCH and DELETE. Can be called externally to clear the cache.
+        Wraps a GET endpoint with the response cache. The endpoint must accept `request` and `response` arguments.
+        Error responses (Response instances) are returned as is and never cached.
         """
-        self._cache.clear()
+        if not self.cache_ttl:
+            return endpoint
+        namespace = self._cache_namespace(collection)
+        self._cache_namespaces.add(namespace)
+        
+        @self._cache.async_cache(ttl=self.cache_ttl, key=lambda key, *args, **kwargs: key, namespace=namespace)
+        async def load(key, *args, **kwargs):
+            output = await endpoint(*args, **kwargs)
+            if isinstance(output, Response):
+                raise _UncachedResponse(output)
+            data = jsonable_encoder(output)
+            etag = '"' + hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()[:32] + '"'
+            return {"data": data, "etag": etag, "last_modified": time()}
+        
+        @wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs["request"]
+            try:
+                entry = await load(self._cache_key(request), *args, **kwargs)
+            except _UncachedResponse as e:
+                return e.response
+            headers = {
+                "ETag": entry["etag"],
+                "Last-Modified": formatdate(entry["last_modified"], usegmt=True),
+                "Cache-Control": f"private, max-age={self.cache_ttl}",
+            }
+            if self._not_modified(request, entry):
+                return Response(status_code=304, headers=headers)
+            kwargs["response"].headers.update(headers)
+            return entry["data"]
+        return wrapper
     
     def get(self,
         name_singluar: Optional[str] = None,
@@ -349,17 +752,23 @@ class CRUDJsonEndpoints:
         
         #### SCHEMA ####
         # endpoint to retrieve the schema of a collection. Uses pydantics model_json_schema() method.
+        # The schema is generated once per class, and revalidated by clients with its version as ETag.
         
         async def get_schema_endpoint(
                 request: Request,
+                response: Response,
             ):
+            headers = {"ETag": f'"{collection.schema_version(mode="validation")}"', "Cache-Control": "no-cache"}
+            if self._not_modified(request, {"etag": headers["ETag"], "last_modified": None}):
+                return Response(status_code=304, headers=headers)
+            response.headers.update(headers)
             return collection.model_json_schema(mode="validation")
 
         #### GET ENDPOINTS ####
         
-        # @self._cache.async_cache(ttl=self.cache_ttl)
         async def get_many_endpoint(
                 request: Request,
+                response: Response,
                 page: int = Query(1, description="Current page of the collection"),
                 per_page: int = Query(100, description="Number of items per page"),
                 sort_by: Optional[str] = Query(None, description="Field to sort by"),
@@ -369,10 +778,10 @@ class CRUDJsonEndpoints:
                 include: Optional[str] = Query(None, title="Include Fields", description="Fields to include in the results. Comma separated list of field names."),
                 # TODO - Add filters
                 filter: Optional[str] = Query(None, description="Filter results using JSON Extended Syntax. See https://www.mongodb.com/docs/manual/reference/mongodb-extended-json/#examples for more information."),
+                count: bool = Query(True, description="Count the total number of matching items. Set to false to skip counting on large collections."),
+                count_mode: CountMode = Query(CountMode.exact, description="'exact' counts every matching item. 'estimated' uses the collection metadata for unfiltered queries, and stops counting filtered queries at a cap."),
+                cursor: Optional[str] = Query(None, description="Keyset pagination. Pass an empty cursor for the first page, then the 'next_cursor' of each response. Replaces 'page', and totals are only counted on the first page."),
             ): 
-            # log.error("Fetching many") # DEBUG
-            # print(self.cache_ttl)
-            # print(self._cache.storage)
             if per_page > 1000:
                 per_page = 1000
             if per_page < 1:
@@ -384,8 +793,7 @@ class CRUDJsonEndpoints:
                 query["$text"] = {"$search": search}
             if filter:
                 try:
-                    bsion = bsonjs.loads(filter)
-                    query.update(RawBSONDocument(bsion))
+                    query.update(_parse_filter(filter))
                 except Exception as e:
                     log.error(e)
                     return JSONResponse(status_code=400, content={"message": "Invalid filter provided. Please check the syntax. Refer to https://www.mongodb.com/docs/manual/reference/mongodb-extended-json/#examples for more information.", "error": str(e)})
@@ -393,18 +801,37 @@ class CRUDJsonEndpoints:
             sort_order_value = 1 if sort_order == SortOrder.asc else -1
             sort = [(sort_by, sort_order_value)] if sort_by else None
             
+            # Only fetch the requested fields. The sort field is kept for the cursor, and dropped again when dumping the output
+            include_fields = {field.strip() for field in include.split(",") if field.strip()} if include else None
+            exclude_fields = {field.strip() for field in exclude.split(",") if field.strip()} if exclude and not include_fields else None
+            projection = _projection(include_fields, exclude_fields, [sort_by] if sort_by and cursor is not None else [])
+            dump_include = {"id" if field == "_id" else field for field in include_fields} if include_fields else None
+            dump_exclude = {"id" if field == "_id" else field for field in exclude_fields} if exclude_fields else None
+            
+            # Keyset pagination: range query on (sort_by, _id) instead of skipping, and one extra item to detect the next page
+            after = None
+            next_cursor = None
+            if cursor is not None:
+                page = 1
+                skip = 0
+                sort = (sort or []) + [("_id", sort_order_value)]
+                if cursor:
+                    try:
+                        after = _decode_cursor(cursor, sort_by, sort_order_value)
+                    except ValueError as e:
+                        return JSONResponse(status_code=400, content={"message": str(e)})
+            
             try:
-                active_count = await collection.find(query).count()
-            except Exception as e:
-                log.error(e)
-                return JSONResponse(status_code=400, content={"message": "Error with query.", "error": str(e)})    
-
-            try:
-                items = await collection.find(query).sort(sort).skip(skip).limit(per_page).to_list()   
+                items, total_items, total_estimated = await self._find_page(collection, query, sort, skip, per_page + 1 if cursor is not None else per_page, count, count_mode, after, projection)
+                if cursor is not None and len(items) > per_page:
+                    items = items[:per_page]
+                    next_cursor = _encode_cursor(items[-1], sort_by, sort_order_value)
                 _hook = self._execute_callback(input_hook, query=CRUDQueryData(data=query, method="get",request=request), output=items) # TODO Move first callback to BEFORE the database query is made
                 if _hook: items = _hook
             except pymongo_errors.PyMongoError as e:
-                return JSONResponse(status_code=400, content={"message": f"Error: {e}"})
+                if "text index required" in str(e):
+                    return JSONResponse(status_code=409, content={"message": "An Index on the Collection has not been found. Please create a text index on the collection or avoid using the search parameter."})
+                return JSONResponse(status_code=400, content={"message": "Error with query.", "error": str(e)})
             except Exception as e:
                 if "index required" in str(e):
                     return JSONResponse(status_code=409, content={"message": "An Index on the Collection has not been found. Please create a text index on the collection or avoid using the search parameter."})
@@ -412,34 +839,33 @@ class CRUDJsonEndpoints:
                 return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
             
             try:
-                output = [output_model(**item.model_dump()).model_dump() for item in items]
+                # Documents come from the database, so they are not validated again
+                output = [_dump_output(output_model, item, include=dump_include, exclude=dump_exclude) for item in items]
             except Exception as e:
                 log.error(e)
                 return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
             
-            if include:
-                include = include.split(",")
-                output = [{key: item[key] for key in include} for item in output]
-            elif exclude:
-                exclude = exclude.split(",")
-                output = [{key: item[key] for key in item if key not in exclude} for item in output]         
-            
             _hook = self._execute_callback(output_hook, query=CRUDQueryData(data=query, method="get",request=request), output=output)
             if _hook: output = _hook
             
             try:
-                return {"data": output, "status_code": 200, "current_page": page, "total_pages": int(ceil(active_count/per_page)), "per_page": per_page, "total_items": active_count}
+                return {
+                    "data": output, "status_code": 200, "page": page, "current_page": page, "per_page": per_page,
+                    "total_pages": int(ceil(total_items/per_page)) if total_items is not None else None,
+                    "total_items": total_items, "total_estimated": total_estimated, "next_cursor": next_cursor,
+                }
             except Exception as e:
                 log.error(e)
                 return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
 
         async def get_one_endpoint(
                 request: Request,
+                response: Response,
                 id: str = Path( description="ID of the item to retrieve", required=True ),
             ):
             
             try:
-                items = await collection.find_one({"_id":ObjectId(id)}) 
+                items = await Database.get_async_collection(collection.Settings.name).find_one({"_id":ObjectId(id)}) 
                 _hook = self._execute_callback(input_hook, query=CRUDQueryData(data={"_id":ObjectId(id)}, method="get",request=request), output=items)
                 if _hook: items = _hook
             except Exception as e:
@@ -451,13 +877,60 @@ class CRUDJsonEndpoints:
                     return JSONResponse(status_code=404, content={"message": "Item not found"})   
                 _hook = self._execute_callback(output_hook, query=CRUDQueryData(data={"_id":ObjectId(id)}, method="get",request=request), output=items)
                 if _hook: items = _hook
-                return output_model(**items.model_dump()).model_dump(exclude_none=True) 
+                return _dump_output(output_model, items, exclude_none=True)
             except pymongo_errors.PyMongoError as e:
                 return JSONResponse(status_code=400, content={"message": f"Error: {e}"})
             except Exception as e:
                 log.error(e)
                 return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
     
+        #### EXPORT ENDPOINTS ####
+        
+        async def export_endpoint(
+                request: Request,
+                format: ExportFormat = Query(ExportFormat.ndjson, description="'ndjson' streams one JSON document per line. 'csv' streams a header row and one row per document."),
+                batch_size: int = Query(1000, description="Number of documents fetched and sent per batch"),
+                limit: int = Query(0, description="Maximum number of documents to export. 0 exports all matching documents."),
+                sort_by: Optional[str] = Query(None, description="Field to sort by"),
+                sort_order: Optional[SortOrder] = Query(SortOrder.asc, description="Sort order for the results", example="asc"),
+                exclude: Optional[str] = Query(None, title="Exclude Fields", description="Fields to exclude from the results. Comma separated list of field names."),
+                include: Optional[str] = Query(None, title="Include Fields", description="Fields to include in the results. Comma separated list of field names."),
+                filter: Optional[str] = Query(None, description="Filter results using JSON Extended Syntax. See https://www.mongodb.com/docs/manual/reference/mongodb-extended-json/#examples for more information."),
+            ):
+            batch_size = min(max(batch_size, 1), 10000)
+            limit = max(limit, 0)
+            
+            query = {}
+            if filter:
+                try:
+                    query = _parse_filter(filter)
+                except Exception as e:
+                    log.error(e)
+                    return JSONResponse(status_code=400, content={"message": "Invalid filter provided. Please check the syntax. Refer to https://www.mongodb.com/docs/manual/reference/mongodb-extended-json/#examples for more information.", "error": str(e)})
+            sort = [(sort_by, 1 if sort_order == SortOrder.asc else -1)] if sort_by else None
+            
+            include_fields = [field.strip() for field in include.split(",") if field.strip()] if include else None
+            exclude_fields = [field.strip() for field in exclude.split(",") if field.strip()] if exclude and not include_fields else None
+            # The sort field is kept for the keyset queries of the batches, and dropped again when dumping the output
+            projection = _projection(include_fields, exclude_fields, [sort_by] if sort_by else [])
+            dump_include = {"id" if field == "_id" else field for field in include_fields} if include_fields else None
+            dump_exclude = {"id" if field == "_id" else field for field in exclude_fields} if exclude_fields else None
+            
+            # CSV columns, in the same order as the output model dump
+            columns = ["_id" if field == "id" else field for field in output_model.model_fields]
+            columns = columns[1:] + columns[:1] if columns[:1] == ["_id"] else columns
+            if include_fields:
+                columns = [field for field in columns if field in include_fields or (field == "_id" and "id" in include_fields)]
+            elif exclude_fields:
+                columns = [field for field in columns if field not in exclude_fields and not (field == "_id" and "id" in exclude_fields)]
+            
+            filename = f"{collection.Settings.name}.{format.value}"
+            return StreamingResponse(
+                self._export_stream(collection, output_model, query, sort, projection, format, columns, batch_size, limit, dump_include, dump_exclude, request, input_hook, output_hook),
+                media_type="application/x-ndjson" if format == ExportFormat.ndjson else "text/csv",
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+            )
+            
         #### POST ENDPOINTS ####
         async def post_endpoint(
                 request: Request,
@@ -472,6 +945,7 @@ class CRUDJsonEndpoints:
                 return JSONResponse(status_code=400, content={"message": "Too many items to insert. Limit to 1000 items."})
             
             _to_insert = []
+            _inserted_items = []
             completed = []
             errors = []
             for item in data:
@@ -493,7 +967,8 @@ class CRUDJsonEndpoints:
                     row = collection(**item.model_dump()) # Validate the data
                     _hook = self._execute_callback(input_hook, query=CRUDQueryData(data=item.model_dump(), method="post",request=request), output=row)
                     if _hook: row = _hook
-                    _to_insert.append(row.model_dump())
+                    _to_insert.append(_to_mongo(row))
+                    _inserted_items.append(item)
                 except pymongo_errors.PyMongoError as e:
                     _e = str(e).split("full error:")[0] if "full error:" in str(e) else e
                     errors.append({"message": f"Error: {_e}", "data": str(item.model_dump()) if return_item_data_on_error else None})
@@ -503,28 +978,31 @@ class CRUDJsonEndpoints:
             
             try:
                 if _to_insert:
-                    log.warning("Inserting..." + str(collection.Settings.name) + str(_to_insert))
-                    _collection = Database.get_collection(collection.Settings.name)
-                    # insert = await collection.insert_many(_to_insert) 
-                    insert = _collection.insert_many(_to_insert)
-                    log.warning(insert)
-                    query = {"_id": {"$in": insert.inserted_ids}}
-                    # documents = await collection.find(query).to_list(None)
-                    documents = _collection.find(query)
-                    completed = [output_model(**item).model_dump() for item in documents]
-
-                    # If an error occurs, it will raise an exception
+                    _collection = Database.get_async_collection(collection.Settings.name)
+                    failed = {}
+                    try:
+                        await _collection.insert_many(_to_insert, ordered=False)
+                    except pymongo_errors.BulkWriteError as e:
+                        # Unordered: every document without a write error was inserted
+                        for write_error in e.details.get("writeErrors", []):
+                            failed[write_error["index"]] = write_error.get("errmsg", "Write error")
+                    # The documents already hold their final values and _id, so the response is built without reading them back
+                    for index, (item, document) in enumerate(zip(_inserted_items, _to_insert)):
+                        if index in failed:
+                            _e = failed[index].split("full error:")[0]
+                            errors.append({"message": f"Error: {_e}", "data": str(item.model_dump()) if return_item_data_on_error else None})
+                        else:
+                            completed.append(_dump_output(output_model, document))
                     
                 if not completed:
                     return JSONResponse(status_code=400, content={"message": "Failed to insert data. Check the data and try again.", "errors": errors})
+                self.clear_cache(collection)
                 
                 completed_hook = self._execute_callback(output_hook, query=CRUDQueryData(data=None, method="post",request=request), output=completed)
                 if completed_hook: completed = completed_hook
                 
                 return {
                     "status_code": 200, "message": f"Sucessfully saved {len(completed)} {name_plural.capitalize()}, with {len(errors)} errors.", "success": completed, "errors": errors}
-            except pymongo_errors.BulkWriteError as e:
-                return JSONResponse(status_code=400, content={"message": f"Error: {e}"})
             except pymongo_errors.PyMongoError as e:
                 _e = str(e).split("full error:")[0] if "full error:" in str(e) else e
                 return JSONResponse(status_code=400, content={"message": f"Error: {_e}"})
@@ -553,77 +1031,121 @@ class CRUDJsonEndpoints:
         #         })
         
         #### PUT / PATCH ENDPOINTS ####
-        async def patch_many_endpoint( # DEBUG
+        async def patch_many_endpoint(
                 request: Request,
-                data: Union[List[input_model], input_model],
-                # data: List[OptionalInputModel],
+                data: Union[List[dict], dict] = Body(..., description="Item or list of items to update. Each item requires its 'id' and the key-value pairs to modify."),
             ): 
-            # TODO NOTE Update_many() only works by using a search criteria, meaning all items will have the same data updates. Probably need to use update one at a time to update multiple items. Further research needed.
             if not data:
                 return JSONResponse(status_code=400, content={"message": "No data provided"})
-                                                
+            
+            data = data if isinstance(data, list) else [data]
+            
+            if len(data) > 1000:
+                return JSONResponse(status_code=400, content={"message": "Too many items to update. Limit to 1000 items."})
+            
+            readonly_fields = getattr(collection.Settings, "endpoints_readonly_fields", None) or []
+            updated_field = getattr(collection.Settings, "endpoints_updated_field", None)
+            
             completed = []
             errors = []
+            _ids = []
             for item in data:
+                _id = item.get("id") or item.get("_id")
+                if not _id:
+                    errors.append({"message": "ID field is required to update an item", "data": item if return_item_data_on_error else None})
+                    continue
                 try:
-                    # item = item.model_dump()
-                    item['id'] = item.get("id")  or item.get("_id")
-                    if not item.get("id"):
-                        errors.append({"message": "ID field is required to update an item", "data": item if return_item_data_on_error else None})
-                        continue
-                    item['id'] = ObjectId(item['id'])
-                    # Obtain item first.
-                    row = await collection.find_one({"_id":item['id']})
-                    if not row:
+                    _ids.append((item, ObjectId(_id)))
+                except Exception:
+                    errors.append({"message": "Invalid ID", "data": item if return_item_data_on_error else None})
+            
+            try:
+                # Prefetch every item in one query
+                _collection = Database.get_async_collection(collection.Settings.name)
+                existing = {str(doc["_id"]): doc for doc in await _collection.find({"_id": {"$in": [_id for _, _id in _ids]}}).to_list(None)} if _ids else {}
+            except pymongo_errors.PyMongoError as e:
+                return JSONResponse(status_code=400, content={"message": f"Error: {e}"})
+            except Exception as e:
+                log.error(e)
+                return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
+            
+            # Validate all items before writing. Every field the validated row (and the input hook) changed is $set.
+            updates = []
+            for item, _id in _ids:
+                try:
+                    doc = existing.get(str(_id))
+                    if not doc:
                         errors.append({"message": "Item not found", "data": item if return_item_data_on_error else None})
                         continue
-                    try:
-                        for key, value in item.items():
-                            # Update row with new value
-                            if hasattr(row, key):
-                                try:
-                                    # Check if field is read only
-                                    if key in collection.Settings.endpoints_readonly_fields:
-                                        log.warning(f"Field {key} is read only and should not be in the input_model. ")
-                                        continue
-                                except:
-                                    pass
-                                # NOTE Will set value to None if in json input!
-                                setattr(row, key, value)
-                            
-                    except Exception as e:
-                        log.error(e)
-                        errors.append({"message": "Something went wrong. Please see the logs.", "data": item if return_item_data_on_error else None})
-                        continue
-                    # Callback
+                    changes = {}
+                    for key, value in item.items():
+                        if key in ("id", "_id") or key not in collection.model_fields:
+                            continue
+                        if key in readonly_fields:
+                            log.warning(f"Field {key} is read only and should not be in the input_model. ")
+                            continue
+                        # NOTE Will set value to None if in json input!
+                        changes[key] = value
+                    row = collection(**{**doc, **changes}) # Validate the data
                     _hook = self._execute_callback(input_hook, query=CRUDQueryData(data=item, method="patch",request=request), output=row)
                     if _hook: row = _hook
-                    # Update
-                    try:
-                        setattr(row, collection.Settings.endpoints_updated_field, utc_now())
-                    except:
-                        pass
-                    update = await row.save()
-                    row.sa
-                    if update:
-                        completed.append(output_model(**row.model_dump()).model_dump())
-                    else:
-                        errors.append({"message": "An error occurred", "data": item if return_item_data_on_error else None})
-                except pymongo_errors.PyMongoError as e:
-                    errors.append({"message": f"Error: {e}", "data": item if return_item_data_on_error else None})
+                    if updated_field:
+                        setattr(row, updated_field, utc_now())
+                    row_data = _to_mongo(row)
+                    update = {key: value for key, value in row_data.items() if key != "_id" and _changed(doc.get(key, _MISSING), value)}
+                    updates.append((item, {**row_data, "_id": doc["_id"]}, {"_id": doc["_id"]}, {"$set": update}))
                 except Exception as e:
                     log.error(e)
-                    errors.append({"message": "Something went wrong. Please see the logs.", "data": item if return_item_data_on_error else None})
+                    errors.append({"message": "Malformed data.", "data": item if return_item_data_on_error else None})
             
             try:
+                failed = {}
+                not_found = set()
+                if updates and Database.using_tinydb:
+                    # TinyDB updates are applied one by one, so a failed update does not fail the others
+                    for index, (_, _, _filter, _update) in enumerate(updates):
+                        try:
+                            # raw_result holds the ids of the updated documents
+                            if not (await _collection.update_one(_filter, _update)).raw_result:
+                                not_found.add(index)
+                        except pymongo_errors.DuplicateKeyError as e:
+                            failed[index] = str(e)
+                        except Exception as e:
+                            log.error(e)
+                            failed[index] = "Something went wrong. Please see the logs."
+                elif updates:
+                    try:
+                        matched = (await _collection.bulk_write([UpdateOne(_filter, _update) for _, _, _filter, _update in updates], ordered=False)).matched_count
+                    except pymongo_errors.BulkWriteError as e:
+                        # Unordered: every operation without a write error was applied
+                        for write_error in e.details.get("writeErrors", []):
+                            failed[write_error["index"]] = write_error.get("errmsg", "Write error")
+                        matched = e.details.get("nMatched", 0)
+                    if matched < len(updates) - len(failed):
+                        # Items deleted since they were fetched: find which ones
+                        _written = [index for index in range(len(updates)) if index not in failed]
+                        _found = {str(doc["_id"]) for doc in await _collection.find({"_id": {"$in": [updates[index][2]["_id"] for index in _written]}}, {"_id": 1}).to_list(None)}
+                        not_found = {index for index in _written if str(updates[index][2]["_id"]) not in _found}
+                for index, (item, updated_doc, _, _) in enumerate(updates):
+                    if index in failed:
+                        errors.append({"message": f"Error: {failed[index]}", "data": item if return_item_data_on_error else None})
+                    elif index in not_found:
+                        errors.append({"message": "Item not found", "data": item if return_item_data_on_error else None})
+                    else:
+                        completed.append(_dump_output(output_model, updated_doc))
+                
                 if not completed:
-                    return JSONResponse(status_code=400, content={"message": "Failed to insert data. Check the data and try again.", "errors": errors})
+                    return JSONResponse(status_code=400, content={"message": "Failed to update data. Check the data and try again.", "errors": errors})
+                self.clear_cache(collection)
                         
                 _hook = self._execute_callback(output_hook, query=CRUDQueryData(data=None, method="patch",request=request), output=completed)
                 if _hook: completed = _hook
                 
                 return {
                     "status_code": 200, "message": f"Sucessfully saved {len(completed)} {name_plural.capitalize()}, with {len(errors)} errors.", "success": completed, "errors": errors}
+            except pymongo_errors.PyMongoError as e:
+                _e = str(e).split("full error:")[0] if "full error:" in str(e) else e
+                return JSONResponse(status_code=400, content={"message": f"Error: {_e}"})
             except Exception as e:
                 log.error(e)
                 return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
@@ -693,6 +1215,7 @@ class CRUDJsonEndpoints:
             try:
                 if not completed:
                     return JSONResponse(status_code=400, content={"message": "Failed to insert data. Check the data and try again.", "errors": errors})
+                self.clear_cache(collection)
                 _hook = self._execute_callback(output_hook, query=CRUDQueryData(data=None, method="patch",request=request), output=completed)
                 if _hook: completed = _hook
                 
@@ -705,14 +1228,82 @@ class CRUDJsonEndpoints:
                         
 
         #### DELETE ENDPOINTS ####
-        # TODO Introduce a delete many function ? delete_many() with using ID in _ condition/query. 
+        async def delete_many_endpoint(
+                request: Request,
+                data: CRUDRequestModelDeleteMany,
+                dry_run: bool = Query(False, description="Only count the matching items, without deleting them."),
+            ):
+            """
+            Deletes a batch of items by ids or filter with a single delete_many.
+            The matching items are counted first, and nothing is deleted if they exceed max_items or the endpoint cap.
+            The items are then fetched up to the cap, and the delete is limited to the fetched items, checked against the cap again.
+            Hooks receive the whole batch: input_hook the matching documents (and can return fewer), output_hook the deleted items.
+            """
+            if not data.ids and not data.filter:
+                return JSONResponse(status_code=400, content={"message": "Provide 'ids' or a non empty 'filter' of the items to delete."})
+            max_items = min(data.max_items or self.delete_many_cap, self.delete_many_cap)
+            
+            query = {}
+            if data.filter:
+                try:
+                    query = _parse_filter(data.filter)
+                    _validate_filter(query)
+                except Exception as e:
+                    log.error(e)
+                    return JSONResponse(status_code=400, content={"message": "Invalid filter provided. Please check the syntax. Refer to https://www.mongodb.com/docs/manual/reference/mongodb-extended-json/#examples for more information.", "error": str(e)})
+                if not query:
+                    return JSONResponse(status_code=400, content={"message": "The filter cannot be empty."})
+            if data.ids:
+                try:
+                    ids = [ObjectId(_id) for _id in data.ids]
+                except Exception:
+                    return JSONResponse(status_code=400, content={"message": "Invalid ID provided."})
+                query = {"$and": [query, {"_id": {"$in": ids}}]} if query else {"_id": {"$in": ids}}
+            
+            try:
+                _collection = Database.get_async_collection(collection.Settings.name)
+                matched = await _collection.count_documents(query, limit=max_items + 1)
+                if matched > max_items:
+                    return JSONResponse(status_code=409, content={"message": f"More than {max_items} items match. Narrow the filter or delete in smaller batches."})
+                if dry_run:
+                    return CRUDResponseModelDelete(status_code=200, message=f"{matched} items would be deleted.", matched_count=matched, deleted_count=0, dry_run=True)
+                if not matched:
+                    return JSONResponse(status_code=404, content={"message": "No items found", "matched_count": 0})
+                
+                # The fetched documents bound the delete, not the count: items inserted since then do not get past the cap
+                items = await _collection.find(query, limit=max_items + 1).to_list(max_items + 1)
+                matched = len(items)
+                if matched > max_items:
+                    return JSONResponse(status_code=409, content={"message": f"More than {max_items} items match. Narrow the filter or delete in smaller batches."})
+                _hook = self._execute_callback(input_hook, query=CRUDQueryData(data=query, method="delete",request=request), output=items)
+                if _hook is not None: items = _hook
+                if len(items) > max_items:
+                    return JSONResponse(status_code=409, content={"message": f"The input hook returned more than {max_items} items to delete."})
+                if not items:
+                    return CRUDResponseModelDelete(status_code=200, message="No items deleted.", matched_count=matched, deleted_count=0)
+                
+                # Only the documents the hooks have seen are deleted
+                result = await _collection.delete_many({"_id": {"$in": [item["_id"] for item in items]}})
+                self.clear_cache(collection)
+                
+                deleted = [_dump_output(output_model, item) for item in items]
+                self._execute_callback(output_hook, query=CRUDQueryData(data=query, method="delete",request=request), output=deleted)
+                return CRUDResponseModelDelete(status_code=200, message=f"Deleted {result.deleted_count} {name_plural.capitalize()}.", matched_count=matched, deleted_count=result.deleted_count)
+            except pymongo_errors.PyMongoError as e:
+                _e = str(e).split("full error:")[0] if "full error:" in str(e) else e
+                return JSONResponse(status_code=400, content={"message": f"Error: {_e}"})
+            except Exception as e:
+                log.error(e)
+                return JSONResponse(status_code=500, content={"message": "Something went wrong. Please see the logs."})
+        
         async def delete_one_endpoint(
                 request: Request,
                 id: str = Path( description="ID of the item to delete", required=True ),
             ):
             
             try:
-                items = await collection.find_one({"_id":ObjectId(id)}) 
+                _collection = Database.get_async_collection(collection.Settings.name)
+                items = await _collection.find_one({"_id":ObjectId(id)}) 
                 _hook = self._execute_callback(input_hook, query=CRUDQueryData(data={"_id":ObjectId(id)}, method="delete",request=request), output=items)
                 if _hook: items = _hook
             except Exception as e:
@@ -726,8 +1317,9 @@ class CRUDJsonEndpoints:
                 _hook = self._execute_callback(output_hook, query=CRUDQueryData(data={"_id":ObjectId(id)}, method="delete",request=request), output=items)
                 if _hook: items = _hook
                 if items:
-                    _del = await items.delete()
-                    if _del: 
+                    _del = await _collection.delete_one({"_id": items["_id"]})
+                    if _del.deleted_count: 
+                        self.clear_cache(collection)
                         return CRUDResponseModelDelete(id=id, status_code=200, message="Item deleted successfully")
                     return JSONResponse(status_code=500, content={"message": "An error occurred while deleting the item."})
             except pymongo_errors.PyMongoError as e:
@@ -746,7 +1338,8 @@ class CRUDJsonEndpoints:
         ###### ADD ENDPOINTS TO ROUTER
         ############################################################
         
-        for _method in method:
+        # The export route is added first, so "/{name_plural}/export" is not captured by "/{name_singluar}/{id}"
+        for _method in sorted(method, key=lambda m: m.lower() != "export"):
             
             match _method.lower():
                 case "get":
@@ -754,7 +1347,7 @@ class CRUDJsonEndpoints:
                     if name_plural:
                         self.router.add_api_route(
                             f"{self.prefix}/{name_plural}",
-                            get_many_endpoint,
+                            self._cached_endpoint(get_many_endpoint, collection),
                             methods=["get"],
                             dependencies=dependencies,
                             response_model=CRUDResponseModelGet,
@@ -784,7 +1377,7 @@ class CRUDJsonEndpoints:
                         
                         self.router.add_api_route(
                             f"{self.prefix}/{name_singluar}"+"/{id}",
-                            get_one_endpoint,
+                            self._cached_endpoint(get_one_endpoint, collection),
                             methods=["get"],
                             dependencies=dependencies,
                             response_model=output_model,
@@ -867,6 +1460,37 @@ class CRUDJsonEndpoints:
                             name=f"{name_singluar}_delete",
                             callbacks=completed_callbacks
                         )                    
+                    if name_plural:
+                        self.router.add_api_route(
+                            f"{self.prefix}/{name_plural}",
+                            delete_many_endpoint,
+                            methods=["delete"],
+                            dependencies=dependencies,
+                            response_model=CRUDResponseModelDelete,
+                            tags=tags,
+                            summary=f"Delete many {(self.base_name + ' ' if self.base_name else '')}{name_plural.capitalize()}",
+                            description=description + f"\n\nUse this endpoint to delete a batch of items by 'ids' or 'filter', up to {self.delete_many_cap} items. Use dry_run to count the matching items first.",
+                            include_in_schema=include_in_schema,
+                            name=f"{name_plural}_delete",
+                            callbacks=completed_callbacks
+                        )
+                case "export":
+                    """
+                    Export endpoint streams every matching document as NDJSON or CSV, without pagination. Not included in the default methods.
+                    """
+                    if name_plural:
+                        self.router.add_api_route(
+                            f"{self.prefix}/{name_plural}/export",
+                            export_endpoint,
+                            methods=["get"],
+                            dependencies=dependencies,
+                            tags=tags,
+                            summary=f"Export {(self.base_name + ' ' if self.base_name else '')}{name_plural}",
+                            description=description + "\n\nUse this endpoint to stream all matching items as NDJSON or CSV.",
+                            include_in_schema=include_in_schema,
+                            name=f"{name_plural}_export",
+                            callbacks=completed_callbacks,
+                        )
                 case "search":
                     """
                     Search endpoint is useful to send a MongoDB compliant JSON query to the collection and return the results.
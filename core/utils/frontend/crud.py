@@ -206,6 +206,8 @@ class CrudBuilder:
     # @ui.refreshable
     def items(self, query:dict = {}) -> None:
         
+        if Database.explain_sampled():
+            Database.log_collscan(self.db_name, query)
         self.db_items: List[self.db] = list(self.db.find(query))
         self.table_items: List[self.db] = []
         
@@ -0,0 +1,65 @@
+"""
+Startup timings.
+
+Records how long each step of the application startup takes: the import of each module, the inclusion of its routes,
+the fetch of the module configurations and the creation of the indexes of each collection. main.py logs them as a
+startup report once the application has started.
+
+Import times include the packages a module is the first to import, so shared dependencies are counted once, on the
+first module importing them.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+
+class StartupTimings:
+    """
+    Timings of the startup steps, in the order they were recorded.
+    Usage:
+        with StartupTimings.measure("import", "users"):
+            import_module("core.modules.users.main")
+        log.info(StartupTimings.report())
+    """
+    _lock = threading.Lock()
+    _timings: List[tuple] = []  # (phase, name, seconds)
+
+    @classmethod
+    @contextmanager
+    def measure(cls, phase: str, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.record(phase, name, time.perf_counter() - start)
+
+    @classmethod
+    def record(cls, phase: str, name: str, seconds: float):
+        with cls._lock:
+            cls._timings.append((phase, name, seconds))
+
+    @classmethod
+    def timings(cls) -> List[Dict[str, Any]]:
+        with cls._lock:
+            return [{"phase": phase, "name": name, "ms": round(seconds * 1000, 3)} for phase, name, seconds in cls._timings]
+
+    @classmethod
+    def report(cls, total: float = None) -> str:
+        """ The timings grouped by phase, slowest first, with the total of each phase. """
+        phases: Dict[str, list] = {}
+        with cls._lock:
+            for phase, name, seconds in cls._timings:
+                phases.setdefault(phase, []).append((name, seconds))
+        width = max([len(name) for timings in phases.values() for name, _ in timings] + [10])
+        lines = ["Startup report" + (f": {total:.3f} seconds" if total is not None else "")]
+        for phase, timings in phases.items():
+            lines.append(f"  {phase:<{width + 2}} {sum(seconds for _, seconds in timings) * 1000:>10.1f} ms")
+            for name, seconds in sorted(timings, key=lambda timing: timing[1], reverse=True):
+                lines.append(f"    {name:<{width}} {seconds * 1000:>10.1f} ms")
+        return "\n".join(lines)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._timings = []
@@ -2,7 +2,7 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter, Depends, Request, BackgroundTasks, HTTPException #, Body, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 # from beanie import init_beanie, Document
 # from beanie.operators import In
 # from motor.motor_asyncio import AsyncIOMotorClient
@@ -11,14 +11,20 @@ from core import log, print
 from core.utils.sqlite import engine, Base
 from core.schemas.database import DatabaseMongoBaseModel
 import traceback
+from secrets import compare_digest
 from os import path
 from importlib import import_module, util
+import asyncio
 import inspect
 import sys
+from typing import List
 
 from core.config import settings
 from core import Module
 from core.utils.database import Database
+from core.utils.database_metrics import DatabaseMetrics
+from core.utils.startup import StartupTimings
+from core.schemas.module_schema import ModuleSchema
 from pymongo import IndexModel
 
 # TODO Use https://www.adminer.org/en/ for advanced database management ??
@@ -48,15 +54,19 @@ async def lifespan(application: FastAPI):
     # lifespan_variables["test"] = name_of_function
     log.info("Loading lifespan function")
     # Initialize MongoDB instances
-    if await start_database():
+    with StartupTimings.measure("lifespan", "database"):
+        _db_initialised = await start_database()
+    if _db_initialised:
     # Initialize Module configurations and DB schemas
-        await start_modules()  
+        with StartupTimings.measure("lifespan", "modules"):
+            await start_modules()  
     
     else:
         log.error("Failed to initialize Database. Exiting.")
         return
 
     log.info("Application started in {:.3f} seconds".format(time() - _start))
+    log.info(StartupTimings.report(time() - _start))
 
     yield
     # Clean up the models and data and release the resources
@@ -92,34 +102,47 @@ async def start_database():
     else:
         try:
             # Use a connection pool for MongoDB and PyMongo! 
-            _dbConnection = "TinyDB" if 'tinydb' in settings.MONGODB_URI else "MongoDB"
+            _dbConnection = "TinyDB" if 'tinydb' in settings.MONGODB_URI else "SQLite" if settings.MONGODB_URI.startswith('sqlite') else "MongoDB"
             log.info(f"Connecting to {_dbConnection} Database: {settings.DATABASE_NAME}")
             if Database.connect(settings.MONGODB_URI, settings.DATABASE_NAME):
                 # collection.create_index([('field_i_want_to_index', pymongo.TEXT)], name='search_index', default_language='english')
                 # https://pymongo.readthedocs.io/en/stable/api/pymongo/collection.html#pymongo.collection.Collection.create_index
-                # TODO Create indexes for the given collections
+                # Indexes are created on every backend: TinyDB keeps them in memory, SQLite creates expression indexes
                 if _mongo_db:
-                    if not Database.using_tinydb:
-                        # Loop through all the collections and create indexes
-                        for collection in _mongo_db:
-                            if hasattr(collection, "Settings"):
-                                if hasattr(collection.Settings, "indexes"):
-                                    _indexes = []
-                                    if not isinstance(collection.Settings.indexes, list):
-                                        collection.Settings.indexes = [collection.Settings.indexes]
-                                    for index in collection.Settings.indexes:
-                                        # Create the index
-                                        if not isinstance(index, IndexModel):
-                                            raise Exception(f"Index is not an instance of pymongo.IndexModel: {index}")
-                                        _indexes.append(index)
-                                    if _indexes:
-                                        Database.db[collection.Settings.name].create_indexes(_indexes)
-                                        log.info(f"Created index on {collection.Settings.name}")
-                            else:
-                                log.error(f"No Settings class found for {collection}")
-                                raise Exception(f"No Settings class found for {collection}")
-                        
-                        log.info("MongoDB Initialized tables: " + str([t.Settings.name for t in _mongo_db]))
+                    # Loop through all the collections and collect their indexes
+                    _collection_indexes = []
+                    for collection in _mongo_db:
+                        if hasattr(collection, "Settings"):
+                            if hasattr(collection.Settings, "indexes"):
+                                _indexes = []
+                                if not isinstance(collection.Settings.indexes, list):
+                                    collection.Settings.indexes = [collection.Settings.indexes]
+                                for index in collection.Settings.indexes:
+                                    # Create the index. Dicts hold the keys and options of create_index()
+                                    if isinstance(index, dict):
+                                        index = IndexModel(**index)
+                                    if not isinstance(index, IndexModel):
+                                        raise Exception(f"Index is not an instance of pymongo.IndexModel: {index}")
+                                    _indexes.append(index)
+                                if _indexes:
+                                    _collection_indexes.append((collection.Settings.name, _indexes))
+                        else:
+                            log.error(f"No Settings class found for {collection}")
+                            raise Exception(f"No Settings class found for {collection}")
+                    
+                    # Indexes of all the collections are created concurrently
+                    _results = await asyncio.gather(*(create_indexes(name, indexes) for name, indexes in _collection_indexes), return_exceptions=True)
+                    _failed = None
+                    for (name, _), result in zip(_collection_indexes, _results):
+                        if isinstance(result, Exception):
+                            log.error(f"Failed to create indexes on {name}: {result}")
+                            _failed = _failed or result
+                        else:
+                            log.info(f"Created index on {name}")
+                    if _failed:
+                        raise _failed
+                    
+                    log.info(f"{_dbConnection} Initialized tables: " + str([t.Settings.name for t in _mongo_db]))
                 
             # client = AsyncIOMotorClient(settings.MONGODB_URI)
             # # Specify the database
@@ -138,16 +161,30 @@ async def start_database():
     return db_initialised
 
 
+async def create_indexes(collection_name: str, indexes: List[IndexModel]):
+    """
+    Creates the indexes of a collection without blocking the event loop, in a worker thread (on the database thread with TinyDB).
+    """
+    def create():
+        with StartupTimings.measure("indexes", collection_name):
+            return Database.get_collection(collection_name).create_indexes(indexes)
+    return await Database.run_sync(create)
+
+
 async def start_modules():
     """
     Loads modules configuration and database schemas.
     """
     log.info("Lifespan: Loading Modules")
+    # Configurations of all the modules are fetched in one query
+    with StartupTimings.measure("config", "fetch"):
+        _documents = ModuleSchema.fetch_config_documents([name for name, module in Module.modules.items() if module])
     # Load configurations for modules
     for module_name, module in Module.modules.items():
         try:
             if module:
-                module.fetch_config()
+                with StartupTimings.measure("config", module.name):
+                    module.fetch_config(_documents.get(module.name))
                 # print(__file__, module)
                 log.info(f"Module '{module.name}' config loaded")
         except Exception as e:
@@ -303,4 +340,20 @@ async def health(background_tasks: BackgroundTasks):
     # TODO Start Cron Jobs
     return {"status": "ok"}
 
+@app.get("/metrics/database", include_in_schema=False)
+async def database_metrics(request: Request, reset: bool = False):
+    """
+    Latency histograms per collection and operation, the costliest query shapes and the slow-query log of this worker.
+    Requires DATABASE_METRICS and METRICS_TOKEN, sent as a bearer token. reset=true starts new aggregates.
+    """
+    # Without a token the endpoint is not exposed, so metrics are never readable (or reset) anonymously
+    if not settings.DATABASE_METRICS or not settings.METRICS_TOKEN:
+        return JSONResponse(status_code=404, content={"message": "Database metrics are disabled."})
+    if not compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return JSONResponse(status_code=401, content={"message": "Invalid metrics token."})
+    metrics = DatabaseMetrics.snapshot()
+    if reset:
+        DatabaseMetrics.reset()
+    return metrics
+
 log.info("FastAPI Loaded")
\ No newline at end of file
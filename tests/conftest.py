@@ -0,0 +1,9 @@
+"""
+The settings are read on the first import of core: the .env file of the project is used when present, otherwise the
+required settings get test values.
+"""
+import os
+
+os.environ.setdefault("PROJECT_NAME", "DragonApp")
+os.environ.setdefault("FIRST_SUPERUSER", "admin@example.com")
+os.environ.setdefault("FIRST_SUPERUSER_PASSWORD", "test-password")
@@ -0,0 +1,60 @@
+"""
+Tests of the in-process cache (core.utils.cache.SimpleCache) and of its namespace, tag and expiry indexes.
+"""
+import time
+
+from core.utils.cache import SimpleCache
+
+
+def index_sizes(cache: SimpleCache) -> tuple:
+    return (
+        sum(len(keys) for keys in cache._namespaces.values()),
+        sum(len(keys) for keys in cache._tags.values()),
+        sum(len(keys) for keys in cache._expiry_buckets.values()),
+    )
+
+
+def test_lru_eviction_unindexes_entries():
+    cache = SimpleCache(max_entries=10, max_bytes=None)
+    for i in range(1000):
+        cache.set(f"k{i}", i, ttl=None if i % 2 else 300, namespace=f"ns{i % 7}", tags=[f"t{i}", "all"])
+    assert len(cache.storage) == 10
+    # Each of the 10 entries is in its namespace, its own tag and "all", and half of them expire
+    assert index_sizes(cache) == (10, 20, 5)
+    assert len(cache._tags) == 11
+    assert cache.stats()["evictions"] == 990
+    assert cache.invalidate_tags("all") == 10
+    assert index_sizes(cache) == (0, 0, 0)
+    assert not cache._namespaces and not cache._tags and not cache._expiry_buckets
+
+
+def test_byte_eviction_unindexes_entries():
+    cache = SimpleCache(max_entries=None, max_bytes=1000, sizer=lambda value: 100)
+    for i in range(100):
+        cache.set(f"k{i}", i, ttl=None, tags=[f"t{i}"])
+    assert len(cache.storage) == 10
+    assert index_sizes(cache) == (10, 10, 0)
+    assert cache.stats()["bytes"] == 1000
+
+
+def test_overwrite_moves_indexes():
+    cache = SimpleCache(max_entries=None, max_bytes=None)
+    cache.set("k", 1, ttl=300, tags=["old"])
+    cache.set("k", 2, ttl=None, tags=["new"])
+    assert set(cache._tags) == {"new"} and not cache._expiry_buckets
+    assert cache.invalidate_tags("old") == 0
+    assert cache.get("k") == 2
+    cache.clear()
+    assert index_sizes(cache) == (0, 0, 0)
+
+
+def test_expiry_unindexes_entries(monkeypatch):
+    cache = SimpleCache(max_entries=None, max_bytes=None)
+    cache.set("a", 1, ttl=1, tags=["t"])
+    cache.set("b", 2, ttl=1, tags=["t"])
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 5)
+    assert cache.get("a") is None
+    assert cache.sweep() == 1
+    assert index_sizes(cache) == (0, 0, 0)
+    assert cache.stats()["bytes"] == 0
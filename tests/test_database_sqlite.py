@@ -0,0 +1,170 @@
+"""
+Tests of the MongoDB query translation of the SQLite document database.
+
+Each query is run on a small collection, and the matched documents are compared with the ones MongoDB returns.
+Run them from the project directory with `python -m pytest tests`.
+"""
+import re
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from core.utils.database_sqlite import SQLiteDatabase
+
+
+DOCUMENTS = [
+    {"_id": "a", "name": "alpha", "n": 5, "tags": ["x", "y"], "meta": {"created": datetime(2020, 1, 1), "score": 1.5}, "active": True},
+    {"_id": "b", "name": "beta", "n": "zz", "tags": ["y"], "meta": {"created": datetime(2021, 6, 1)}, "active": False},
+    {"_id": "c", "name": "gamma", "n": 7, "tags": [], "meta": {"score": 3}, "active": None},
+    {"_id": "d", "name": "Delta", "n": None, "items": [{"sku": "s1", "qty": 2}, {"sku": "s2", "qty": 9}]},
+]
+
+
+@pytest.fixture
+def collection(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / "test.db"))
+    collection = database["things"]
+    collection.insert_many([dict(document) for document in DOCUMENTS])
+    yield collection
+    database.close()
+
+
+def ids(collection, query, **kwargs) -> list:
+    return sorted(document["_id"] for document in collection.find(query, **kwargs))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({}, ["a", "b", "c", "d"]),
+    ({"name": "alpha"}, ["a"]),
+    ({"_id": "b"}, ["b"]),
+    ({"meta.score": 3}, ["c"]),
+    ({"tags.0": "y"}, ["b"]),
+    ({"n": None}, ["d"]),
+    ({"active": True}, ["a"]),
+    ({"n": {"$eq": 5}}, ["a"]),
+    ({"n": {"$ne": 5}}, ["b", "c", "d"]),
+    ({"n": {"$ne": None}}, ["a", "b", "c"]),
+    ({"name": {"$in": ["alpha", "gamma", "omega"]}}, ["a", "c"]),
+    ({"n": {"$in": [None, 7]}}, ["c", "d"]),
+    ({"name": {"$nin": ["alpha", "beta"]}}, ["c", "d"]),
+    ({"_id": {"$in": ["a", "d"]}}, ["a", "d"]),
+    ({"items": {"$exists": True}}, ["d"]),
+    ({"meta.created": {"$exists": False}}, ["c", "d"]),
+    ({"name": {"$regex": "^[ab]"}}, ["a", "b"]),
+    ({"name": {"$regex": "^d", "$options": "i"}}, ["d"]),
+    ({"name": re.compile("MMA$", re.I)}, ["c"]),
+    ({"name": {"$not": {"$regex": "a$"}}}, []),
+    ({"n": {"$not": {"$gt": 5}}}, ["a", "b", "d"]),
+    ({"tags": {"$size": 1}}, ["b"]),
+    ({"n": {"$type": "number"}}, ["a", "c"]),
+    ({"n": {"$type": ["string", "null"]}}, ["b", "d"]),
+    ({"meta": {"$type": "object"}}, ["a", "b", "c"]),
+    ({"meta.created": {"$type": "date"}}, ["a", "b"]),
+    ({"active": {"$type": "bool"}}, ["a", "b"]),
+    ({"tags": {"$all": ["x", "y"]}}, ["a"]),
+    ({"items": {"$elemMatch": {"sku": "s2", "qty": {"$gte": 5}}}}, ["d"]),
+    ({"items": {"$elemMatch": {"sku": "s1", "qty": {"$gte": 5}}}}, []),
+    ({"$and": [{"n": {"$gte": 5}}, {"n": {"$lt": 7}}]}, ["a"]),
+    ({"$or": [{"name": "beta"}, {"meta.score": {"$gt": 2}}]}, ["b", "c"]),
+    ({"$nor": [{"name": "beta"}, {"n": 5}]}, ["c", "d"]),
+    ({"name": "alpha", "$comment": "ignored"}, ["a"]),
+])
+def test_find(collection, query, expected):
+    assert ids(collection, query) == expected
+    assert collection.count_documents(query) == len(expected)
+
+
+@pytest.mark.parametrize("query, expected", [
+    # Numbers only match numbers, whatever the stored type of the other documents
+    ({"n": {"$gt": 3}}, ["a", "c"]),
+    ({"n": {"$lte": 7}}, ["a", "c"]),
+    ({"meta.score": {"$gte": 1}}, ["a", "c"]),
+    # Strings only match strings
+    ({"n": {"$gt": "a"}}, ["b"]),
+    ({"name": {"$lt": "c"}}, ["a", "b", "d"]),
+    # Booleans only match booleans
+    ({"active": {"$gte": False}}, ["a", "b"]),
+    # Datetimes only match datetimes, compared in UTC
+    ({"meta.created": {"$gt": datetime(2020, 6, 1)}}, ["b"]),
+    ({"meta.created": {"$lt": datetime(2021, 6, 1, 2, tzinfo=timezone.utc)}}, ["a", "b"]),
+    # Null never compares
+    ({"n": {"$gt": None}}, []),
+    ({"items": {"$elemMatch": {"$gt": 1}}}, []),
+])
+def test_comparison_type_bracketing(collection, query, expected):
+    assert ids(collection, query) == expected
+
+
+def test_comparison_of_array_elements(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / "test.db"))
+    collection = database["scores"]
+    collection.insert_many([{"_id": "a", "values": [1, "zz", 9]}, {"_id": "b", "values": ["zz"]}])
+    assert ids(collection, {"values": {"$elemMatch": {"$gt": 5}}}) == ["a"]
+    assert ids(collection, {"values": {"$elemMatch": {"$gt": "a"}}}) == ["a", "b"]
+    database.close()
+
+
+def test_comparison_of_object_ids(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / "test.db"))
+    collection = database["refs"]
+    low, high = ObjectId("000000000000000000000001"), ObjectId("ffffffffffffffffffffffff")
+    collection.insert_many([{"_id": "a", "ref": low}, {"_id": "b", "ref": high}, {"_id": "c", "ref": "ffff"}])
+    assert ids(collection, {"ref": {"$gt": low}}) == ["b"]
+    assert ids(collection, {"ref": low}) == ["a"]
+    database.close()
+
+
+def test_sort_skip_limit(collection):
+    names = [document["name"] for document in collection.find({}, sort=[("name", 1)], skip=1, limit=2)]
+    assert names == ["alpha", "beta"]
+    names = [document["name"] for document in collection.find({}).sort("name", -1).limit(2)]
+    assert names == ["gamma", "beta"]
+    assert collection.count_documents({}, skip=1, limit=2) == 2
+
+
+def test_projection(collection):
+    assert collection.find_one({"_id": "a"}, {"name": 1, "meta.score": 1}) == {"_id": "a", "name": "alpha", "meta": {"score": 1.5}}
+    assert collection.find_one({"_id": "a"}, {"name": 1, "_id": 0}) == {"name": "alpha"}
+    document = collection.find_one({"_id": "a"}, {"tags": 0, "meta": 0})
+    assert "tags" not in document and "meta" not in document and document["name"] == "alpha"
+
+
+def test_text_search(collection):
+    with pytest.raises(OperationFailure):
+        list(collection.find({"$text": {"$search": "alpha"}}))
+    collection.create_index([("name", "text")])
+    assert ids(collection, {"$text": {"$search": "alpha gamma"}}) == ["a", "c"]
+    assert ids(collection, {"$text": {"$search": "ta -beta"}}) == ["d"]
+    assert ids(collection, {"$text": {"$search": '"al%"'}}) == []
+
+
+@pytest.mark.parametrize("query", [
+    {"$where": "this.n > 1"},
+    {"n": {"$mod": [2, 0]}},
+    {"n": {"$type": "decimal"}},
+    {"$or": []},
+    {'na"me': 1},
+])
+def test_unsupported_queries(collection, query):
+    with pytest.raises(OperationFailure):
+        list(collection.find(query))
+
+
+def test_updates(collection):
+    collection.update_one({"_id": "a"}, {"$set": {"meta.score": 2}, "$inc": {"n": 1}, "$push": {"tags": "z"}, "$unset": {"active": ""}})
+    document = collection.find_one({"_id": "a"})
+    assert document["meta"] == {"created": datetime(2020, 1, 1, tzinfo=timezone.utc), "score": 2}
+    assert document["n"] == 6 and document["tags"] == ["x", "y", "z"] and "active" not in document
+    result = collection.update_many({"n": {"$gt": 5}}, {"$set": {"big": True}})
+    assert result.matched_count == 2
+    assert ids(collection, {"big": True}) == ["a", "c"]
+
+
+def test_unique_index(collection):
+    collection.create_index("name", unique=True)
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"name": "alpha"})
+    with pytest.raises(DuplicateKeyError):
+        collection.update_one({"_id": "b"}, {"$set": {"name": "alpha"}})
@@ -0,0 +1,69 @@
+"""
+Tests of the helpers of the CRUD endpoints (core.utils.endpoints).
+"""
+import base64
+from datetime import datetime
+
+import pytest
+from bson import Decimal128, ObjectId, encode
+
+from core.utils.endpoints import _apply_projection, _decode_cursor, _encode_cursor, _projection, _sort_key
+
+
+@pytest.mark.parametrize("include, keep, expected", [
+    ({"name"}, [], {"name": 1}),
+    ({"id", "name"}, [], {"_id": 1, "name": 1}),
+    ({"name"}, ["meta.created"], {"name": 1, "meta.created": 1}),
+    # The sort field is the parent of an included field, or inside one: only the parent is projected
+    ({"meta.created"}, ["meta"], {"meta": 1}),
+    ({"meta"}, ["meta.created"], {"meta": 1}),
+    ({"meta", "meta.created", "name"}, [], {"meta": 1, "name": 1}),
+    # Sibling paths do not collide
+    ({"meta.created"}, ["meta.rank"], {"meta.created": 1, "meta.rank": 1}),
+    ({"metadata"}, ["meta"], {"metadata": 1, "meta": 1}),
+])
+def test_projection_include(include, keep, expected):
+    assert _projection(include, None, keep) == expected
+
+
+@pytest.mark.parametrize("exclude, keep, expected", [
+    ({"name"}, [], {"name": 0}),
+    ({"id", "name"}, [], {"name": 0}),
+    ({"name"}, ["name"], None),
+    # Fields overlapping the sort field are needed for the cursor
+    ({"meta", "name"}, ["meta.created"], {"name": 0}),
+    ({"meta.created", "name"}, ["meta"], {"name": 0}),
+    ({"metadata"}, ["meta"], {"metadata": 0}),
+])
+def test_projection_exclude(exclude, keep, expected):
+    assert _projection(None, exclude, keep) == expected
+
+
+def test_apply_projection_dotted_include():
+    doc = {"_id": "a", "name": "alpha", "meta": {"created": 1, "rank": 2}, "other": 3}
+    assert _apply_projection(doc, _projection({"meta.created"}, None, ["meta"])) == {"_id": "a", "meta": {"created": 1, "rank": 2}}
+    assert _apply_projection(doc, _projection(None, {"other"}, ["meta"])) == {"_id": "a", "name": "alpha", "meta": {"created": 1, "rank": 2}}
+
+
+def test_sort_key_mixed_types():
+    values = [5, "zz", None, datetime(2020, 1, 1), True, {"a": 1}, [1], ObjectId("000000000000000000000001"), 2.5, "aa"]
+    docs = sorted(({"n": value} for value in values), key=_sort_key("n"))
+    expected = [None, 2.5, 5, "aa", "zz", {"a": 1}, [1], ObjectId("000000000000000000000001"), True, datetime(2020, 1, 1)]
+    assert [doc["n"] for doc in docs] == expected
+
+
+def test_cursor_round_trip():
+    cursor = _encode_cursor({"_id": "x", "n": {"a": [1, None]}}, "n", 1)
+    assert _decode_cursor(cursor, "n", 1) == {"f": "n", "d": 1, "v": {"a": [1, None]}, "i": "x"}
+    with pytest.raises(ValueError):
+        _decode_cursor(cursor, "n", -1)
+
+
+@pytest.mark.parametrize("after", [
+    {"f": "n", "d": 1, "v": Decimal128("1"), "i": "x"},
+    {"f": "n", "d": 1, "i": "x"},
+    {"f": "n", "d": 1, "v": 1, "i": 3},
+])
+def test_tampered_cursor(after):
+    with pytest.raises(ValueError):
+        _decode_cursor(base64.urlsafe_b64encode(encode(after)).decode(), "n", 1)